@@ -1,8 +1,9 @@
+const cluster = require('cluster');
 const http = require('http');
 const https = require('https');
 const WebSocket = require('ws');
-const websocketHandler = require('./routes/websocket');
-const serverInfoHandler = require('./utils/serverInfoHandler');
+const configStore = require('./utils/configStore');
+const logger = require('./utils/logger');
 const fs = require('fs');
 const path = require('path');
 
@@ -21,6 +22,8 @@ const defaultSettings = {
   motd: "Welcome to the chat! Be respectful and have fun.",
   heartbeatInterval: 30000, //client must ping within this interval (seconds)
   heartbeatTimeout: 120000, //server disconnects if no ping received within this time (seconds)
+  maxPayloadBytes: 65536, //frames larger than this are refused before they are read
+  maxParseFailures: 10, //malformed frames a client may send before it is disconnected
 
   wss: {
     enabled: false,
@@ -38,11 +41,101 @@ const defaultSettings = {
     allowScreenShare: false, //allow screen sharing
     forceRelay: true, //force all traffic through TURN; prevents ip leaks to other callers
   },
+  reconnectGuard: {
+    enabled: true,
+    windowMs: 120000, //window for counting connection attempts from one ip
+    maxAttempts: 3, //attempts allowed within {windowMs} before the ip is refused
+  },
   churnGuard: {
     enabled: true,
     windowMs: 300000,
     maxCycles: 5,
     blockDurationMs: 600000,
+    maxEntries: 10000, //most ips tracked at once; oldest idle ones are dropped first
+  },
+  loginLimiter: {
+    maxEntries: 10000, //most ip:username login bans tracked at once
+  },
+  auth: {
+    hashWorkers: 2, //threads dedicated to bcrypt, separate from libuv's pool
+    maxHashQueue: 32, //logins waiting for a hash thread before new ones are refused
+    sessionResumeTtlMs: 600000, //how long a session token can be used with /resume
+  },
+  persistence: {
+    batchSize: 200, //write buffered messages once this many are waiting
+    flushIntervalMs: 250, //...or after this many ms, whichever comes first
+    maxPending: 5000, //reject new chat messages while this many are still unwritten
+    maxRetries: 3, //a batch that still can't be written after this many retries is dropped
+  },
+  logging: {
+    level: 'info', //debug, info, warn or error
+    format: 'json', //'json' lines, or 'text' for reading in a terminal
+    file: '', //append logs to this file instead of stdout
+    maxQueuedBytes: 4194304, //drop (and count) new log lines while this much output is still unwritten
+    sampleRates: { 'heartbeat-timeout': 1 }, //log 1 in N of these high-frequency events
+  },
+  backpressure: {
+    highWaterMark: 1048576, //bytes waiting to be sent before a client counts as slow
+    lowWaterMark: 262144, //...and below this it has caught up
+    maxBufferedBytes: 8388608, //hard cap per client for the 'degrade' and 'disconnect' actions
+    slowConsumerMs: 15000, //how long a client may stay slow under the 'disconnect' action
+    action: 'degrade', //'drop' skips chat for slow clients, 'degrade' only sheds typing, 'disconnect' kicks them
+    droppable: ['typing'], //frame types that are coalesced (latest per sender) rather than queued
+  },
+  rooms: {
+    enabled: true, //let users move between rooms with /join #room and /part
+    maxRooms: 1000, //most rooms with members on one server process; joining a new room past this is refused
+    switchCooldownMs: 3000, //how often a user can /join or /part
+  },
+  blocks: {
+    durationMs: 43200000, //how long a /block lasts (12 hours)
+    maxPerUser: 100, //most users one person can have blocked at once
+  },
+  presence: {
+    enabled: true, //push presence-snapshot and presence-delta messages so clients don't have to poll /list
+    batchMs: 100, //joins, leaves and renames within this many ms go out as one message
+  },
+  typing: {
+    intervalMs: 500, //typing indicators are sent to a room at most this often, batched
+    refreshMs: 4000, //an unchanged list of who is typing is resent this often
+    expireMs: 6000, //a user stops counting as typing this long after their last typing message
+  },
+  metrics: {
+    enabled: true, //prometheus metrics at /metrics
+    token: '', //if set, scrapers must send 'Authorization: Bearer <token>'; the same header shows slow clients and room names on /server-info
+    idleMs: 300000, //timings, event loop and gc observers stop this long after the last scrape
+  },
+  retention: {
+    enabled: false, //background pruning, archival and vacuum of chat.db
+    intervalMs: 3600000, //how often the retention job runs
+    maxAgeDays: 0, //delete messages older than this many days (0 = keep forever)
+    maxRows: 0, //keep at most this many messages (0 = no limit)
+    joinLeaveMaxAgeDays: 0, //compact join/leave messages older than this many days (0 = never)
+    joinLeave: 'rollup', //'rollup' replaces them with one summary line per day, 'drop' deletes them
+    archive: true, //save deleted messages as gzip json-lines files before deleting them
+    archiveDir: 'archive', //where archive segments go, relative to the server folder
+    batchSize: 2000, //messages deleted per transaction
+    vacuumPages: 2000, //most free pages returned to the filesystem per run
+  },
+  search: {
+    enabled: true, //full-text search with /search and search-request
+    timeBudgetMs: 250, //searches running longer than this are cancelled
+    pageSize: 10, //results per page
+    maxResults: 200, //how deep into the results anyone can page
+    maxQueued: 16, //searches waiting to run before new ones are refused
+  },
+  compression: {
+    enabled: true, //permessage-deflate for clients that offer it; clients can opt out with ?compress=off
+    threshold: 1024, //frames smaller than this (bytes) are never compressed
+    level: 6, //zlib level 1-9
+    memLevel: 4, //zlib memory per compressor 1-9
+    windowBits: 10, //zlib window size 9-15; smaller uses less memory per connection
+    concurrency: 4, //compression jobs run at once across all connections
+    maxClients: 1000, //most connections that get compression; the rest connect uncompressed
+  },
+  cluster: {
+    enabled: false, //run one server process per worker, all sharing {port}
+    workers: 0, //number of worker processes; 0 uses one per cpu core
   }
 };
 
@@ -56,18 +149,61 @@ const defaultSettings = {
 
 if (!fs.existsSync(settingsPath)) {
   fs.writeFileSync(settingsPath, JSON.stringify(defaultSettings, null, 2));
-  console.log('Settings file created with default settings.');
+  logger.info('Settings file created with default settings');
 }
 
-const settings = JSON.parse(fs.readFileSync(settingsPath));
-
 const adminsPath = path.join(__dirname, 'admins.json');
 if (!fs.existsSync(adminsPath)) {
   const defaultAdmin = "admin";
   fs.writeFileSync(adminsPath, JSON.stringify([defaultAdmin], null, 2));
-  console.log(`Default admin is being created with username: "${defaultAdmin}"`);
-  console.warn(`CHANGE THIS CHANGE THIS CHANGE THIS!`);
-  console.warn(`ANYONE WITH THE USERNAME "ADMIN" HAS FULL CONTROL OF MODERATION COMMANDS!`);
+  logger.info(`Default admin is being created with username: "${defaultAdmin}"`);
+  logger.warn(`CHANGE THIS CHANGE THIS CHANGE THIS!`);
+  logger.warn(`ANYONE WITH THE USERNAME "ADMIN" HAS FULL CONTROL OF MODERATION COMMANDS!`);
+}
+
+// settings, bans and admins are read once here and then kept up to date
+// by a file watcher, so accepting a connection never touches the disk
+configStore.load();
+const settings = configStore.settings;
+logger.configure(settings.logging);
+
+// in cluster mode this process only supervises the workers; each worker
+// runs the rest of this file. per-ip limits and guards apply per worker
+if (cluster.isPrimary && settings.cluster && settings.cluster.enabled) {
+  require('./utils/clusterPrimary')(settings);
+  return;
+}
+
+configStore.watch();
+
+const websocketHandler = require('./routes/websocket');
+const serverInfoHandler = require('./utils/serverInfoHandler');
+const metricsHandler = require('./utils/metricsHandler');
+const wireCodec = require('./utils/wireCodec');
+const compression = require('./utils/compression');
+
+const chatDb = require('./utils/db');
+chatDb.configure(settings.persistence);
+// the handlers assume the current schema; don't serve anyone without it
+chatDb.ready().catch((err) => {
+  logger.error('Chat database could not be migrated, stopping', { err });
+  process.exit(1);
+});
+require('./utils/search').configure(settings.search);
+require('./utils/metrics').configure(settings.metrics);
+require('./utils/backpressure').configure(settings.backpressure);
+require('./utils/rooms').configure(settings.rooms);
+require('./utils/typing').configure(settings.typing);
+require('./utils/blocks').configure(settings.blocks);
+require('./utils/presence').configure(settings.presence);
+require('./utils/retention').start(settings.retention);
+
+if (settings.auth) {
+  require('./utils/hashPool').configure({
+    workers: settings.auth.hashWorkers,
+    maxQueue: settings.auth.maxHashQueue,
+  });
+  require('./utils/sessionCache').configure({ ttlMs: settings.auth.sessionResumeTtlMs });
 }
 
 /*
@@ -82,9 +218,7 @@ if (settings.wss && settings.wss.enabled) {
   const certPath = path.join(__dirname, settings.wss.cert);
 
   if (!fs.existsSync(keyPath) || !fs.existsSync(certPath)) {
-    console.error("WSS is enabled but certificate files were not found.");
-    console.error(`Expected key: ${keyPath}`);
-    console.error(`Expected cert: ${certPath}`);
+    logger.error('WSS is enabled but certificate files were not found', { keyPath, certPath });
     process.exit(1);
   }
 
@@ -94,22 +228,33 @@ if (settings.wss && settings.wss.enabled) {
   };
 
   server = https.createServer(httpsOptions);
-  console.log("Starting server with TLS (WSS enabled)");
+  logger.info('Starting server with TLS (WSS enabled)');
 } else {
   server = http.createServer();
-  console.log("Starting server without TLS (WS)");
+  logger.info('Starting server without TLS (WS)');
 }
 
+// compression options are read once; changing them needs a restart
+compression.configure(settings.compression);
+
 const wss = new WebSocket.Server({
   noServer: true,
-  perMessageDeflate: false  // Disable deflate to avoid RSV issues
+  maxPayload: settings.maxPayloadBytes || 65536,
+  // prefer the compact subprotocol, otherwise keep ws's default of the first offered
+  handleProtocols: (protocols) => (
+    protocols.has(wireCodec.SUBPROTOCOL) ? wireCodec.SUBPROTOCOL : protocols.values().next().value
+  ),
+  perMessageDeflate: compression.serverOptions(),
 });
 
 const initWebRTC = require('./handlers/webrtcHandler');
 initWebRTC(wss, settings);
 
+require('./handlers/clusterRelay')(wss, settings);
+require('./utils/presence').init(wss, settings);
+
 server.on('request', (req, res) => {
-  if (!serverInfoHandler(req, res, wss, settings)) {
+  if (!serverInfoHandler(req, res, wss, settings) && !metricsHandler(req, res, wss, settings)) {
     res.writeHead(404);
     res.end();
   }
@@ -121,6 +266,8 @@ server.on('upgrade', (request, socket, head) => {
     return;
   }
 
+  compression.admit(request);
+
   wss.handleUpgrade(request, socket, head, (ws) => {
     wss.emit('connection', ws, request);
   });
@@ -128,7 +275,7 @@ server.on('upgrade', (request, socket, head) => {
 
 wss.on('connection', (socket, req) => {
   socket.on('error', (err) => {
-    console.error('WebSocket client error:', err);
+    logger.error('WebSocket client error', { err });
   });
 
   websocketHandler(socket, req, wss, settings);
@@ -138,27 +285,25 @@ const PORT = settings.port || 3000;
 
 server.listen(PORT, () => {
   const protocol = (settings.wss && settings.wss.enabled) ? "wss" : "ws";
-  console.log(`Server running on ${protocol}://localhost:${PORT}`);
+  logger.info(`Server running on ${protocol}://localhost:${PORT}`);
 });
 
 const shutdown = () => {
-  console.log('Shutting down server...');
+  logger.info('Shutting down server');
 
   wss.clients.forEach((client) => {
     if (client.readyState === WebSocket.OPEN && client.username) {
       const leaveText = `${client.username} has left. (Server Shutdown)`;
-      const leaveMsg = { type: 'system', text: leaveText };
+      const leaveMsg = { type: 'system', room: client.room, text: leaveText };
 
       client.send(JSON.stringify(leaveMsg));
-      console.log(leaveText);
 
       try {
-        const { saveMessage } = require('./utils/db');
-        saveMessage(leaveMsg);
+        chatDb.saveMessage(leaveMsg);
         const connectionLogger = require('./middleware/connectionLogger');
         connectionLogger('LEAVE', client.username);
       } catch (err) {
-        console.error('Error during shutdown logging:', err);
+        logger.error('Error during shutdown logging', { err });
       }
     }
 
@@ -167,13 +312,15 @@ const shutdown = () => {
 
   wss.close(() => {
     server.close(() => {
-      console.log('Server closed gracefully.');
-      process.exit(0);
+      chatDb.close().then(() => {
+        logger.info('Server closed gracefully');
+        process.exit(0);
+      });
     });
   });
 
   setTimeout(() => {
-    console.warn('Force exiting after timeout.');
+    logger.warn('Force exiting after timeout');
     process.exit(1);
   }, 5000);
 };
@@ -0,0 +1,47 @@
+const EventEmitter = require('events');
+
+const OPEN = 1;
+const CLOSED = 3;
+
+// just enough of a ws socket for the handlers: send() only counts what
+// would have gone on the wire
+class FakeSocket extends EventEmitter {
+  constructor({ ip = '127.0.0.1', username = null, encoding = 'json' } = {}) {
+    super();
+    this.readyState = OPEN;
+    this.OPEN = OPEN;
+    this._ip = ip;
+    this.username = username;
+    this.encoding = encoding;
+    this.authenticated = true;
+    this.sessionToken = 'bench-token';
+    this.blockerKey = `ip:${ip}`;
+    this.sent = 0;
+    this.bytes = 0;
+  }
+
+  send(data) {
+    this.sent++;
+    this.bytes += data.length;
+  }
+
+  close() {
+    if (this.readyState === CLOSED) return;
+    this.readyState = CLOSED;
+    this.emit('close');
+  }
+}
+
+class FakeServer {
+  constructor(clients = []) {
+    this.clients = new Set(clients);
+  }
+}
+
+const sockets = (count, options = {}) => Array.from({ length: count }, (_, i) => new FakeSocket({
+  ip: `10.0.${(i >> 8) & 255}.${i & 255}`,
+  username: `user${i}`,
+  ...options,
+}));
+
+module.exports = { FakeSocket, FakeServer, sockets };
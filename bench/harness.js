@@ -0,0 +1,78 @@
+// timing for one benchmark: warm up, then take several samples of a batch
+// of calls each and report the median, so a stray gc or timer doesn't
+// decide the result. a benchmark is
+//   { name, setup?, fn, teardown?, ops? }
+// fn may return a promise. ops is how many operations one call of fn
+// stands for (e.g. one fan-out to 1000 sockets is 1000 sends), so results
+// compare per operation.
+
+const DEFAULTS = {
+  warmupMs: 200,
+  sampleMs: 100,
+  samples: 15,
+};
+
+const now = () => process.hrtime.bigint();
+
+async function timeBatch(fn, iterations) {
+  const started = now();
+  for (let i = 0; i < iterations; i++) {
+    const result = fn();
+    if (result && typeof result.then === 'function') await result;
+  }
+  return Number(now() - started);
+}
+
+// grow the batch until one takes about sampleMs
+async function calibrate(fn, sampleMs) {
+  let iterations = 1;
+  for (;;) {
+    const elapsedNs = await timeBatch(fn, iterations);
+    if (elapsedNs >= sampleMs * 1e6 || iterations >= 1e8) {
+      return Math.max(1, Math.round(iterations * (sampleMs * 1e6) / Math.max(elapsedNs, 1)));
+    }
+    iterations *= elapsedNs < sampleMs * 1e5 ? 10 : 2;
+  }
+}
+
+const median = (values) => {
+  const sorted = [...values].sort((a, b) => a - b);
+  const mid = sorted.length >> 1;
+  return sorted.length % 2 ? sorted[mid] : (sorted[mid - 1] + sorted[mid]) / 2;
+};
+
+/**
+ * Run one benchmark.
+ * @returns {Promise<{name: string, opsPerSec: number, nsPerOp: number, spread: number, samples: number}>}
+ *   spread is (slowest - fastest) / median sample, as a fraction
+ */
+async function run(bench, options = {}) {
+  const opts = { ...DEFAULTS, ...options };
+  const ops = bench.ops || 1;
+  const context = bench.setup ? await bench.setup() : undefined;
+  const fn = () => bench.fn(context);
+
+  try {
+    const warmupEnd = Date.now() + opts.warmupMs;
+    while (Date.now() < warmupEnd) await timeBatch(fn, 1);
+
+    const iterations = await calibrate(fn, opts.sampleMs);
+    const perOp = [];
+    for (let i = 0; i < opts.samples; i++) {
+      perOp.push((await timeBatch(fn, iterations)) / (iterations * ops));
+    }
+
+    const nsPerOp = median(perOp);
+    return {
+      name: bench.name,
+      opsPerSec: Math.round(1e9 / nsPerOp),
+      nsPerOp: Math.round(nsPerOp * 100) / 100,
+      spread: Math.round(((Math.max(...perOp) - Math.min(...perOp)) / nsPerOp) * 1000) / 1000,
+      samples: opts.samples,
+    };
+  } finally {
+    if (bench.teardown) await bench.teardown(context);
+  }
+}
+
+module.exports = { run };
@@ -0,0 +1,154 @@
+#!/usr/bin/env node
+// micro-benchmarks for the server's hot paths, against fake sockets and a
+// throwaway database.
+//
+//   npm run bench
+//   npm run bench -- --filter broadcast
+//   npm run bench -- --json results.json
+//   npm run bench -- --save-baseline            (writes bench/baseline.json)
+//   npm run bench -- --baseline bench/baseline.json --threshold 0.15
+//
+// with a baseline, any benchmark more than --threshold slower than its
+// baseline entry is reported as a regression and the exit code is 1.
+// baselines are only comparable on the same machine and node version.
+
+const fs = require('fs');
+const os = require('os');
+const path = require('path');
+
+const DEFAULT_BASELINE = path.join(__dirname, 'baseline.json');
+
+function parseArgs(argv) {
+  const args = { threshold: 0.2 };
+  for (let i = 0; i < argv.length; i++) {
+    switch (argv[i]) {
+      case '--filter': args.filter = new RegExp(argv[++i], 'i'); break;
+      case '--json': args.json = argv[++i]; break;
+      case '--baseline': args.baseline = argv[++i]; break;
+      case '--save-baseline': args.saveBaseline = argv[i + 1] && !argv[i + 1].startsWith('--') ? argv[++i] : DEFAULT_BASELINE; break;
+      case '--threshold': args.threshold = Number(argv[++i]); break;
+      case '--quick': args.quick = true; break;
+      default:
+        console.error(`Unknown option ${argv[i]}`);
+        process.exit(2);
+    }
+  }
+  return args;
+}
+
+const args = parseArgs(process.argv.slice(2));
+
+// before anything opens chat.db
+const tmpDb = path.join(os.tmpdir(), `chat-bench-${process.pid}.db`);
+if (!process.env.CHAT_DB_PATH) process.env.CHAT_DB_PATH = tmpDb;
+
+require('../utils/logger').configure({ level: 'warn' });
+const harness = require('./harness');
+
+// --filter picks suites by file name, or failing that single benchmarks by
+// name. suites are only loaded when they can match, so e.g. the broadcast
+// suite runs without sqlite3 installed
+function loadSuites() {
+  const dir = path.join(__dirname, 'suites');
+  const files = fs.readdirSync(dir).filter((f) => f.endsWith('.js')).sort();
+  const load = (file) => require(path.join(dir, file));
+
+  if (!args.filter) return files.flatMap(load);
+
+  const suites = files.filter((f) => args.filter.test(path.basename(f, '.js')));
+  if (suites.length) return suites.flatMap(load);
+
+  return files.flatMap(load).filter((bench) => args.filter.test(bench.name));
+}
+
+function compare(results, baseline) {
+  const byName = new Map(baseline.results.map((r) => [r.name, r]));
+  let regressions = 0;
+
+  for (const result of results) {
+    const before = byName.get(result.name);
+    if (!before) continue;
+
+    result.change = Math.round(((result.opsPerSec - before.opsPerSec) / before.opsPerSec) * 1000) / 1000;
+    result.regressed = result.change < -args.threshold;
+    if (result.regressed) regressions++;
+  }
+  return regressions;
+}
+
+function printTable(results) {
+  const width = Math.max(...results.map((r) => r.name.length), 10);
+  const hasBaseline = results.some((r) => r.change !== undefined);
+
+  console.log(`${'benchmark'.padEnd(width)}  ${'ops/s'.padStart(12)}  ${'ns/op'.padStart(10)}  ${'spread'.padStart(7)}${hasBaseline ? '  vs baseline' : ''}`);
+  for (const r of results) {
+    const change = r.change === undefined
+      ? ''
+      : `  ${(r.change >= 0 ? '+' : '') + (r.change * 100).toFixed(1)}%${r.regressed ? '  REGRESSION' : ''}`;
+    console.log(
+      `${r.name.padEnd(width)}  ${r.opsPerSec.toLocaleString('en-US').padStart(12)}  ` +
+      `${String(r.nsPerOp).padStart(10)}  ${`${(r.spread * 100).toFixed(0)}%`.padStart(7)}${change}`
+    );
+  }
+}
+
+async function cleanup() {
+  const dbModule = require.resolve('../utils/db');
+  if (require.cache[dbModule]) await require(dbModule).close();
+
+  if (process.env.CHAT_DB_PATH === tmpDb) {
+    for (const suffix of ['', '-wal', '-shm']) fs.rmSync(tmpDb + suffix, { force: true });
+  }
+}
+
+async function main() {
+  const benches = loadSuites();
+  if (!benches.length) {
+    console.error('No benchmarks matched.');
+    process.exit(2);
+  }
+
+  const options = args.quick ? { warmupMs: 50, sampleMs: 25, samples: 5 } : {};
+  const results = [];
+  for (const bench of benches) {
+    process.stderr.write(`running ${bench.name}...\n`);
+    results.push(await harness.run(bench, options));
+  }
+
+  let regressions = 0;
+  const baselinePath = args.baseline || (fs.existsSync(DEFAULT_BASELINE) && !args.saveBaseline ? DEFAULT_BASELINE : null);
+  if (baselinePath) regressions = compare(results, JSON.parse(fs.readFileSync(baselinePath, 'utf8')));
+
+  printTable(results);
+
+  const report = {
+    date: new Date().toISOString(),
+    node: process.version,
+    platform: `${os.platform()} ${os.arch()}`,
+    cpu: os.cpus()[0] ? os.cpus()[0].model : 'unknown',
+    baseline: baselinePath || undefined,
+    results,
+  };
+
+  if (args.json) fs.writeFileSync(args.json, JSON.stringify(report, null, 2));
+
+  if (args.saveBaseline) {
+    const { baseline, ...rest } = report;
+    fs.writeFileSync(args.saveBaseline, JSON.stringify({
+      ...rest,
+      results: results.map(({ name, opsPerSec, nsPerOp }) => ({ name, opsPerSec, nsPerOp })),
+    }, null, 2));
+    console.log(`\nBaseline saved to ${args.saveBaseline}`);
+  }
+
+  if (regressions) console.log(`\n${regressions} benchmark(s) regressed by more than ${args.threshold * 100}%.`);
+
+  await cleanup();
+  process.exit(regressions ? 1 : 0);
+}
+
+main().catch(async (err) => {
+  console.error(err);
+  await cleanup().catch(() => {});
+  process.exit(1);
+});
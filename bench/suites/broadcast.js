@@ -0,0 +1,66 @@
+const broadcast = require('../../handlers/broadcast');
+const rooms = require('../../utils/rooms');
+const blocks = require('../../utils/blocks');
+const { FakeServer, sockets } = require('../fakes');
+
+const chat = (i, room) => ({
+  type: 'chat',
+  room,
+  username: 'bench',
+  text: `message ${i} with a bit of text in it`,
+  timestamp: new Date().toISOString(),
+  senderIp: '10.9.9.9',
+});
+
+const fanOut = (count, options = {}) => ({
+  name: `broadcast: chat to ${count} ${options.encoding || 'json'} clients`,
+  setup: () => {
+    const wss = new FakeServer(sockets(count, options));
+    return { wss, i: 0 };
+  },
+  fn: (ctx) => broadcast(ctx.wss, chat(ctx.i++), {}),
+});
+
+module.exports = [
+  fanOut(10),
+  fanOut(100),
+  fanOut(1000),
+  fanOut(1000, { encoding: 'compact' }),
+
+  // only the room's members are visited, however many others are connected
+  {
+    name: 'broadcast: chat to a 100 member room among 10000 clients',
+    setup: () => {
+      const all = sockets(10000);
+      all.slice(0, 100).forEach((socket) => rooms.join(socket, 'bench'));
+      return { wss: new FakeServer(all), members: all.slice(0, 100), i: 0 };
+    },
+    fn: (ctx) => broadcast(ctx.wss, chat(ctx.i++, 'bench'), {}),
+    teardown: (ctx) => ctx.members.forEach((socket) => rooms.leave(socket)),
+  },
+
+  // the sender's blockers are found once per message, not per recipient
+  {
+    name: 'broadcast: chat to 1000 json clients, sender blocked by 10',
+    setup: () => {
+      const all = sockets(1000);
+      all.slice(0, 10).forEach((socket) => blocks.block(socket.blockerKey, '10.9.9.9', 'bench'));
+      return { wss: new FakeServer(all), blockers: all.slice(0, 10), i: 0 };
+    },
+    fn: (ctx) => broadcast(ctx.wss, chat(ctx.i++), {}),
+    teardown: (ctx) => ctx.blockers.forEach((socket) => blocks.unblock(socket.blockerKey, '10.9.9.9')),
+  },
+
+  // system messages skip the per-recipient block check
+  {
+    name: 'broadcast: system message to 1000 json clients',
+    setup: () => ({ wss: new FakeServer(sockets(1000)) }),
+    fn: (ctx) => broadcast(ctx.wss, { type: 'system', text: 'someone has joined.' }, {}),
+  },
+
+  {
+    name: 'broadcast: encode one chat frame',
+    setup: () => ({ i: 0 }),
+    fn: (ctx) => broadcast.encode(chat(ctx.i++)),
+  },
+];
@@ -0,0 +1,36 @@
+const connectionLimiter = require('../../handlers/connectionLimiter');
+const { FakeSocket, FakeServer } = require('../fakes');
+
+const settings = {
+  totalMaxConnections: 100000,
+  connectionWindowMs: 30000,
+  maxConnectionsPerWindow: 2,
+  maxTotalConnections: 4,
+};
+
+// connect and immediately drop, like a client stuck in a reconnect loop
+const cycle = (ctx, ip) => {
+  const socket = new FakeSocket({ ip });
+  if (connectionLimiter(ip, socket, ctx.wss, settings)) {
+    ctx.wss.clients.add(socket);
+    socket.close();
+    ctx.wss.clients.delete(socket);
+  }
+};
+
+module.exports = [
+  {
+    name: 'connectionLimiter: reconnect storm from one ip',
+    setup: () => ({ wss: new FakeServer() }),
+    fn: (ctx) => cycle(ctx, '10.1.1.1'),
+  },
+
+  {
+    name: 'connectionLimiter: reconnect storm over 100k ips',
+    setup: () => ({ wss: new FakeServer(), i: 0 }),
+    fn: (ctx) => {
+      const n = ctx.i++ % 100000;
+      cycle(ctx, `10.${n >> 16}.${(n >> 8) & 255}.${n & 255}`);
+    },
+  },
+];
@@ -0,0 +1,51 @@
+const db = require('../../utils/db');
+
+const TABLE_ROWS = 200000;
+const BATCH = 1000;
+
+const row = (i) => ({ type: 'chat', username: `user${i % 500}`, text: `benchmark message number ${i}` });
+
+// saveMessage refuses rows past persistence.maxPending, so fill in chunks
+async function fill(count) {
+  for (let done = 0; done < count; done += BATCH) {
+    for (let i = 0; i < Math.min(BATCH, count - done); i++) db.saveMessage(row(done + i));
+    await db.flush();
+  }
+}
+
+async function ensureRows(count) {
+  await db.ready();
+  const { messages } = await db.getHistoryPage({ limit: 1 });
+  const newest = messages.length ? messages[0].id : 0;
+  if (newest < count) await fill(count - newest);
+}
+
+module.exports = [
+  {
+    name: `db: saveMessage + flush, per row (batches of ${BATCH})`,
+    ops: BATCH,
+    setup: () => db.ready().then(() => ({ i: 0 })),
+    fn: async (ctx) => {
+      for (let i = 0; i < BATCH; i++) db.saveMessage(row(ctx.i++));
+      await db.flush();
+    },
+  },
+
+  {
+    name: `db: getRecentMessages(100) on ${TABLE_ROWS / 1000}k rows`,
+    setup: () => ensureRows(TABLE_ROWS),
+    fn: () => db.getRecentMessages(100),
+  },
+
+  {
+    name: `db: getHistoryPage 50 rows, mid-table cursor`,
+    setup: () => ensureRows(TABLE_ROWS),
+    fn: () => db.getHistoryPage({ beforeId: TABLE_ROWS / 2, limit: 50 }),
+  },
+
+  {
+    name: `db: getHistoryPage 50 rows of one user`,
+    setup: () => ensureRows(TABLE_ROWS),
+    fn: () => db.getHistoryPage({ beforeId: TABLE_ROWS / 2, limit: 50, username: 'user7' }),
+  },
+];
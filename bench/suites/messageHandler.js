@@ -0,0 +1,46 @@
+const inboundRouter = require('../../handlers/inboundRouter');
+const createHandlers = require('../../handlers/messageHandler');
+const broadcast = require('../../handlers/broadcast');
+const rooms = require('../../utils/rooms');
+const { FakeSocket, FakeServer, sockets } = require('../fakes');
+
+const settings = { maxMessagesPerSecond: 3 };
+const moderation = { isAdmin: () => false, isBanned: () => false };
+const noCommands = () => false;
+
+// one joined socket with the real router and handlers, among `peers`
+// others, all in a room of their own
+let nextRoom = 0;
+const joined = (peers) => {
+  const socket = new FakeSocket({ username: 'bench' });
+  const wss = new FakeServer([socket, ...sockets(peers)]);
+  const room = `bench-${nextRoom++}`;
+  wss.clients.forEach((client) => rooms.join(client, room));
+  const router = inboundRouter.attach(socket, settings);
+  createHandlers.install(router, createHandlers(socket, wss, broadcast, settings, moderation, noCommands));
+  return { socket, router };
+};
+
+const frame = (message) => Buffer.from(JSON.stringify({ token: 'bench-token', ...message }));
+
+module.exports = [
+  // past the first few, every message is turned away by the rate limit
+  {
+    name: 'messageHandler: parse + rate-limited chat',
+    setup: () => ({ ...joined(0), data: frame({ type: 'chat', content: 'spam spam spam' }) }),
+    fn: (ctx) => ctx.router.dispatch(ctx.data, false),
+  },
+
+  // only records state; the room hears about it in the next batch
+  {
+    name: 'messageHandler: parse + typing in a 100 client room',
+    setup: () => ({ ...joined(100), data: frame({ type: 'typing' }) }),
+    fn: (ctx) => ctx.router.dispatch(ctx.data, false),
+  },
+
+  {
+    name: 'messageHandler: wrongly shaped chat',
+    setup: () => ({ ...joined(0), data: frame({ type: 'chat', content: 42 }) }),
+    fn: (ctx) => ctx.router.dispatch(ctx.data, false),
+  },
+];
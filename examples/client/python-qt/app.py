@@ -3,14 +3,16 @@ import asyncio
 import json
 from datetime import datetime
 from urllib.parse import urlparse
-from PyQt6.QtWidgets import QApplication, QWidget, QMessageBox, QInputDialog, QCheckBox
-from PyQt6.QtCore import Qt, QTimer
+from PyQt6.QtWidgets import QApplication, QWidget, QMessageBox, QInputDialog, QCheckBox, QListWidgetItem
+from PyQt6.QtCore import QTimer
+from PyQt6.QtGui import QTextCursor
 from PyQt6 import uic
 import websockets
 import aiohttp
 from plyer import notification
 
 SERVERS_FILE = "servers.json"
+HISTORY_PAGE_SIZE = 50
 
 class ChatClient(QWidget):
     def __init__(self):
@@ -30,6 +32,9 @@ class ChatClient(QWidget):
         self.session_token = None
         self.heartbeat_interval = None
         self.ping_task = None
+        self.member_items = {}
+        self.reset_history_paging()
+        self.chat_display.verticalScrollBar().valueChanged.connect(self.on_chat_scrolled)
         self.msg_input.setEnabled(False)
         self.send_btn.setEnabled(False)
         self.msg_input.returnPressed.connect(self.send_message)
@@ -93,6 +98,7 @@ class ChatClient(QWidget):
             self.anonymous_name = None
         self.session_token = None
         self.heartbeat_interval = None
+        self.reset_history_paging()
         self.disconnect()
         self.keep_running = True
         self.msg_input.setEnabled(False)
@@ -167,28 +173,36 @@ class ChatClient(QWidget):
                     self.ping_task = asyncio.run_coroutine_threadsafe(self.ping_loop(self.websocket), self.event_loop)
                 return
 
+            if mtype == "history-page":
+                self.show_history_page(data)
+                return
+
             if mtype == "history":
+                # a full history starts paging over, in what may be a new room
+                self.reset_history_paging(data.get("room"))
+                self.track_history_cursor(data.get("messages", []))
                 for msg in data.get("messages", []):
-                    text = msg.get("text", "")
-                    if " is now " in text:
-                        continue
-                    if text.endswith("has joined.") or text.endswith("has left."):
-                        username = text.rsplit(' ', 2)[0].strip()
-                        if text.endswith("has joined."):
-                            self.add_member(username)
-                        else:
-                            self.remove_member(username)
-                        continue
                     if not msg.get("username"):
-                        self.append_chat(f"[System] {text}")
+                        self.append_chat(f"[System] {msg.get('text', '')}")
                     else:
                         self.display_message(msg)
                 self.append_chat("[Client] ##### History #####\n")
-                if self.websocket:
-                    payload = {"type": "chat", "content": "/list"}
-                    if self.session_token:
-                        payload["token"] = self.session_token
-                    asyncio.run_coroutine_threadsafe(self.websocket.send(json.dumps(payload)), self.event_loop)
+                return
+
+            if mtype == "presence-snapshot":
+                self.update_members(data.get("users", []))
+                return
+
+            if mtype == "presence-delta":
+                for change in data.get("changes", []):
+                    op = change.get("op")
+                    if op == "join":
+                        self.add_member(change.get("username"))
+                    elif op == "leave":
+                        self.remove_member(change.get("username"))
+                    elif op == "rename":
+                        self.remove_member(change.get("from"))
+                        self.add_member(change.get("username"))
                 return
 
             if mtype == "chat":
@@ -196,30 +210,7 @@ class ChatClient(QWidget):
                 return
 
             if mtype == "system":
-                text = data.get("text", "")
-                if text.startswith("Online users:"):
-                    members = [m.strip() for m in text[len("Online users:"):].split(",")]
-                    self.update_members(members)
-                    return
-                if text.endswith("has joined."):
-                    username = text[:-len("has joined.")].strip()
-                    self.add_member(username)
-                    return
-                if text.endswith("has left."):
-                    username = text[:-len("has left.")].strip()
-                    self.remove_member(username)
-                    return
-                if " is now " in text:
-                    old_name, new_name = map(str.strip, text.split(" is now ", 1))
-                    self.remove_member(old_name)
-                    self.add_member(new_name)
-                    if self.websocket:
-                        payload = {"type": "chat", "content": "/list"}
-                        if self.session_token:
-                            payload["token"] = self.session_token
-                        asyncio.run_coroutine_threadsafe(self.websocket.send(json.dumps(payload)), self.event_loop)
-                    return
-                self.append_chat(text)
+                self.append_chat(data.get("text", ""))
                 return
 
             self.append_chat(f"[Unknown message type] {raw_msg}")
@@ -227,26 +218,85 @@ class ChatClient(QWidget):
         except Exception as e:
             self.append_chat(f"[Error parsing message] {raw_msg} ({e})")
 
+    def reset_history_paging(self, room=None):
+        self.history_room = room
+        self.oldest_id = None
+        self.history_has_more = False
+        self.history_loading = False
+
+    def track_history_cursor(self, messages):
+        # the newest rows may not have an id yet, older ones always do
+        ids = [m["id"] for m in messages if m.get("id")]
+        if ids:
+            self.oldest_id = min(ids) if self.oldest_id is None else min(self.oldest_id, *ids)
+        self.history_has_more = bool(ids)
+
+    def on_chat_scrolled(self, value):
+        if value != self.chat_display.verticalScrollBar().minimum():
+            return
+        if self.history_loading or not self.history_has_more or self.oldest_id is None:
+            return
+        if not self.websocket or not self.session_token:
+            return
+        self.history_loading = True
+        payload = {
+            "type": "history-request",
+            "token": self.session_token,
+            "before_id": self.oldest_id,
+            "limit": HISTORY_PAGE_SIZE,
+        }
+        asyncio.run_coroutine_threadsafe(self.websocket.send(json.dumps(payload)), self.event_loop)
+
+    def show_history_page(self, data):
+        # asked for before a /join; its ids belong to the old room
+        if data.get("room") != self.history_room:
+            return
+        messages = data.get("messages", [])
+        self.history_loading = False
+        self.track_history_cursor(messages)
+        self.history_has_more = bool(data.get("has_more")) and bool(messages)
+        lines = []
+        for msg in messages:
+            if msg.get("username"):
+                lines.append(self.format_message(msg))
+            else:
+                lines.append(f"[System] {msg.get('text', '')}")
+        if not self.history_has_more:
+            lines.insert(0, "[Client] ##### Start of history #####")
+        if lines:
+            self.prepend_chat(lines)
+
+    def prepend_chat(self, lines):
+        # keep the view on what the user was reading while text lands above it
+        bar = self.chat_display.verticalScrollBar()
+        old_max = bar.maximum()
+        old_value = bar.value()
+        cursor = QTextCursor(self.chat_display.document())
+        cursor.movePosition(QTextCursor.MoveOperation.Start)
+        cursor.insertText("\n".join(lines) + "\n")
+        bar.setValue(old_value + bar.maximum() - old_max)
+
+    # presence changes can repeat what the snapshot already had, so adding
+    # someone listed or removing someone who isn't is a no-op
     def add_member(self, username):
-        if username and username not in self.get_members():
-            self.members_list.addItem(username)
-
-    def remove_member(self, username):
-        if not username:
+        if not username or username in self.member_items:
             return
-        items = self.members_list.findItems(username, Qt.MatchFlag.MatchExactly)
-        for item in items:
-            row = self.members_list.row(item)
-            self.members_list.takeItem(row)
+        item = QListWidgetItem(username)
+        self.members_list.addItem(item)
+        self.member_items[username] = item
 
-    def get_members(self):
-        return [self.members_list.item(i).text() for i in range(self.members_list.count())]
+    def remove_member(self, username):
+        item = self.member_items.pop(username, None)
+        if item is not None:
+            self.members_list.takeItem(self.members_list.row(item))
 
     def update_members(self, members):
         self.members_list.clear()
-        self.members_list.addItems(members)
+        self.member_items = {}
+        for username in members:
+            self.add_member(username)
 
-    def display_message(self, msg):
+    def format_message(self, msg):
         username = msg.get("username", "Unknown")
         text = msg.get("text", "")
         timestamp = msg.get("timestamp")
@@ -255,7 +305,12 @@ class ChatClient(QWidget):
         except:
             dt = datetime.now()
         time_str = dt.strftime("%H:%M:%S")
-        self.append_chat(f"[{time_str}] <{username}> {text}")
+        return f"[{time_str}] <{username}> {text}"
+
+    def display_message(self, msg):
+        username = msg.get("username", "Unknown")
+        text = msg.get("text", "")
+        self.append_chat(self.format_message(msg))
         if not self.isActiveWindow() and self.websocket and self.username:
             if any(name.lower() in text.lower() for name in self.nicknames):
                 self.show_notification(f"Mentioned by {username}", text)
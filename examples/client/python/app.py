@@ -1,5 +1,6 @@
 import asyncio
 import json
+import struct
 import websockets
 from termcolor import colored
 import sys
@@ -8,6 +9,105 @@ session_token = None
 heartbeat_task = None
 heartbeat_interval = None
 
+# ask the server for its compact binary encoding instead of JSON.
+# text frames stay JSON either way, binary frames are decoded below
+USE_COMPACT = False
+
+
+# reference decoder for the compact encoding (docs/PROTOCOL.md).
+# the tables are append-only on the server, so they only ever grow here too
+COMPACT_TYPES = [
+    None, "chat", "system", "typing", "history", "session-token",
+    "heartbeat-config", "pong", "ping", "webrtc-error", "history-request",
+    "history-page", "search-request", "search-results", "presence-snapshot",
+    "presence-delta",
+]
+
+COMPACT_KEYS = [
+    None, "type", "username", "text", "timestamp", "messages", "token",
+    "content", "interval", "timeout", "error", "users", "mediaTypes",
+    "participants", "fromUsername", "targetUsername", "id", "before_id",
+    "limit", "has_more", "query", "page", "results", "snippet", "room",
+    "changes", "op", "from",
+]
+
+
+class CompactReader:
+    def __init__(self, buf):
+        self.buf = buf
+        self.pos = 0
+
+    def byte(self):
+        b = self.buf[self.pos]
+        self.pos += 1
+        return b
+
+    def varint(self):
+        n = 0
+        shift = 0
+        while True:
+            b = self.byte()
+            n |= (b & 0x7F) << shift
+            if b < 0x80:
+                return n
+            shift += 7
+
+    def string(self):
+        length = self.varint()
+        s = self.buf[self.pos:self.pos + length].decode("utf-8")
+        self.pos += length
+        return s
+
+    def value(self):
+        tag = self.byte()
+        if tag == 0x00:
+            return None
+        if tag == 0x01:
+            return False
+        if tag == 0x02:
+            return True
+        if tag in (0x03, 0x09):  # uint, timestamp (epoch ms)
+            return self.varint()
+        if tag == 0x04:
+            return -self.varint()
+        if tag == 0x05:
+            n = struct.unpack_from(">d", self.buf, self.pos)[0]
+            self.pos += 8
+            return n
+        if tag == 0x06:
+            return self.string()
+        if tag == 0x07:
+            return [self.value() for _ in range(self.varint())]
+        if tag == 0x08:
+            return self.map_body()
+        raise ValueError(f"unknown tag {tag:#x}")
+
+    def map_body(self):
+        out = {}
+        for _ in range(self.varint()):
+            code = self.byte()
+            key = COMPACT_KEYS[code] if code else self.string()
+            out[key] = self.value()
+        return out
+
+
+def decode_compact(buf):
+    r = CompactReader(buf)
+
+    version = r.byte()
+    if version != 1:
+        raise ValueError(f"unsupported compact version {version}")
+
+    code = r.byte()
+    msg_type = COMPACT_TYPES[code] if code else r.string()
+
+    if r.byte() != 0x08:
+        raise ValueError("frame body must be a map")
+
+    message = r.map_body()
+    message["type"] = msg_type
+    return message
+
 
 async def heartbeat_loop(ws, interval_ms):
     global session_token
@@ -66,11 +166,18 @@ async def recv_loop(ws):
 
     async for message in ws:
 
-        try:
-            data = json.loads(message)
-        except json.JSONDecodeError:
-            print("Received non-JSON message:", message)
-            continue
+        if isinstance(message, bytes):
+            try:
+                data = decode_compact(message)
+            except (ValueError, IndexError, UnicodeDecodeError) as e:
+                print(f"Received bad compact frame: {e}")
+                continue
+        else:
+            try:
+                data = json.loads(message)
+            except json.JSONDecodeError:
+                print("Received non-JSON message:", message)
+                continue
 
         msg_type = data.get("type")
 
@@ -127,6 +234,9 @@ async def recv_loop(ws):
 async def chat_client():
     uri = "ws://127.0.0.1:3000?username=hellotest"
 
+    if USE_COMPACT:
+        uri += "&encoding=compact"
+
     try:
         async with websockets.connect(uri) as websocket:
 
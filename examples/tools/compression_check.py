@@ -0,0 +1,113 @@
+"""
+permessage-deflate interop check.
+
+connects to a running server once per row of the matrix below, sends a
+chat message big enough to cross the compression threshold, and checks
+that it comes back intact. prints what each connection negotiated.
+
+    pip install websockets
+    python compression_check.py --url ws://127.0.0.1:8443
+
+run it with compression enabled and again with it disabled in
+settings.json; every row should pass both times. it opens five
+connections from one ip, so raise maxConnectionsPerWindow and turn off
+reconnectGuard on the test server first. the browser client
+(examples/client/js-web) can't be driven from here, see docs/PROTOCOL.md
+for how to check it by hand.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import string
+import sys
+
+import websockets
+
+# (name, query string, websockets compression arg, expect deflate when the server has it on)
+MATRIX = [
+    ("python default offer", "", "deflate", True),
+    ("python no offer", "", None, False),
+    ("python opted out", "compress=off", "deflate", False),
+    ("python compact + deflate", "encoding=compact", "deflate", True),
+    ("python compact, no offer", "encoding=compact", None, False),
+]
+
+
+def response_headers(ws):
+    # websockets >= 14 vs the legacy client
+    response = getattr(ws, "response", None)
+    if response is not None:
+        return response.headers
+    return ws.response_headers
+
+
+async def run_case(base_url, name, query, compression, expect_deflate, server_deflate):
+    username = "cc" + "".join(random.choices(string.ascii_lowercase, k=8))
+    sep = "&" if query else ""
+    url = f"{base_url}?username={username}{sep}{query}"
+
+    # long enough to be compressed, short enough for the 2000 char limit
+    text = "interop " + "abcdefghij" * 150
+
+    async with websockets.connect(url, compression=compression, max_size=None) as ws:
+        extensions = response_headers(ws).get("Sec-WebSocket-Extensions") or ""
+        negotiated = "permessage-deflate" in extensions
+
+        token = None
+        sent = False
+
+        async def frames():
+            while True:
+                yield await asyncio.wait_for(ws.recv(), timeout=5)
+
+        async for frame in frames():
+            if isinstance(frame, str):
+                msg = json.loads(frame)
+                if msg.get("type") == "session-token":
+                    token = msg["token"]
+                if msg.get("type") == "chat" and msg.get("text") == text:
+                    break
+            elif sent and text.encode() in frame:
+                break
+
+            if token and not sent:
+                await ws.send(json.dumps({"type": "chat", "token": token, "content": text}))
+                sent = True
+
+    wanted = expect_deflate and server_deflate
+    ok = negotiated == wanted
+    status = "PASS" if ok else "FAIL"
+    print(f"{status}  {name:<28} deflate={'yes' if negotiated else 'no ':<3}  {extensions}")
+    return ok
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="ws://127.0.0.1:8443")
+    parser.add_argument(
+        "--server-deflate",
+        choices=["on", "off"],
+        default="on",
+        help="whether compression.enabled is set on the server",
+    )
+    args = parser.parse_args()
+
+    failures = 0
+    for name, query, compression, expect in MATRIX:
+        try:
+            ok = await run_case(args.url, name, query, compression, expect, args.server_deflate == "on")
+        except Exception as e:
+            print(f"FAIL  {name:<28} {type(e).__name__}: {e}")
+            ok = False
+        failures += 0 if ok else 1
+
+        # let the previous leave settle before the next join
+        await asyncio.sleep(1)
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
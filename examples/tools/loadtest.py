@@ -0,0 +1,478 @@
+"""
+Load generator for js-chat-server.
+
+simulates many users against a running server, spread over several
+processes, each user speaking the real protocol: it waits for its session
+token, pings on the interval from heartbeat-config, and counts as joined
+once its history frame arrives. then it sends chat and typing messages at
+the configured rates until the run ends.
+
+    pip install websockets
+    python loadtest.py --url ws://127.0.0.1:8443 --scenario steady --users 500 --procs 4
+
+scenarios:
+  steady           users join over --ramp seconds, then chat and type at the given rates
+  join-storm       everyone connects at once; measures connect rate and join latency
+  broadcast-storm  everyone joins, then --senders of them chat as fast as the rate limit allows
+  auth-flood       needs authentication on; every user registers then logs in (bcrypt load)
+
+every chat message carries its sender, a sequence number and a send time.
+the sender times its own copy coming back (echo latency, and anything that
+never comes back is dropped). every other receiver times it against the
+wall clock, which is only meaningful with the server on the same machine
+(fan-out latency), and counts gaps in each sender's sequence numbers.
+
+the server's per-ip limits are meant for real clients, so run the test
+against a server of its own with a settings.json along these lines:
+totalMaxConnections and maxTotalConnections above --users,
+maxConnectionsPerWindow above --users, churnGuard and reconnectGuard
+disabled, and maxMessagesPerSecond at or above --chat-rate.
+--spread-ips spreads connections over 127.0.0.2-127.0.0.254 (linux
+loopback only), which keeps the per-ip limits from all landing on one ip.
+
+the same --seed gives the same schedule of joins and messages. results
+are printed as a table, and --json writes them to a file for comparing runs.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import random
+import string
+import sys
+import time
+
+import websockets
+
+RESERVOIR_SIZE = 20000
+CONNECT_TIMEOUT = 30
+DRAIN_SECONDS = 3
+PREFIX = "lt "
+
+
+class Stats:
+    """what one process measured; merged in the parent"""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.counts = {
+            "connect_attempts": 0,
+            "connected": 0,
+            "connect_failed": 0,
+            "disconnected_early": 0,
+            "chat_sent": 0,
+            "chat_echoed": 0,
+            "chat_received": 0,
+            "sequence_gaps": 0,
+            "rate_limited": 0,
+            "typing_sent": 0,
+            "typing_received": 0,
+            "frames_received": 0,
+            "auth_busy": 0,
+            "auth_failed": 0,
+        }
+        self.samples = {"join_ms": [], "echo_ms": [], "fanout_ms": []}
+        self.seen = {"join_ms": 0, "echo_ms": 0, "fanout_ms": 0}
+        self.times = {}
+
+    # wall-clock instants, so they compare across processes
+    def mark(self, name, pick):
+        now = time.time()
+        self.times[name] = pick(self.times.get(name, now), now)
+
+    def add(self, name, n=1):
+        self.counts[name] += n
+
+    # reservoir sampling keeps memory flat however long the run is
+    def sample(self, name, value):
+        self.seen[name] += 1
+        bucket = self.samples[name]
+        if len(bucket) < RESERVOIR_SIZE:
+            bucket.append(value)
+        else:
+            j = self.rng.randrange(self.seen[name])
+            if j < RESERVOIR_SIZE:
+                bucket[j] = value
+
+
+class User:
+    def __init__(self, args, stats, proc, index, run_id, rng, start_at, end_at):
+        self.args = args
+        self.stats = stats
+        self.rng = rng
+        self.id = f"{proc}x{index}"
+        self.name = f"lt{run_id}{proc}x{index}"[:20]
+        self.password = f"pw-{run_id}-{self.id}"
+        self.local_ip = f"127.0.0.{2 + (proc * 7919 + index) % 253}" if args.spread_ips else None
+        self.start_at = start_at
+        self.end_at = end_at
+        self.token = None
+        self.joined = asyncio.Event()
+        self.interval = 30.0
+        self.seq = 0
+        self.auth_command = "/register"
+        self.pending = {}  # seq -> perf_counter_ns at send
+        self.last_seq = {}  # sender -> highest seq seen
+
+    async def run(self, senders_ready):
+        await asyncio.sleep(max(0.0, self.start_at - time.monotonic()))
+
+        url = self.args.url
+        if self.args.scenario != "auth-flood":
+            url += ("&" if "?" in url else "?") + f"username={self.name}"
+
+        kwargs = {"open_timeout": CONNECT_TIMEOUT, "max_size": None}
+        if self.local_ip:
+            kwargs["local_addr"] = (self.local_ip, 0)
+
+        self.stats.add("connect_attempts")
+        self.stats.mark("first_attempt", min)
+        started = time.perf_counter_ns()
+        try:
+            async with websockets.connect(url, **kwargs) as ws:
+                reader = asyncio.create_task(self.read(ws, started))
+                try:
+                    await asyncio.wait_for(self.joined.wait(), CONNECT_TIMEOUT)
+                except asyncio.TimeoutError:
+                    self.stats.add("connect_failed")
+                    reader.cancel()
+                    return
+                self.stats.add("connected")
+
+                tasks = [asyncio.create_task(self.heartbeat(ws))]
+                if self.sends_chat():
+                    await senders_ready()
+                    tasks.append(asyncio.create_task(self.chat(ws)))
+                if self.args.typing_rate > 0:
+                    tasks.append(asyncio.create_task(self.typing(ws)))
+
+                # the reader only finishes early if the server closed on us
+                done, _ = await asyncio.wait([reader], timeout=max(0.0, self.end_at - time.monotonic()))
+                for task in tasks:
+                    task.cancel()
+                if done:
+                    self.stats.add("disconnected_early")
+                    return
+
+                # whatever is still in flight gets a moment to arrive
+                await asyncio.sleep(DRAIN_SECONDS)
+                reader.cancel()
+        except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException):
+            if self.joined.is_set():
+                self.stats.add("disconnected_early")
+            else:
+                self.stats.add("connect_failed")
+
+    def sends_chat(self):
+        if self.args.scenario == "join-storm":
+            return False
+        if self.args.scenario == "broadcast-storm":
+            return self.rng.random() < self.args.senders
+        return self.args.chat_rate > 0
+
+    async def send(self, ws, message):
+        message["token"] = self.token
+        try:
+            await ws.send(json.dumps(message))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    # /register, then /login once registered; a busy reply retries the same step
+    async def authenticate(self, ws):
+        await self.send(ws, {"type": "chat", "content": f"{self.auth_command} {self.name} {self.password}"})
+
+    async def read(self, ws, started):
+        try:
+            async for frame in ws:
+                self.stats.add("frames_received")
+                if not isinstance(frame, str):
+                    continue
+                msg = json.loads(frame)
+                kind = msg.get("type")
+
+                if kind == "chat":
+                    self.on_chat(msg)
+                elif kind == "typing":
+                    self.stats.add("typing_received")
+                elif kind == "session-token":
+                    self.token = msg["token"]
+                    if self.args.scenario == "auth-flood":
+                        await self.authenticate(ws)
+                elif kind == "heartbeat-config":
+                    self.interval = msg.get("interval", 30000) / 1000
+                elif kind == "history" and not self.joined.is_set():
+                    self.stats.sample("join_ms", (time.perf_counter_ns() - started) / 1e6)
+                    self.stats.mark("last_join", max)
+                    self.joined.set()
+                elif kind == "system":
+                    await self.on_system(ws, msg.get("text", ""))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def on_system(self, ws, text):
+        if "too fast" in text:
+            self.stats.add("rate_limited")
+        elif text.startswith("Registered."):
+            self.auth_command = "/login"
+            await self.authenticate(ws)
+        elif "busy" in text and not self.joined.is_set():
+            self.stats.add("auth_busy")
+            await asyncio.sleep(1)
+            await self.authenticate(ws)
+        elif text in ("Username exists.", "Login failed.", "Username in use."):
+            self.stats.add("auth_failed")
+
+    def on_chat(self, msg):
+        text = msg.get("text", "")
+        if not text.startswith(PREFIX):
+            return
+        try:
+            _, sender, seq, sent_ns = text.split(" ", 4)[:4]
+            seq = int(seq)
+            sent_ns = int(sent_ns)
+        except ValueError:
+            return
+
+        self.stats.add("chat_received")
+
+        if sender == self.id:
+            sent_at = self.pending.pop(seq, None)
+            if sent_at is not None:
+                self.stats.add("chat_echoed")
+                self.stats.sample("echo_ms", (time.perf_counter_ns() - sent_at) / 1e6)
+            return
+
+        self.stats.sample("fanout_ms", (time.time_ns() - sent_ns) / 1e6)
+        last = self.last_seq.get(sender)
+        if last is not None and seq > last + 1:
+            self.stats.add("sequence_gaps", seq - last - 1)
+        if last is None or seq > last:
+            self.last_seq[sender] = seq
+
+    async def heartbeat(self, ws):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.send(ws, {"type": "ping"})
+
+    async def chat(self, ws):
+        rate = self.args.chat_rate
+        # a random phase so senders don't all fire on the same tick
+        await asyncio.sleep(self.rng.random() / rate)
+        padding = "x" * self.args.message_bytes
+        while True:
+            self.seq += 1
+            self.pending[self.seq] = time.perf_counter_ns()
+            content = f"{PREFIX}{self.id} {self.seq} {time.time_ns()} {padding}"
+            await self.send(ws, {"type": "chat", "content": content})
+            self.stats.add("chat_sent")
+            await asyncio.sleep(self.rng.expovariate(rate))
+
+    async def typing(self, ws):
+        rate = self.args.typing_rate
+        while True:
+            await asyncio.sleep(self.rng.expovariate(rate))
+            await self.send(ws, {"type": "typing"})
+            self.stats.add("typing_sent")
+
+
+async def run_process(args, proc, run_id, users, t0):
+    rng = random.Random(args.seed * 1000 + proc)
+    stats = Stats(rng)
+
+    # join-storm and the storms connect everyone together; steady ramps
+    ramp = 0 if args.scenario in ("join-storm", "broadcast-storm", "auth-flood") else args.ramp
+    end_at = t0 + ramp + args.duration
+
+    # broadcast-storm senders only start once every local user has joined
+    everyone_joined = asyncio.Event()
+    joined_or_failed = [0]
+
+    population = []
+    for i in range(users):
+        start_at = t0 + (ramp * i / users if ramp else 0)
+        population.append(User(args, stats, proc, i, run_id, random.Random(rng.random()), start_at, end_at))
+
+    async def senders_ready():
+        if args.scenario == "broadcast-storm":
+            await everyone_joined.wait()
+
+    async def watch(user):
+        task = asyncio.create_task(user.run(senders_ready))
+        joined = asyncio.create_task(user.joined.wait())
+        await asyncio.wait([task, joined], return_when=asyncio.FIRST_COMPLETED)
+        joined_or_failed[0] += 1
+        if joined_or_failed[0] == users:
+            everyone_joined.set()
+        joined.cancel()
+        await task
+
+    await asyncio.gather(*(watch(u) for u in population))
+    return {"counts": stats.counts, "samples": stats.samples, "times": stats.times}
+
+
+def process_main(args, proc, run_id, users, t0, results):
+    try:
+        result = asyncio.run(run_process(args, proc, run_id, users, t0))
+    except Exception as e:
+        result = {"error": f"{type(e).__name__}: {e}"}
+    results.put(result)
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))
+    return round(ordered[k], 2)
+
+
+def summarize(args, results, elapsed):
+    counts = {}
+    samples = {}
+    times = {}
+    errors = []
+    for result in results:
+        if "error" in result:
+            errors.append(result["error"])
+            continue
+        for key, value in result["counts"].items():
+            counts[key] = counts.get(key, 0) + value
+        for key, values in result["samples"].items():
+            samples.setdefault(key, []).extend(values)
+        for key, pick in (("first_attempt", min), ("last_join", max)):
+            if key in result["times"]:
+                times[key] = pick(times.get(key, result["times"][key]), result["times"][key])
+
+    latency = {
+        key: {
+            "p50": percentile(values, 50),
+            "p90": percentile(values, 90),
+            "p99": percentile(values, 99),
+            "max": round(max(values), 2) if values else None,
+            "samples": len(values),
+        }
+        for key, values in samples.items()
+    }
+
+    join_window = times["last_join"] - times["first_attempt"] if len(times) == 2 else 0
+    dropped = counts.get("chat_sent", 0) - counts.get("chat_echoed", 0)
+
+    return {
+        "scenario": args.scenario,
+        "url": args.url,
+        "users": args.users,
+        "procs": args.procs,
+        "duration_s": args.duration,
+        "seed": args.seed,
+        "elapsed_s": round(elapsed, 2),
+        "counts": counts,
+        "latency_ms": latency,
+        "throughput": {
+            "chat_sent_per_s": round(counts.get("chat_sent", 0) / args.duration, 1),
+            "chat_delivered_per_s": round(counts.get("chat_received", 0) / args.duration, 1),
+            "frames_received_per_s": round(counts.get("frames_received", 0) / args.duration, 1),
+            "connects_per_s": round(counts.get("connected", 0) / join_window, 1) if join_window else None,
+        },
+        "dropped": {
+            "chat_not_echoed": dropped,
+            "sequence_gaps": counts.get("sequence_gaps", 0),
+            "rate_limited": counts.get("rate_limited", 0),
+        },
+        "errors": errors,
+    }
+
+
+def print_report(report):
+    print(f"\nscenario {report['scenario']}: {report['users']} users, {report['procs']} procs, "
+          f"{report['duration_s']}s (+ramp), seed {report['seed']}, took {report['elapsed_s']}s\n")
+
+    counts = report["counts"]
+    print(f"  connected      {counts.get('connected', 0)}/{counts.get('connect_attempts', 0)}"
+          f"  (failed {counts.get('connect_failed', 0)}, dropped mid-run {counts.get('disconnected_early', 0)})")
+    for key, value in report["throughput"].items():
+        print(f"  {key:<22} {value}")
+    print()
+
+    print(f"  {'latency (ms)':<14}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}{'samples':>10}")
+    for key, row in report["latency_ms"].items():
+        cells = "".join(f"{'-' if row[c] is None else row[c]:>10}" for c in ("p50", "p90", "p99", "max"))
+        print(f"  {key:<14}{cells}{row['samples']:>10}")
+    print()
+
+    for key, value in report["dropped"].items():
+        print(f"  {key:<22} {value}")
+    if counts.get("auth_busy") or counts.get("auth_failed"):
+        print(f"  {'auth_busy':<22} {counts.get('auth_busy', 0)}")
+        print(f"  {'auth_failed':<22} {counts.get('auth_failed', 0)}")
+
+    for error in report["errors"]:
+        print(f"  process error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="\n".join(__doc__.strip().splitlines()[2:]),
+    )
+    parser.add_argument("--url", default="ws://127.0.0.1:8443")
+    parser.add_argument(
+        "--scenario",
+        choices=["steady", "join-storm", "broadcast-storm", "auth-flood"],
+        default="steady",
+    )
+    parser.add_argument("--users", type=int, default=200, help="simulated users in total")
+    parser.add_argument("--procs", type=int, default=max(1, min(4, multiprocessing.cpu_count())))
+    parser.add_argument("--duration", type=float, default=30, help="seconds of traffic after everyone joined")
+    parser.add_argument("--ramp", type=float, default=10, help="seconds to spread joins over (steady only)")
+    parser.add_argument("--chat-rate", type=float, default=0.2, help="chat messages per second per sending user")
+    parser.add_argument("--typing-rate", type=float, default=0.0, help="typing events per second per user")
+    parser.add_argument("--senders", type=float, default=0.1,
+                        help="fraction of users that chat in broadcast-storm")
+    parser.add_argument("--message-bytes", type=int, default=32, help="padding added to each chat message")
+    parser.add_argument("--spread-ips", action="store_true",
+                        help="connect from 127.0.0.2-254 instead of one address (linux)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", metavar="PATH", help="also write the report to this file")
+    args = parser.parse_args()
+
+    if args.scenario == "broadcast-storm" and args.chat_rate == parser.get_default("chat_rate"):
+        args.chat_rate = 3.0
+
+    # names stay unique across runs without depending on the seed
+    run_id = "".join(random.SystemRandom().choices(string.ascii_lowercase + string.digits, k=4))
+
+    procs = max(1, min(args.procs, args.users))
+    share = [args.users // procs + (1 if i < args.users % procs else 0) for i in range(procs)]
+
+    results = multiprocessing.Queue()
+    t0_offset = 1.0
+    started = time.monotonic()
+    workers = []
+    for proc in range(procs):
+        # every process schedules against the same monotonic start time
+        worker = multiprocessing.Process(
+            target=process_main,
+            args=(args, proc, run_id, share[proc], started + t0_offset, results),
+        )
+        worker.start()
+        workers.append(worker)
+
+    collected = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    report = summarize(args, collected, time.monotonic() - started)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    sys.exit(1 if report["errors"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,52 +1,121 @@
-const { clampUsername } = require('../utils/colorUtils');
-const { saveMessage, getRecentMessages } = require('../utils/db');
+const { clampUsername } = require('../utils/colorutils');
+const { saveMessage, getHistoryFrame } = require('../utils/db');
+const { sendFrame } = require('./broadcast');
 const { registerUser, authenticateUser } = require('../utils/auth');
+const sessionCache = require('../utils/sessionCache');
 const validateUsername = require('./validateUsername');
+const roster = require('../utils/roster');
+const rooms = require('../utils/rooms');
+const blocks = require('../utils/blocks');
+const presence = require('../utils/presence');
+const logger = require('../utils/logger');
 
-module.exports = (socket, req, wss, settings, adminUsers, broadcast, loginLimiter, bannedUsers, connectionLogger, handleCommand) => {
+module.exports = (socket, req, wss, settings, moderation, broadcast, loginLimiter, connectionLogger, handleCommand) => {
   socket.send(JSON.stringify({
     type: 'system',
     text: 'Authentication required. Use /register <username> <password> or /login <username> <password> in message content.',
   }));
 
-  const messageHandler = require('./messageHandler')(socket, wss, broadcast, settings, adminUsers, handleCommand);
+  const handlers = require('./messageHandler')(socket, wss, broadcast, settings, moderation, handleCommand);
 
-  socket.on('message', async (rawMsg) => {
-    let msg;
+  const reportAuthError = (err) => {
+    if (err.code === 'HASH_POOL_BUSY') {
+      socket.send(JSON.stringify({
+        type: 'system',
+        text: 'Server is busy. Please try again in a few seconds.',
+      }));
+      return;
+    }
+
+    logger.error('Authentication error', { err });
+    socket.send(JSON.stringify({
+      type: 'system',
+      text: 'Authentication failed due to a server error.',
+    }));
+  };
+
+  const completeLogin = async (username) => {
+    let claimed;
+    socket.authPending = true;
     try {
-      msg = JSON.parse(rawMsg);
-    } catch {
+      claimed = await roster.claim(username, socket._ip);
+    } finally {
+      socket.authPending = false;
+    }
+
+    if (!claimed) {
       socket.send(JSON.stringify({
         type: 'system',
-        text: 'Invalid message format. Must be JSON.',
+        text: 'Username in use.',
       }));
+      socket.close();
       return;
     }
 
-    if (socket.authenticated) {
-      return messageHandler(rawMsg);
+    // the client went away while the claim was in flight
+    if (socket.readyState !== socket.OPEN) {
+      roster.release(username);
+      return;
     }
 
-    if (msg.type === 'ping') {
-      socket.lastHeartbeat = Date.now();
-      socket.isAlive = true;
-      
-      socket.send(JSON.stringify({ 
-        type: 'pong',
-        timestamp: socket.lastHeartbeat,
+    socket.username = username;
+    socket.authenticated = true;
+    socket.isAdmin = moderation.isAdmin(username);
+    blocks.identify(socket, settings);
+
+    sessionCache.remember(socket.sessionToken, username);
+
+    connectionLogger('JOIN', username);
+
+    rooms.join(socket, rooms.DEFAULT_ROOM);
+    const room = socket.room;
+    sendFrame(socket, await getHistoryFrame(room));
+    presence.sendSnapshot(socket);
+
+    if (settings.motd) {
+      socket.send(JSON.stringify({ type: 'system', text: `MOTD: ${settings.motd}` }));
+    }
+
+    const joinText = `${username} has joined.`;
+    broadcast(wss, { type: 'system', room, text: joinText }, settings);
+    saveMessage({ type: 'system', text: joinText, room });
+  };
+
+  // a client that logged in recently can reconnect with its previous
+  // session token instead of its password, which skips bcrypt entirely
+  const resumeSession = async (token) => {
+    const username = token ? sessionCache.take(token) : null;
+
+    if (!username) {
+      socket.send(JSON.stringify({
+        type: 'system',
+        text: 'Session expired. Please /login.',
       }));
-      
       return;
     }
 
-    if (msg.type !== 'chat' || typeof msg.content !== 'string') {
+    if (moderation.isBanned(username)) {
       socket.send(JSON.stringify({
         type: 'system',
-        text: 'Please authenticate first using /register or /login commands in message content.',
+        text: 'You are banned.',
       }));
+      socket.close();
       return;
     }
 
+    await completeLogin(username);
+  };
+
+  const requireAuth = (handler) => (msg) => {
+    if (socket.authenticated) return handler(msg);
+
+    socket.send(JSON.stringify({
+      type: 'system',
+      text: 'Please authenticate first using /register or /login commands in message content.',
+    }));
+  };
+
+  const authCommand = async (msg) => {
     const content = msg.content.trim();
 
     const parts = content.split(' ');
@@ -54,6 +123,27 @@ module.exports = (socket, req, wss, settings, adminUsers, broadcast, loginLimite
     const rawUsername = parts[1];
     const password = parts.slice(2).join(' ');
 
+    // one login, resume or register per socket at a time, and none once
+    // logged in; otherwise two could reach completeLogin and claim two names
+    if (socket.authenticated) return;
+    if (socket.authPending) {
+      socket.send(JSON.stringify({
+        type: 'system',
+        text: 'Authentication already in progress.',
+      }));
+      return;
+    }
+
+    if (command === '/resume') {
+      socket.authPending = true;
+      try {
+        await resumeSession(parts[1]);
+      } finally {
+        socket.authPending = false;
+      }
+      return;
+    }
+
     if (command !== '/register' && command !== '/login') {
       socket.send(JSON.stringify({
         type: 'system',
@@ -88,7 +178,7 @@ module.exports = (socket, req, wss, settings, adminUsers, broadcast, loginLimite
       return;
     }
 
-    if (bannedUsers.includes(username)) {
+    if (moderation.isBanned(username)) {
       socket.send(JSON.stringify({
         type: 'system',
         text: 'You are banned.',
@@ -98,7 +188,16 @@ module.exports = (socket, req, wss, settings, adminUsers, broadcast, loginLimite
     }
 
     if (command === '/register') {
-      const success = await registerUser(username, password);
+      let success;
+      socket.authPending = true;
+      try {
+        success = await registerUser(username, password);
+      } catch (err) {
+        reportAuthError(err);
+        return;
+      } finally {
+        socket.authPending = false;
+      }
       socket.send(JSON.stringify({
         type: 'system',
         text: success ? 'Registered. Please /login.' : 'Username exists.',
@@ -116,36 +215,20 @@ module.exports = (socket, req, wss, settings, adminUsers, broadcast, loginLimite
         return;
       }
 
-      if (await authenticateUser(username, password)) {
-        if (wss.usernames.has(username)) {
-          socket.send(JSON.stringify({
-            type: 'system',
-            text: 'Username in use.',
-          }));
-          socket.close();
-          return;
-        }
-
-        socket.username = username;
-        socket.authenticated = true;
-        socket.isAdmin = adminUsers.includes(username);
+      let authenticated;
+      socket.authPending = true;
+      try {
+        authenticated = await authenticateUser(username, password);
+      } catch (err) {
+        reportAuthError(err);
+        return;
+      } finally {
+        socket.authPending = false;
+      }
 
+      if (authenticated) {
         loginLimiter.resetAttempts(ip, username);
-        wss.usernames.add(username);
-        wss.authenticatedClients.add(socket);
-
-        connectionLogger('JOIN', username);
-
-        const messages = await getRecentMessages();
-        socket.send(JSON.stringify({ type: 'history', messages }));
-
-        if (settings.motd) {
-          socket.send(JSON.stringify({ type: 'system', text: `MOTD: ${settings.motd}` }));
-        }
-
-        const joinText = `${username} has joined.`;
-        broadcast(wss, { type: 'system', text: joinText }, settings);
-        saveMessage({ type: 'system', text: joinText });
+        await completeLogin(username);
       } else {
         loginLimiter.recordFailedAttempt(ip, username);
         socket.send(JSON.stringify({
@@ -154,5 +237,15 @@ module.exports = (socket, req, wss, settings, adminUsers, broadcast, loginLimite
         }));
       }
     }
-  });
-};
\ No newline at end of file
+  };
+
+  // nothing awaits the router's handlers, so anything authCommand throws
+  // has to be caught here or it takes the whole process down
+  socket.router
+    .route('chat', (msg) => (socket.authenticated ? handlers.chat(msg) : authCommand(msg).catch(reportAuthError)))
+    .route('typing', requireAuth(handlers.typing))
+    .route('history-request', requireAuth(handlers.historyRequest))
+    .route('search-request', requireAuth(handlers.searchRequest))
+    .routePrefix('webrtc-', requireAuth(handlers.webrtc))
+    .fallback(requireAuth(handlers.unknown));
+};
@@ -1,31 +1,103 @@
-const BLOCK_DURATION_MS = 12 * 60 * 60 * 1000; // 12 hours
+const bus = require('../utils/bus');
+const wireCodec = require('../utils/wireCodec');
+const compression = require('../utils/compression');
+const metrics = require('../utils/metrics');
+const backpressure = require('../utils/backpressure');
+const rooms = require('../utils/rooms');
+const blocks = require('../utils/blocks');
 
-module.exports = (wss, data, settings) => {
+const OPEN = 1;
+
+const framesOut = metrics.counter('chat_frames_out_total', 'Frames sent through the broadcast path', 'encoding');
+const bytesOut = metrics.counter('chat_bytes_out_total', 'Payload bytes sent through the broadcast path (before compression)', 'encoding');
+const fanOutSeconds = metrics.histogram(
+  'chat_broadcast_fanout_seconds',
+  'Time to hand one broadcast to every local recipient',
+  [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1]
+);
+
+// serialize an outbound message exactly once per wire format.
+// senderIp is only used for filtering and never goes on the wire
+const encode = (data) => {
+  const { senderIp, ...outbound } = data;
+  return {
+    type: outbound.type,
+    room: outbound.room || null,
+    senderIp: senderIp || null,
+    message: outbound,
+    payload: Buffer.from(JSON.stringify(outbound)),
+    compact: null,
+    // whether the compression sampler has seen each form yet
+    observedJson: false,
+    observedCompact: false,
+  };
+};
+
+// send an already encoded frame; the same buffer is handed to every socket.
+// the compact form is only built once a compact client actually needs it.
+// a client that has fallen behind gets the slow consumer policy instead
+const sendFrame = (client, frame) => {
+  if (client.bufferedAmount > backpressure.highWaterMark() && !backpressure.admit(client, frame, sendFrame)) {
+    return;
+  }
+
+  if (client.encoding === 'compact') {
+    if (!frame.compact) frame.compact = wireCodec.encode(frame.message);
+    if (client.compressed) {
+      compression.observe(frame.compact, !frame.observedCompact);
+      frame.observedCompact = true;
+    }
+    framesOut.inc('compact');
+    bytesOut.inc('compact', frame.compact.length);
+    client.send(frame.compact, { binary: true });
+    return;
+  }
+  if (client.compressed) {
+    compression.observe(frame.payload, !frame.observedJson);
+    frame.observedJson = true;
+  }
+  framesOut.inc('json');
+  bytesOut.inc('json', frame.payload.length);
+  client.send(frame.payload, { binary: false });
+};
+
+// room messages only visit that room's members; the rest go to everyone
+const fanOut = (wss, frame, settings, exclude) => {
   settings = settings || {};
+  const startedAt = metrics.start();
+
+  const requireAuth = settings.authentication;
+  // usually nobody has blocked the sender and there is nothing to check
+  const blockers = frame.type !== 'system' && frame.senderIp !== null
+    ? blocks.blockersOf(frame.senderIp)
+    : undefined;
 
-  wss.clients.forEach((client) => {
+  const targets = frame.room ? rooms.membersOf(frame.room) : wss.clients;
+
+  targets.forEach((client) => {
     if (
-      client.readyState !== 1 ||
-      (settings.authentication && !client.authenticated)
+      client === exclude ||
+      client.readyState !== OPEN ||
+      (requireAuth && !client.authenticated)
     ) return;
 
-    if (data.type === 'system') {
-      client.send(JSON.stringify(data));
+    if (blockers !== undefined && blockers.has(client.blockerKey)) {
       return;
     }
 
-    if (client.blockedUsers && data.senderIp) {
-      const blockedAt = client.blockedUsers[data.senderIp];
-      if (blockedAt) {
-        if (Date.now() - blockedAt > BLOCK_DURATION_MS) {
-          delete client.blockedUsers[data.senderIp];
-        } else {
-          return;
-        }
-      }
-    }
-
-    const { senderIp, ...outbound } = data;
-    client.send(JSON.stringify(outbound));
+    sendFrame(client, frame);
   });
-};
\ No newline at end of file
+
+  fanOutSeconds.since(startedAt);
+};
+
+// in cluster mode the other workers deliver it to their own sockets
+const broadcast = (wss, data, settings, exclude) => {
+  fanOut(wss, encode(data), settings, exclude);
+  if (bus.clustered) bus.publish('broadcast', data);
+};
+
+module.exports = broadcast;
+module.exports.encode = encode;
+module.exports.sendFrame = sendFrame;
+module.exports.fanOut = fanOut;
@@ -0,0 +1,62 @@
+const bus = require('../utils/bus');
+const { encode, fanOut } = require('./broadcast');
+
+const STATS_INTERVAL_MS = 2000;
+const STATS_STALE_MS = 3 * STATS_INTERVAL_MS;
+
+// live counts reported by the other workers, keyed by worker id
+const peers = new Map();
+
+const localStats = (wss) => ({
+  connectedUsers: wss.clients.size,
+  voiceParticipants: wss.webrtcSFU ? wss.webrtcSFU.getParticipantCount() : 0,
+});
+
+// deliver what other workers publish to the sockets on this one.
+// nothing received here is ever published again
+function init(wss, settings) {
+  if (!bus.clustered) return;
+
+  bus.subscribe('broadcast', (data) => {
+    fanOut(wss, encode(data), settings);
+  });
+
+  bus.subscribe('kick', ({ target, text }) => {
+    wss.clients.forEach((client) => {
+      if (client.username === target) {
+        client.send(JSON.stringify({ type: 'system', text }));
+        client.close();
+      }
+    });
+  });
+
+  bus.subscribe('stats', (stats, from) => {
+    peers.set(from, { ...stats, receivedAt: Date.now() });
+  });
+
+  bus.subscribe('worker-exit', ({ workerId }) => {
+    peers.delete(workerId);
+  });
+
+  setInterval(() => bus.publish('stats', localStats(wss)), STATS_INTERVAL_MS).unref();
+}
+
+/**
+ * Counts for /server-info, summed over every worker in cluster mode.
+ */
+function getTotals(wss) {
+  const totals = { workers: 1, ...localStats(wss) };
+  const now = Date.now();
+
+  for (const stats of peers.values()) {
+    if (now - stats.receivedAt > STATS_STALE_MS) continue;
+    totals.workers++;
+    totals.connectedUsers += stats.connectedUsers;
+    totals.voiceParticipants += stats.voiceParticipants;
+  }
+
+  return totals;
+}
+
+module.exports = init;
+module.exports.getTotals = getTotals;
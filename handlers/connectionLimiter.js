@@ -1,4 +1,4 @@
-const ipConnectionTimestamps = new Map();
+const ipIndex = require('../utils/ipIndex');
 
 module.exports = (ip, socket, wss, settings) => {
   const totalMaxConnections = settings.totalMaxConnections || 20;
@@ -11,23 +11,13 @@ module.exports = (ip, socket, wss, settings) => {
     return false;
   }
 
-  const now = Date.now();
   const windowSize = settings.connectionWindowMs || 30000;
   const maxConnectionsPerWindow = settings.maxConnectionsPerWindow || 2;
   const maxTotalConnectionsPerIP = settings.maxTotalConnections || 4;
 
-  const timestamps = ipConnectionTimestamps.get(ip) || [];
-  const recent = timestamps.filter(ts => now - ts < windowSize);
+  const recent = ipIndex.hit(ip, 'connect', windowSize);
 
-  recent.push(now);
-
-  if (recent.length === 0) {
-    ipConnectionTimestamps.delete(ip);
-  } else {
-    ipConnectionTimestamps.set(ip, recent);
-  }
-
-  if (recent.length > maxConnectionsPerWindow) {
+  if (recent > maxConnectionsPerWindow) {
     socket.send(JSON.stringify({
       type: 'system',
       text: `Too many connections from this IP. Limit is ${maxConnectionsPerWindow} per ${windowSize / 1000} seconds.`,
@@ -36,8 +26,7 @@ module.exports = (ip, socket, wss, settings) => {
     return false;
   }
 
-  const currentIPConnections = Array.from(wss.clients).filter(client => client._ip === ip).length;
-  if (currentIPConnections >= maxTotalConnectionsPerIP) {
+  if (ipIndex.live(ip) >= maxTotalConnectionsPerIP) {
     socket.send(JSON.stringify({
       type: 'system',
       text: `Too many concurrent connections from this IP. Maximum allowed is ${maxTotalConnectionsPerIP}.`,
@@ -46,5 +35,8 @@ module.exports = (ip, socket, wss, settings) => {
     return false;
   }
 
+  ipIndex.acquire(ip);
+  socket.once('close', () => ipIndex.release(ip));
+
   return true;
 };
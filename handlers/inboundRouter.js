@@ -0,0 +1,148 @@
+// the one place a client frame gets decoded. every socket has a single
+// router: the frame is parsed once, checked against the shape its type
+// requires, and handed to whichever handler registered for that type.
+// oversized frames never get here, ws drops them (see maxPayload in app.js)
+
+const wireCodec = require('../utils/wireCodec');
+const metrics = require('../utils/metrics');
+
+const DEFAULT_MAX_PARSE_FAILURES = 10;
+
+// fields each message type must carry, and their typeof
+const SHAPES = {
+  chat: { content: 'string' },
+  'search-request': { query: 'string' },
+};
+
+const stats = {
+  frames: 0,
+  parseFailures: 0,
+  invalid: 0,
+  unrouted: 0,
+  closedForFailures: 0,
+};
+
+const framesIn = metrics.counter('chat_frames_in_total', 'Websocket frames received from clients');
+const bytesIn = metrics.counter('chat_bytes_in_total', 'Websocket payload bytes received from clients');
+
+const sendSystem = (socket, text) => {
+  socket.send(JSON.stringify({ type: 'system', text }));
+};
+
+const matchesShape = (msg, shape) => {
+  for (const field in shape) {
+    if (typeof msg[field] !== shape[field]) return false;
+  }
+  return true;
+};
+
+class InboundRouter {
+  constructor(socket, settings = {}) {
+    this.socket = socket;
+    this.routes = new Map();
+    this.prefixes = [];
+    this.fallbackHandler = null;
+    this.parseFailures = 0;
+    this.maxParseFailures = settings.maxParseFailures || DEFAULT_MAX_PARSE_FAILURES;
+  }
+
+  route(type, handler) {
+    this.routes.set(type, handler);
+    return this;
+  }
+
+  // e.g. every `webrtc-*` type to one handler
+  routePrefix(prefix, handler) {
+    this.prefixes = this.prefixes.filter(([p]) => p !== prefix);
+    this.prefixes.push([prefix, handler]);
+    return this;
+  }
+
+  fallback(handler) {
+    this.fallbackHandler = handler;
+    return this;
+  }
+
+  lookup(type) {
+    const handler = this.routes.get(type);
+    if (handler) return handler;
+
+    for (const [prefix, prefixHandler] of this.prefixes) {
+      if (type.startsWith(prefix)) return prefixHandler;
+    }
+    return this.fallbackHandler;
+  }
+
+  reject(text) {
+    this.parseFailures++;
+    stats.parseFailures++;
+    sendSystem(this.socket, text);
+
+    if (this.parseFailures >= this.maxParseFailures) {
+      stats.closedForFailures++;
+      this.socket.close(1008, 'Too many malformed messages');
+    }
+  }
+
+  dispatch(data, isBinary) {
+    stats.frames++;
+    framesIn.inc();
+    bytesIn.inc(data.length);
+
+    // binary frames are only understood from clients that negotiated compact
+    if (isBinary && this.socket.encoding !== 'compact') {
+      this.reject('Invalid message format. Must be JSON.');
+      return;
+    }
+
+    let msg;
+    try {
+      msg = isBinary ? wireCodec.decode(data) : JSON.parse(data);
+    } catch {
+      this.reject(isBinary ? 'Invalid compact frame.' : 'Invalid message format. Must be JSON.');
+      return;
+    }
+
+    if (!msg || typeof msg !== 'object' || Array.isArray(msg) || typeof msg.type !== 'string') {
+      this.reject('Invalid message format.');
+      return;
+    }
+
+    const shape = SHAPES[msg.type];
+    if (shape && !matchesShape(msg, shape)) {
+      stats.invalid++;
+      sendSystem(this.socket, 'Invalid message structure.');
+      return;
+    }
+
+    const handler = this.lookup(msg.type);
+    if (!handler) {
+      stats.unrouted++;
+      return;
+    }
+
+    handler(msg);
+  }
+}
+
+/**
+ * Create the router for a socket and attach it as the socket's only
+ * `message` listener.
+ * @returns {InboundRouter}
+ */
+function attach(socket, settings) {
+  const router = new InboundRouter(socket, settings);
+  socket.router = router;
+  socket.on('message', (data, isBinary) => router.dispatch(data, isBinary));
+  return router;
+}
+
+function getStats() {
+  return { ...stats };
+}
+
+module.exports = {
+  attach,
+  sendSystem,
+  getStats,
+};
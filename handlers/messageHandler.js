@@ -1,130 +1,156 @@
-const { saveMessage } = require('../utils/db');
-
-module.exports = (socket, wss, broadcast, settings, adminUsers, handleCommand) => {
+const { saveMessage, getHistoryPage } = require('../utils/db');
+const { sendSystem } = require('./inboundRouter');
+const { search, errorText: searchErrorText } = require('../utils/search');
+const typingState = require('../utils/typing');
+const logger = require('../utils/logger');
+
+// handlers for a joined user's messages, keyed by what they handle.
+// frames arrive already parsed and shape-checked by the socket's router
+module.exports = (socket, wss, broadcast, settings, moderation, handleCommand) => {
   const messageTimestamps = [];
 
-  return (msg) => {
-    let parsed;
+  const webrtc = (parsed) => {
+    const nowISO = new Date().toISOString();
+    const sfu = wss.webrtcSFU;
 
-    try {
-      parsed = JSON.parse(msg);
-    } catch {
+    if (!sfu) {
       socket.send(JSON.stringify({
-        type: 'system',
-        text: 'Invalid message format.',
+        type: 'webrtc-error',
+        error: 'WebRTC not initialized',
+        timestamp: nowISO,
       }));
       return;
     }
 
-    if (!parsed || typeof parsed !== 'object' || Array.isArray(parsed)) {
-      sendSystem(socket, 'Invalid message format.');
+    if (parsed.token !== socket.sessionToken) {
+      socket.send(JSON.stringify({
+        type: 'webrtc-error',
+        error: 'Invalid session token',
+        timestamp: nowISO,
+      }));
       return;
     }
 
-    const nowISO = new Date().toISOString();
+    switch (parsed.type) {
+      case 'webrtc-join':
+        sfu.handleJoinVoice(socket, parsed);
+        break;
 
-    if (parsed.type === 'ping') {
-      socket.lastHeartbeat = Date.now();
-      socket.isAlive = true;
+      case 'webrtc-leave':
+        sfu.handleLeaveVoice(socket);
+        break;
 
-      socket.send(JSON.stringify({
-        type: 'pong',
-        timestamp: nowISO,
-      }));
+      case 'webrtc-offer':
+        sfu.handleOffer(socket, parsed);
+        break;
 
-      return;
-    }
+      case 'webrtc-answer':
+        sfu.handleAnswer(socket, parsed);
+        break;
 
-    if (typeof parsed.type === 'string' && parsed.type.startsWith('webrtc-')) {
-      const sfu = wss.webrtcSFU;
+      case 'webrtc-ice-candidate':
+        sfu.handleIceCandidate(socket, parsed);
+        break;
 
-      if (!sfu) {
-        socket.send(JSON.stringify({
-          type: 'webrtc-error',
-          error: 'WebRTC not initialized',
-          timestamp: nowISO,
-        }));
-        return;
-      }
+      case 'webrtc-media-change':
+        sfu.handleMediaChange(socket, parsed);
+        break;
 
-      if (parsed.token !== socket.sessionToken) {
+      default:
         socket.send(JSON.stringify({
           type: 'webrtc-error',
-          error: 'Invalid session token',
+          error: 'Unknown WebRTC message type',
           timestamp: nowISO,
         }));
-        return;
-      }
-
-      switch (parsed.type) {
-        case 'webrtc-join':
-          sfu.handleJoinVoice(socket, parsed);
-          break;
-
-        case 'webrtc-leave':
-          sfu.handleLeaveVoice(socket);
-          break;
-
-        case 'webrtc-offer':
-          sfu.handleOffer(socket, parsed);
-          break;
-
-        case 'webrtc-answer':
-          sfu.handleAnswer(socket, parsed);
-          break;
-
-        case 'webrtc-ice-candidate':
-          sfu.handleIceCandidate(socket, parsed);
-          break;
-
-        case 'webrtc-media-change':
-          sfu.handleMediaChange(socket, parsed);
-          break;
-
-        default:
-          socket.send(JSON.stringify({
-            type: 'webrtc-error',
-            error: 'Unknown WebRTC message type',
-            timestamp: nowISO,
-          }));
-      }
-
-      return;
     }
+  };
 
+  const typing = (parsed) => {
     if (parsed.token !== socket.sessionToken) {
       sendSystem(socket, 'Invalid session token.');
       return;
     }
 
-    if (parsed.type === 'typing') {
-      if (!socket.username) return;
+    if (!socket.username) return;
 
-      const typingMsg = JSON.stringify({
-        type: 'typing',
-        username: socket.username,
-        timestamp: nowISO,
-      });
+    // sent on to the room in batches, see utils/typing.js
+    if (parsed.active === false) {
+      typingState.clear(socket.room, socket.username);
+    } else {
+      typingState.record(socket.room, socket.username, socket._ip);
+    }
+  };
 
-      wss.clients.forEach(client => {
-        if (
-          client !== socket &&
-          client.readyState === 1 &&
-          (!settings.authentication || client.authenticated)
-        ) {
-          client.send(typingMsg);
-        }
+  // older history of the socket's room, one page per request: { before_id, limit, username? }
+  const historyRequest = (parsed) => {
+    if (parsed.token !== socket.sessionToken) {
+      sendSystem(socket, 'Invalid session token.');
+      return;
+    }
+
+    // one query per socket at a time; scrolling clients fire these fast
+    if (socket.historyPending) return;
+    socket.historyPending = true;
+    const room = socket.room;
+
+    getHistoryPage({
+      beforeId: parsed.before_id,
+      limit: parsed.limit,
+      username: typeof parsed.username === 'string' ? parsed.username : undefined,
+      room,
+    })
+      .then(({ messages, hasMore }) => {
+        broadcast.sendFrame(socket, broadcast.encode({
+          type: 'history-page',
+          room,
+          before_id: Number.isSafeInteger(parsed.before_id) ? parsed.before_id : null,
+          messages,
+          has_more: hasMore,
+        }));
+      })
+      .catch((err) => {
+        logger.error('History page error', { err });
+        sendSystem(socket, 'Could not load older messages.');
+      })
+      .finally(() => {
+        socket.historyPending = false;
       });
+  };
 
+  // ranked full-text search in the socket's room: { query, page?, limit? }
+  const searchRequest = (parsed) => {
+    if (parsed.token !== socket.sessionToken) {
+      sendSystem(socket, 'Invalid session token.');
       return;
     }
 
-    if (parsed.type !== 'chat' || typeof parsed.content !== 'string') {
-      sendSystem(socket, 'Invalid message structure.');
+    if (socket.searchPending) return;
+    socket.searchPending = true;
+
+    const reply = (fields) => {
+      broadcast.sendFrame(socket, broadcast.encode({
+        type: 'search-results',
+        query: parsed.query,
+        ...fields,
+      }));
+    };
+
+    search(parsed.query, { page: parsed.page, limit: parsed.limit, room: socket.room })
+      .then(({ results, page, hasMore }) => reply({ page, results, has_more: hasMore }))
+      .catch((err) => reply({ page: parsed.page || 1, results: [], has_more: false, error: searchErrorText(err) }))
+      .finally(() => {
+        socket.searchPending = false;
+      });
+  };
+
+  const chat = (parsed) => {
+    if (parsed.token !== socket.sessionToken) {
+      sendSystem(socket, 'Invalid session token.');
       return;
     }
 
     const now = Date.now();
+    const nowISO = new Date(now).toISOString();
 
     messageTimestamps.push(now);
 
@@ -160,20 +186,47 @@ module.exports = (socket, wss, broadcast, settings, adminUsers, handleCommand) =
       return;
     }
 
-    if (handleCommand(text, socket, wss, broadcast, settings, adminUsers)) {
+    if (handleCommand(text, socket, wss, broadcast, settings, moderation)) {
       return;
     }
 
     const messageObj = {
       type: 'chat',
+      room: socket.room,
       username: socket.username,
       text,
       timestamp: nowISO,
       senderIp: socket._ip,
     };
 
-    saveMessage({ type: 'chat', username: socket.username, text, timestamp: nowISO });
+    if (!saveMessage({ type: 'chat', username: socket.username, text, timestamp: nowISO, room: socket.room })) {
+      socket.send(JSON.stringify({
+        type: 'system',
+        text: 'The server is busy and your message was not sent. Please try again shortly.',
+      }));
+      return;
+    }
 
     broadcast(wss, messageObj, settings);
+    typingState.clear(socket.room, socket.username);
   };
-};
\ No newline at end of file
+
+  const unknown = () => {
+    sendSystem(socket, 'Invalid message structure.');
+  };
+
+  return { chat, typing, historyRequest, searchRequest, webrtc, unknown };
+};
+
+/**
+ * Point a socket's router at the handlers above.
+ */
+module.exports.install = (router, handlers) => {
+  router
+    .route('chat', handlers.chat)
+    .route('typing', handlers.typing)
+    .route('history-request', handlers.historyRequest)
+    .route('search-request', handlers.searchRequest)
+    .routePrefix('webrtc-', handlers.webrtc)
+    .fallback(handlers.unknown);
+};
@@ -1,7 +1,13 @@
-const { getRecentMessages, saveMessage } = require('../utils/db');
+const { getHistoryFrame, saveMessage } = require('../utils/db');
+const { sendFrame } = require('./broadcast');
 const validateUsername = require('./validateUsername');
+const roster = require('../utils/roster');
+const rooms = require('../utils/rooms');
+const blocks = require('../utils/blocks');
+const presence = require('../utils/presence');
+const logger = require('../utils/logger');
 
-module.exports = (socket, req, wss, settings, bannedUsers, broadcast, generateUsername, clampUsername, connectionLogger, handleCommand) => {
+module.exports = (socket, req, wss, settings, moderation, broadcast, generateUsername, clampUsername, connectionLogger, handleCommand) => {
   const desiredUsername = clampUsername(require('url').parse(req.url, true).query.username || generateUsername());
 
   if (!validateUsername(desiredUsername)) {
@@ -11,30 +17,47 @@ module.exports = (socket, req, wss, settings, bannedUsers, broadcast, generateUs
     return;
   }
 
-  if (bannedUsers.includes(desiredUsername)) {
+  if (moderation.isBanned(desiredUsername)) {
     socket.send(JSON.stringify({ type: 'system', text: 'You are banned.' }));
     socket.close();
     return;
   }
 
-  if (wss.usernames.has(desiredUsername)) {
-    socket.send(JSON.stringify({ type: 'system', text: 'Username taken.' }));
-    socket.close();
-    return;
-  }
+  roster.claim(desiredUsername, socket._ip).then((claimed) => {
+    if (!claimed) {
+      socket.send(JSON.stringify({ type: 'system', text: 'Username taken.' }));
+      socket.close();
+      return;
+    }
 
-  socket.username = desiredUsername;
-  wss.usernames.add(desiredUsername);
-  connectionLogger('JOIN', desiredUsername);
+    // the client went away while the claim was in flight
+    if (socket.readyState !== socket.OPEN) {
+      roster.release(desiredUsername);
+      return;
+    }
 
-  getRecentMessages().then((messages) => {
-    socket.send(JSON.stringify({ type: 'history', messages }));
-    if (settings.motd) socket.send(JSON.stringify({ type: 'system', text: `MOTD: ${settings.motd}` }));
-    const joinText = `${desiredUsername} has joined.`;
-    broadcast(wss, { type: 'system', text: joinText }, settings);
-    saveMessage({ type: 'system', text: joinText });
-  });
+    socket.username = desiredUsername;
+    blocks.identify(socket, settings);
+    connectionLogger('JOIN', desiredUsername);
 
-  const messageHandler = require('./messageHandler')(socket, wss, broadcast, settings, [], handleCommand);
-  socket.on('message', messageHandler);
+    rooms.join(socket, rooms.DEFAULT_ROOM);
+    const room = socket.room;
+
+    const joined = getHistoryFrame(room).then((frame) => {
+      sendFrame(socket, frame);
+      presence.sendSnapshot(socket);
+      if (settings.motd) socket.send(JSON.stringify({ type: 'system', text: `MOTD: ${settings.motd}` }));
+      const joinText = `${desiredUsername} has joined.`;
+      broadcast(wss, { type: 'system', room, text: joinText }, settings);
+      saveMessage({ type: 'system', text: joinText, room });
+    });
+
+    const messageHandler = require('./messageHandler');
+    messageHandler.install(socket.router, messageHandler(socket, wss, broadcast, settings, moderation, handleCommand));
+    return joined;
+  }).catch((err) => {
+    // nothing else would catch this, and an unhandled rejection stops the process
+    logger.error('Join error', { err, username: desiredUsername });
+    socket.send(JSON.stringify({ type: 'system', text: 'Joining failed due to a server error.' }));
+  });
 };
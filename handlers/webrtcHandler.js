@@ -1,4 +1,8 @@
 const { saveMessage } = require('../utils/db');
+const broadcast = require('./broadcast');
+const logger = require('../utils/logger');
+
+const { encode, sendFrame } = broadcast;
 
 class WebRTCSFU {
   constructor(wss, settings) {
@@ -120,7 +124,7 @@ class WebRTCSFU {
     this.broadcastToAll(joinMsg);
     saveMessage(joinMsg);
 
-    console.log(`[WEBRTC] ${socket.username} joined voice chat (${this.getParticipantCount()}/${this.getMaxParticipants()})`);
+    logger.info(`[WEBRTC] ${socket.username} joined voice chat (${this.getParticipantCount()}/${this.getMaxParticipants()})`);
   }
 
   handleLeaveVoice(socket) {
@@ -145,7 +149,7 @@ class WebRTCSFU {
     this.broadcastToAll(leaveMsg);
     saveMessage(leaveMsg);
 
-    console.log(`[WEBRTC] ${username} left voice chat (${this.getParticipantCount()}/${this.getMaxParticipants()})`);
+    logger.info(`[WEBRTC] ${username} left voice chat (${this.getParticipantCount()}/${this.getMaxParticipants()})`);
   }
 
   handleOffer(socket, data) {
@@ -183,7 +187,7 @@ class WebRTCSFU {
       offer: offer,
     }));
 
-    console.log(`[WEBRTC] Relayed offer: ${socket.username} → ${targetUsername}`);
+    logger.debug(`[WEBRTC] Relayed offer: ${socket.username} → ${targetUsername}`);
   }
 
   handleAnswer(socket, data) {
@@ -223,7 +227,7 @@ class WebRTCSFU {
 
     this.flushPendingIceCandidates(socket, targetSocket);
 
-    console.log(`[WEBRTC] Relayed answer: ${socket.username} → ${targetUsername}`);
+    logger.debug(`[WEBRTC] Relayed answer: ${socket.username} → ${targetUsername}`);
   }
 
   handleIceCandidate(socket, data) {
@@ -252,7 +256,7 @@ class WebRTCSFU {
       }
       targetPendingMap.get(socket).push(candidate);
       
-      console.log(`[WEBRTC] Buffered ICE candidate: ${socket.username} → ${targetUsername}`);
+      logger.debug(`[WEBRTC] Buffered ICE candidate: ${socket.username} → ${targetUsername}`);
     } else {
       targetSocket.send(JSON.stringify({
         type: 'webrtc-ice-candidate',
@@ -260,7 +264,7 @@ class WebRTCSFU {
         candidate: candidate,
       }));
 
-      console.log(`[WEBRTC] Relayed ICE candidate: ${socket.username} → ${targetUsername}`);
+      logger.debug(`[WEBRTC] Relayed ICE candidate: ${socket.username} → ${targetUsername}`);
     }
   }
 
@@ -281,7 +285,7 @@ class WebRTCSFU {
       }));
     });
 
-    console.log(`[WEBRTC] Flushed ${bufferedCandidates.length} ICE candidates: ${fromSocket.username} → ${toSocket.username}`);
+    logger.debug(`[WEBRTC] Flushed ${bufferedCandidates.length} ICE candidates: ${fromSocket.username} → ${toSocket.username}`);
 
     toPendingMap.delete(fromSocket);
   }
@@ -306,7 +310,7 @@ class WebRTCSFU {
       mediaTypes: mediaTypes,
     }, socket);
 
-    console.log(`[WEBRTC] ${socket.username} media changed:`, mediaTypes);
+    logger.debug(`[WEBRTC] ${socket.username} media changed`, { mediaTypes });
   }
 
   findSocketByUsername(username) {
@@ -319,19 +323,17 @@ class WebRTCSFU {
   }
 
   broadcastToParticipants(message, excludeSocket = null) {
+    const frame = encode(message);
     this.participants.forEach((data, socket) => {
       if (socket !== excludeSocket && socket.readyState === 1) {
-        socket.send(JSON.stringify(message));
+        sendFrame(socket, frame);
       }
     });
   }
 
+  // voice rooms are per worker in cluster mode, but everyone hears about joins and leaves
   broadcastToAll(message) {
-    this.wss.clients.forEach(client => {
-      if (client.readyState === 1) {
-        client.send(JSON.stringify(message));
-      }
-    });
+    broadcast(this.wss, message);
   }
 
   handleDisconnect(socket) {
@@ -346,9 +348,9 @@ module.exports = (wss, settings) => {
 
   wss.webrtcSFU = sfu;
 
-  console.log('[WEBRTC] SFU initialized -', 
+  logger.info(`[WEBRTC] SFU initialized - ${
     sfu.isEnabled() ? `Enabled (max ${sfu.getMaxParticipants()} participants)` : 'Disabled'
-  );
+  }`);
 
   return sfu;
 };
\ No newline at end of file
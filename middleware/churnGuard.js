@@ -1,15 +1,27 @@
-const ipState = new Map();
+const ipIndex = require('../utils/ipIndex');
+const BoundedMap = require('../utils/boundedMap');
+const metrics = require('../utils/metrics');
+const logger = require('../utils/logger');
+
+const blocks = metrics.counter('chat_churn_blocks_total', 'IPs blocked for reconnecting too often');
+const refused = metrics.counter('chat_churn_refused_total', 'Connections refused from churn-blocked IPs');
+
+// capped so rotating source IPs can't grow it without limit; an IP with a
+// connection still open is never evicted
+const ipState = new BoundedMap({
+  maxEntries: 10000,
+  canEvict: (state) => state.pendingConnect === null,
+});
 
 function onConnect(ip, socket, settings) {
   const cfg = _config(settings);
   if (!cfg.enabled) return true;
 
-  _prune(ip, cfg);
-
-  const state = _getState(ip);
+  const state = _getState(ip, cfg);
 
   if (state.blockedUntil !== null) {
     if (Date.now() < state.blockedUntil) {
+      refused.inc();
       const remaining = Math.ceil((state.blockedUntil - Date.now()) / 1000);
       try {
         socket.send(JSON.stringify({
@@ -21,7 +33,7 @@ function onConnect(ip, socket, settings) {
       return false;
     } else {
       state.blockedUntil = null;
-      state.cycles = [];
+      ipIndex.reset(ip, 'churn');
     }
   }
 
@@ -34,36 +46,39 @@ function onDisconnect(ip, settings) {
   const cfg = _config(settings);
   if (!cfg.enabled) return;
 
-  const state = _getState(ip);
+  const state = _getState(ip, cfg);
 
-  if (state.pendingConnect !== null) {
-    state.cycles.push(Date.now());
-    state.pendingConnect = null;
-  }
+  if (state.pendingConnect === null) return;
+  state.pendingConnect = null;
 
-  _prune(ip, cfg);
+  const cycles = ipIndex.hit(ip, 'churn', cfg.windowMs);
 
-  if (state.cycles.length >= cfg.maxCycles) {
+  if (cycles >= cfg.maxCycles) {
     state.blockedUntil = Date.now() + cfg.blockDurationMs;
-    state.cycles = [];
-    console.log(
-      `[CHURN GUARD] Blocked ${ip} for ${cfg.blockDurationMs / 1000}s ` +
-      `(${cfg.maxCycles} rapid cycles detected)`
-    );
+    ipIndex.reset(ip, 'churn');
+    blocks.inc();
+    logger.warn('Churn guard blocked IP', {
+      event: 'churn-guard',
+      ip,
+      blockSeconds: cfg.blockDurationMs / 1000,
+      cycles: cfg.maxCycles,
+    });
   }
 }
 
-function _getState(ip) {
-  if (!ipState.has(ip)) {
-    ipState.set(ip, { cycles: [], pendingConnect: null, blockedUntil: null });
+function _getState(ip, cfg) {
+  ipState.maxEntries = cfg.maxEntries;
+
+  let state = ipState.get(ip);
+  if (!state) {
+    state = { pendingConnect: null, blockedUntil: null };
+    ipState.set(ip, state, Math.max(cfg.windowMs, cfg.blockDurationMs));
   }
-  return ipState.get(ip);
+  return state;
 }
 
-function _prune(ip, cfg) {
-  const state = _getState(ip);
-  const cutoff = Date.now() - cfg.windowMs;
-  state.cycles = state.cycles.filter(ts => ts > cutoff);
+function size() {
+  return ipState.size;
 }
 
 function _config(settings) {
@@ -72,8 +87,9 @@ function _config(settings) {
     windowMs: 300000,
     maxCycles: 5,
     blockDurationMs: 600000,
+    maxEntries: 10000,
   };
   return Object.assign({}, defaults, settings.churnGuard || {});
 }
 
-module.exports = { onConnect, onDisconnect };
\ No newline at end of file
+module.exports = { onConnect, onDisconnect, size };
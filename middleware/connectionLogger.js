@@ -1,4 +1,5 @@
+const logger = require('../utils/logger');
+
 module.exports = function connectionLogger(action, username) {
-  const time = new Date().toISOString();
-  console.log(`[${time}] ${action}: ${username}`);
+  logger.info(`${action}: ${username}`, { event: action.toLowerCase(), username });
 };
@@ -0,0 +1,26 @@
+const ipIndex = require('../utils/ipIndex');
+const logger = require('../utils/logger');
+
+module.exports = function reconnectGuard(ip, socket, settings) {
+  const cfg = _config(settings);
+  if (!cfg.enabled) return true;
+
+  const attempts = ipIndex.hit(ip, 'reconnect', cfg.windowMs);
+
+  if (attempts > cfg.maxAttempts) {
+    logger.warn('Reconnect guard blocked IP', { event: 'reconnect-guard', ip });
+    socket.close(1008, `Reconnect spam - wait ${cfg.windowMs / 1000} seconds.`);
+    return false;
+  }
+
+  return true;
+};
+
+function _config(settings) {
+  const defaults = {
+    enabled: true,
+    windowMs: 120000,
+    maxAttempts: 3,
+  };
+  return Object.assign({}, defaults, settings.reconnectGuard || {});
+}
@@ -1,42 +1,136 @@
-// needs work
-// good example, but partially dysfunctional
-// if you make a better multiplexer, please contribute!
+// routing proxy in front of one or more chat servers.
+// frames are relayed byte-for-byte in both directions; the only client
+// frames that get parsed are the ones that might be a proxy command
+// (/join, /nick, /servers). everything else goes straight through.
 
+const fs = require('fs');
 const http = require('http');
+const https = require('https');
+const path = require('path');
 const WebSocket = require('ws');
 const url = require('url');
 const generateUsername = require('../utils/generateusername');
 const validateUsername = require('../handlers/validateUsername');
-const asettings = require('../settings.json');
-const lastNickChange = new Map();
 
-const PORT = 3000;
+const configPath = path.join(__dirname, 'multiplexer.json');
 
-const backendServers = {
-  main: 'ws://localhost:3001',
-  testing: 'ws://localhost:3002',
-};
-
-const settings = {
+const defaultConfig = {
   serverName: "My Proxy Server",
+  port: 3000,
   totalMaxConnections: 9999,
-  port: PORT
+  nickChangeCooldown: 30000, //ms between /nick changes, should match the backends
+  healthCheckIntervalMs: 10000, //how often every backend's /server-info is polled
+  healthCheckTimeoutMs: 3000, //a backend that takes longer than this is marked down
+  backends: {
+    main: 'ws://localhost:3001',
+    testing: 'ws://localhost:3002',
+  },
+};
+
+if (!fs.existsSync(configPath)) {
+  fs.writeFileSync(configPath, JSON.stringify(defaultConfig, null, 2));
+  console.log('Multiplexer config created with default backends.');
+}
+
+const config = { ...defaultConfig, ...JSON.parse(fs.readFileSync(configPath)) };
+
+const COMMAND_HINTS = ['/join', '/nick', '/servers'];
+
+// cheap byte search so ordinary chat frames are never decoded
+const mightBeCommand = (data) => COMMAND_HINTS.some((hint) => data.indexOf(hint) !== -1);
+
+const backends = new Map();
+
+for (const [id, wsUrl] of Object.entries(config.backends)) {
+  const infoUrl = new URL(wsUrl);
+  infoUrl.protocol = infoUrl.protocol === 'wss:' ? 'https:' : 'http:';
+  infoUrl.pathname = '/server-info';
+
+  backends.set(id, {
+    id,
+    url: wsUrl,
+    infoUrl: infoUrl.toString(),
+    healthy: null,
+    lastCheckAt: null,
+    healthLatencyMs: null,
+    remoteUsers: null,
+    stats: {
+      activeClients: 0,
+      connects: 0,
+      connectFailures: 0,
+      lastConnectMs: 0,
+      maxConnectMs: 0,
+      totalConnectMs: 0,
+      framesToBackend: 0,
+      bytesToBackend: 0,
+      framesFromBackend: 0,
+      bytesFromBackend: 0,
+    },
+  });
+}
+
+const checkBackend = (backend) => {
+  const started = process.hrtime.bigint();
+  const client = backend.infoUrl.startsWith('https:') ? https : http;
+
+  const done = (healthy, info) => {
+    backend.healthy = healthy;
+    backend.lastCheckAt = new Date().toISOString();
+    backend.healthLatencyMs = healthy ? Number(process.hrtime.bigint() - started) / 1e6 : null;
+    backend.remoteUsers = info?.currentStats?.connectedUsers ?? null;
+  };
+
+  const req = client.get(backend.infoUrl, { timeout: config.healthCheckTimeoutMs }, (res) => {
+    let body = '';
+    res.setEncoding('utf8');
+    res.on('data', (chunk) => { body += chunk; });
+    res.on('end', () => {
+      if (res.statusCode !== 200) return done(false);
+      try {
+        done(true, JSON.parse(body));
+      } catch {
+        done(false);
+      }
+    });
+  });
+
+  req.on('timeout', () => req.destroy(new Error('timeout')));
+  req.on('error', () => done(false));
+};
+
+const checkAllBackends = () => backends.forEach(checkBackend);
+checkAllBackends();
+setInterval(checkAllBackends, config.healthCheckIntervalMs);
+
+const backendReport = () => {
+  const report = {};
+  for (const backend of backends.values()) {
+    const { stats } = backend;
+    report[backend.id] = {
+      healthy: backend.healthy,
+      lastCheckAt: backend.lastCheckAt,
+      healthLatencyMs: backend.healthLatencyMs,
+      remoteUsers: backend.remoteUsers,
+      ...stats,
+      avgConnectMs: stats.connects ? stats.totalConnectMs / stats.connects : 0,
+    };
+  }
+  return report;
 };
 
 const server = http.createServer();
 
 const wss = new WebSocket.Server({ noServer: true, perMessageDeflate: false });
 
-const clientUsernames = new Map();
-
-function serverInfoHandler(req, res, wss, settings) {
+function serverInfoHandler(req, res, wss, config) {
   const parsedUrl = url.parse(req.url, true);
 
   if (parsedUrl.pathname === '/server-info') {
     const info = {
-      serverName: settings.serverName || "Unnamed Proxy",
-      totalMaxConnections: settings.totalMaxConnections,
-      currentOnline: wss.clients.size
+      serverName: config.serverName || "Unnamed Proxy",
+      totalMaxConnections: config.totalMaxConnections,
+      currentOnline: wss.clients.size,
+      backends: backendReport(),
     };
 
     res.writeHead(200, {
@@ -50,7 +144,7 @@ function serverInfoHandler(req, res, wss, settings) {
 }
 
 server.on('request', (req, res) => {
-  if (!serverInfoHandler(req, res, wss, settings)) {
+  if (!serverInfoHandler(req, res, wss, config)) {
     res.writeHead(404);
     res.end('Not found');
   }
@@ -61,6 +155,12 @@ server.on('upgrade', (request, socket, head) => {
     socket.destroy();
     return;
   }
+
+  if (wss.clients.size >= config.totalMaxConnections) {
+    socket.destroy();
+    return;
+  }
+
   wss.handleUpgrade(request, socket, head, (ws) => {
     wss.emit('connection', ws, request);
   });
@@ -73,11 +173,12 @@ wss.on('connection', (clientSocket, req) => {
     : generateUsername();
 
   console.log(`Client connected from ${req.socket.remoteAddress} as "${username}"`);
-  clientUsernames.set(clientSocket, username);
 
-  let backendSocket = null;
-  let connected = false;
-  let currentServerId = null;
+  // the backend ties the username, session token and rate limits to the
+  // websocket itself, so every client needs its own upstream connection
+  let upstream = null;
+  let backend = null;
+  let lastNickChange = 0;
 
   const sendToClient = (obj) => {
     if (clientSocket.readyState === WebSocket.OPEN) {
@@ -85,145 +186,178 @@ wss.on('connection', (clientSocket, req) => {
     }
   };
 
-  const connectToBackend = (serverId) => {
-    const targetUrl = `${backendServers[serverId]}?username=${encodeURIComponent(username)}`;
-    backendSocket = new WebSocket(targetUrl);
-    currentServerId = serverId;
+  const forward = (data, isBinary) => {
+    upstream.send(data, { binary: isBinary });
+    backend.stats.framesToBackend++;
+    backend.stats.bytesToBackend += data.length;
+  };
 
-    backendSocket.on('open', () => {
-      connected = true;
-      sendToClient({ type: 'system', text: `PROXY: Connected to ${serverId} as ${username}` });
+  const disconnectBackend = () => {
+    if (!upstream) return;
+    const old = upstream;
+    upstream = null;
+    old.removeAllListeners();
+    old.on('error', () => {});
+    old.close();
+    backend.stats.activeClients--;
+    backend = null;
+  };
+
+  const connectToBackend = (target) => {
+    disconnectBackend();
+
+    const socket = new WebSocket(`${target.url}?username=${encodeURIComponent(username)}`, {
+      perMessageDeflate: false,
+    });
+    const started = process.hrtime.bigint();
+    let opened = false;
+
+    upstream = socket;
+    backend = target;
+    target.stats.activeClients++;
+
+    socket.on('open', () => {
+      opened = true;
+      const connectMs = Number(process.hrtime.bigint() - started) / 1e6;
+      target.stats.connects++;
+      target.stats.lastConnectMs = connectMs;
+      target.stats.maxConnectMs = Math.max(target.stats.maxConnectMs, connectMs);
+      target.stats.totalConnectMs += connectMs;
+      sendToClient({ type: 'system', text: `PROXY: Connected to ${target.id} as ${username}` });
     });
 
-    backendSocket.on('message', (data) => {
-      try {
-        sendToClient(JSON.parse(data));
-      } catch {
-        sendToClient({ type: 'chat', content: data.toString() });
+    socket.on('message', (data, isBinary) => {
+      target.stats.framesFromBackend++;
+      target.stats.bytesFromBackend += data.length;
+      if (clientSocket.readyState === WebSocket.OPEN) {
+        clientSocket.send(data, { binary: isBinary });
       }
     });
 
-    backendSocket.on('close', () => {
-      connected = false;
-      sendToClient({ type: 'system', text: `PROXY: Disconnected from ${serverId}` });
+    socket.on('close', () => {
+      if (upstream !== socket) return;
+      upstream = null;
+      backend = null;
+      target.stats.activeClients--;
+      sendToClient({ type: 'system', text: `PROXY: Disconnected from ${target.id}` });
     });
 
-    backendSocket.on('system', (err) => {
+    socket.on('error', (err) => {
+      if (opened) {
+        sendToClient({ type: 'system', text: `PROXY: Connection to ${target.id} failed: ${err.message}` });
+        return;
+      }
+      target.stats.connectFailures++;
       sendToClient({
         type: 'system',
-        text: `PROXY: Failed to connect to ${serverId}: ${err.message}`
+        text: `PROXY: Failed to connect to ${target.id}: ${err.message}`
       });
     });
   };
 
-  sendToClient({
-    type: 'system',
-    text: `PROXY: Welcome ${username}! Use /join <server_id> to connect`,
-  });
-  sendToClient({
-    type: 'system',
-    text: `PROXY: Type /servers for a list of servers.`,
-  });
-
-  clientSocket.on('message', (data) => {
+  // returns true if the frame was a proxy command and has been handled
+  const handleProxyCommand = (data, isBinary) => {
     let message;
     try {
       message = JSON.parse(data);
-    } catch (err) {
-      sendToClient({ type: 'system', text: 'PROXY: Invalid message format.' });
-      return;
+    } catch {
+      return false;
     }
 
-    // Ignore ping messages
-    if (message.type === 'ping') {
-      return;
+    if (!message || message.type !== 'chat' || typeof message.content !== 'string') {
+      return false;
     }
 
-    if (message.type !== 'chat' || typeof message.content !== 'string') {
-      sendToClient({ type: 'system', text: 'PROXY: Invalid message structure.' });
-      return;
-    }
-
-    const content = message.content.trim();
-    const raw = message.content.trim();
-    const stripped = raw.replace(/^[^:\s]+:\s*/, '');
+    const stripped = message.content.trim().replace(/^[^:\s]+:\s*/, '');
 
     if (stripped.startsWith('/nick ')) {
       const newNick = stripped.split(/\s+/)[1];
-      if (!newNick) {
-        sendToClient({ type: 'system', text: 'PROXY: Usage: /nick <new_name>' });
-        return;
-      }
 
       if (!validateUsername(newNick)) {
         sendToClient({ type: 'system', text: 'PROXY: Illegal username. Requirement: 3-20 characters alphanumeric.' });
-        return;
+        return true;
       }
 
-      const lastChange = lastNickChange.get(clientSocket) || 0;
       const now = Date.now();
-
-      if (now - lastChange < asettings.nickChangeCooldown * 1000) {
-        const wait = Math.ceil((asettings.nickChangeCooldown * 1000 - (now - lastChange)) / 1000);
+      if (now - lastNickChange < config.nickChangeCooldown) {
+        const wait = Math.ceil((config.nickChangeCooldown - (now - lastNickChange)) / 1000);
         sendToClient({ type: 'system', text: `PROXY: You must wait ${wait}s before changing your nickname again.` });
-        return;
+        return true;
       }
 
       username = newNick;
-      clientUsernames.set(clientSocket, newNick);
-      lastNickChange.set(clientSocket, now);
+      lastNickChange = now;
 
-      if (backendSocket && backendSocket.readyState === WebSocket.OPEN) {
-        backendSocket.send(JSON.stringify({ type: 'chat', content }));
+      // the backend gets the original frame and answers for itself
+      if (upstream && upstream.readyState === WebSocket.OPEN) {
+        forward(data, isBinary);
+      } else {
+        sendToClient({ type: 'system', text: `PROXY: Username changed to ${newNick}` });
       }
-
-      sendToClient({ type: 'system', text: `PROXY: Username changed to ${newNick}` });
-      return;
+      return true;
     }
 
     if (stripped === '/servers') {
-      return sendToClient({
-        type: 'system',
-        text: `PROXY: Available servers: ${Object.keys(backendServers).join(', ')}`
+      const list = Array.from(backends.values()).map((b) => {
+        const status = b.healthy === null ? 'unknown' : b.healthy ? 'up' : 'down';
+        return `${b.id} (${status})`;
       });
+      sendToClient({ type: 'system', text: `PROXY: Available servers: ${list.join(', ')}` });
+      return true;
     }
 
-    const joinMatch = stripped.match(/^\/join\s+(\S+)$/);
+    // `/join #room` belongs to the backend
+    const joinMatch = stripped.match(/^\/join\s+([^#\s]\S*)$/);
     if (joinMatch) {
-      const serverId = joinMatch[1];
-      if (!backendServers[serverId]) {
-        return sendToClient({
-          type: 'system',
-          text: `PROXY: Unknown server ID "${serverId}".`
-        });
+      const target = backends.get(joinMatch[1]);
+      if (!target) {
+        sendToClient({ type: 'system', text: `PROXY: Unknown server ID "${joinMatch[1]}".` });
+        return true;
       }
-      if (backendSocket && backendSocket.readyState === WebSocket.OPEN) {
-        backendSocket.close();
+      if (target.healthy === false) {
+        sendToClient({ type: 'system', text: `PROXY: ${target.id} is failing health checks, trying anyway.` });
       }
-      return connectToBackend(serverId);
+      connectToBackend(target);
+      return true;
     }
 
-    if (!connected) {
-      return sendToClient({ type: 'system', text: 'PROXY: Use /join <server_id> to connect to a chat server.' });
+    return false;
+  };
+
+  sendToClient({
+    type: 'system',
+    text: `PROXY: Welcome ${username}! Use /join <server_id> to connect`,
+  });
+  sendToClient({
+    type: 'system',
+    text: `PROXY: Type /servers for a list of servers.`,
+  });
+
+  clientSocket.on('message', (data, isBinary) => {
+    if (!isBinary && mightBeCommand(data) && handleProxyCommand(data, isBinary)) {
+      return;
     }
 
-    if (backendSocket.readyState === WebSocket.OPEN) {
-      backendSocket.send(JSON.stringify(message));
-    } else {
-      connected = false;
-      sendToClient({ type: 'system', text: 'PROXY: Lost connection to server.' });
+    if (!upstream) {
+      sendToClient({ type: 'system', text: 'PROXY: Use /join <server_id> to connect to a chat server.' });
+      return;
     }
+
+    // frames sent while the backend is still connecting would be lost
+    if (upstream.readyState !== WebSocket.OPEN) {
+      sendToClient({ type: 'system', text: 'PROXY: Still connecting, please wait.' });
+      return;
+    }
+
+    forward(data, isBinary);
   });
 
   clientSocket.on('close', () => {
-    if (backendSocket && backendSocket.readyState === WebSocket.OPEN) {
-      backendSocket.close();
-    }
-    clientUsernames.delete(clientSocket);
+    disconnectBackend();
     console.log(`Client from ${req.socket.remoteAddress} disconnected`);
   });
 });
 
-server.listen(PORT, () => {
-  console.log(`Proxy listening on http://localhost:${PORT}`);
+server.listen(config.port, () => {
+  console.log(`Proxy listening on http://localhost:${config.port}`);
 });
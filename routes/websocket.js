@@ -1,79 +1,40 @@
 const crypto = require('crypto');
 
-console.log('Loading loadSettings');
-const loadSettings = require('../handlers/loadSettings');
-console.log('Loading loadBansAndAdmins');
-const loadBansAndAdmins = require('../handlers/loadBansAndAdmins');
-console.log('Loading connectionLimiter');
+const configStore = require('../utils/configStore');
 const connectionLimiter = require('../handlers/connectionLimiter');
-console.log('Loading broadcast');
 const broadcast = require('../handlers/broadcast');
-console.log('Loading authHandler');
 const authHandler = require('../handlers/authHandler');
-console.log('Loading unauthHandler');
 const unauthHandler = require('../handlers/unauthHandler');
-console.log('Loading colorUtils');
-const { clampUsername } = require('../utils/colorUtils');
-console.log('Loading generateUsername');
-const generateUsername = require('../utils/generateUsername');
-console.log('Loading connectionLogger');
+const { clampUsername } = require('../utils/colorutils');
+const generateUsername = require('../utils/generateusername');
 const connectionLogger = require('../middleware/connectionLogger');
-console.log('Loading churnGuard');
 const churnGuard = require('../middleware/churnGuard');
-console.log('Loading commands');
+const reconnectGuard = require('../middleware/reconnectGuard');
 const handleCommand = require('../utils/commands');
-console.log('Loading loginLimiter');
 const loginLimiter = require('../utils/loginLimiter');
+const heartbeatMonitor = require('../utils/heartbeatMonitor');
+const inboundRouter = require('../handlers/inboundRouter');
+const wireCodec = require('../utils/wireCodec');
+const compression = require('../utils/compression');
+const roster = require('../utils/roster');
+const rooms = require('../utils/rooms');
+const typing = require('../utils/typing');
+const logger = require('../utils/logger');
 
-module.exports = (socket, req, wss) => {
+module.exports = (socket, req, wss, settings) => {
 
   const ip =
     req.headers['x-forwarded-for']?.split(',')[0] ||
     req.socket.remoteAddress;
   socket._ip = ip;
 
-  const settings = loadSettings();
-  const { bannedUsers, adminUsers } = loadBansAndAdmins();
-  const reconnectTracker = new Map();
-
-  // this should be its own module and setting
-  // TODO:
-  function reconnectGuard(ip, socket) {
-
-    const now = Date.now();
-
-    if (!reconnectTracker.has(ip)) {
-      reconnectTracker.set(ip, []);
-    }
-
-    const attempts = reconnectTracker.get(ip);
-
-    while (attempts.length && now - attempts[0] > 120000) {
-      attempts.shift();
-    }
-
-    attempts.push(now);
-
-    if (attempts.length > 3) {
-
-      console.log(`[RECONNECT GUARD] Blocking ${ip}`);
-
-      socket.close(1008, "Reconnect spam - wait 120 seconds.");
-
-      return false;
-    }
-
-    return true;
-  }
-    
-  if (!reconnectGuard(ip, socket)) return;
+  if (!reconnectGuard(ip, socket, settings)) return;
   if (!churnGuard.onConnect(ip, socket, settings)) return;
   if (!connectionLimiter(ip, socket, wss, settings)) return;
 
-  if (!wss.usernames) wss.usernames = new Set();
-  if (!wss.authenticatedClients) wss.authenticatedClients = new Set();
-
-  socket.blockedUsers = new Set();
+  // text frames are always JSON; compact clients also get binary frames
+  socket.encoding = wireCodec.negotiate(req, socket.protocol);
+  compression.track(socket);
 
   socket.sessionToken = crypto.randomBytes(32).toString('hex');
 
@@ -95,50 +56,21 @@ module.exports = (socket, req, wss) => {
     timeout: heartbeatTimeout,
   }));
 
+  heartbeatMonitor.track(socket, heartbeatTimeout);
 
-  socket.heartbeatTimer = setInterval(() => {
 
-    const timeSinceLastBeat = Date.now() - socket.lastHeartbeat;
+  // every frame from here on goes through this one listener; the
+  // auth/unauth handlers add their own routes to it
+  const router = inboundRouter.attach(socket, settings);
 
-    if (timeSinceLastBeat > heartbeatTimeout) {
+  router.route('ping', () => {
 
-      console.log(`[HEARTBEAT TIMEOUT] Disconnecting ${socket.username || 'unauthenticated'} - No ping for ${timeSinceLastBeat}ms`);
+    heartbeatMonitor.touch(socket);
 
-      try {
-        socket.send(JSON.stringify({
-          type: 'system',
-          text: 'Disconnected: Heartbeat timeout (no ping received)',
-        }));
-      } catch {}
-
-      socket.close(1008, 'Heartbeat timeout');
-
-    }
-
-  }, 5000);
-
-
-  socket.on('message', (data) => {
-
-    let msg;
-
-    try {
-      msg = JSON.parse(data);
-    } catch {
-      return;
-    }
-
-    if (msg.type === 'ping') {
-
-      socket.lastHeartbeat = Date.now();
-
-      socket.send(JSON.stringify({
-        type: 'pong',
-        timestamp: new Date().toISOString()
-      }));
-
-      return;
-    }
+    socket.send(JSON.stringify({
+      type: 'pong',
+      timestamp: new Date().toISOString()
+    }));
 
   });
 
@@ -150,10 +82,9 @@ module.exports = (socket, req, wss) => {
       req,
       wss,
       settings,
-      adminUsers,
+      configStore,
       broadcast,
       loginLimiter,
-      bannedUsers,
       connectionLogger,
       handleCommand
     );
@@ -165,7 +96,7 @@ module.exports = (socket, req, wss) => {
       req,
       wss,
       settings,
-      bannedUsers,
+      configStore,
       broadcast,
       generateUsername,
       clampUsername,
@@ -178,9 +109,7 @@ module.exports = (socket, req, wss) => {
 
   socket.on('close', () => {
     churnGuard.onDisconnect(ip, settings);
-    if (socket.heartbeatTimer) {
-      clearInterval(socket.heartbeatTimer);
-    }
+    heartbeatMonitor.untrack(socket);
 
     if (wss.webrtcSFU) {
       wss.webrtcSFU.handleDisconnect(socket);
@@ -190,15 +119,19 @@ module.exports = (socket, req, wss) => {
 
       connectionLogger('LEAVE', socket.username);
 
-      wss.usernames.delete(socket.username);
+      roster.release(socket.username);
+
+      const room = socket.room;
+      rooms.leave(socket);
+      typing.clear(room, socket.username);
 
       const leaveText = `${socket.username} has left.`;
 
-      broadcast(wss, { type: 'system', text: leaveText }, settings);
+      broadcast(wss, { type: 'system', room, text: leaveText }, settings);
 
       const { saveMessage } = require('../utils/db');
 
-      saveMessage({ type: 'system', text: leaveText });
+      saveMessage({ type: 'system', text: leaveText, room });
 
     }
 
@@ -206,7 +139,7 @@ module.exports = (socket, req, wss) => {
 
 
   socket.on('error', (err) => {
-    console.error('WebSocket client error:', err);
+    logger.error('WebSocket client error', { err });
   });
 
 };
\ No newline at end of file
@@ -0,0 +1,57 @@
+const test = require('node:test');
+const assert = require('node:assert');
+const os = require('os');
+const path = require('path');
+
+process.env.CHAT_DB_PATH = path.join(os.tmpdir(), `chat-test-${process.pid}.db`);
+
+const hasSqlite = (() => {
+  try {
+    require.resolve('sqlite3');
+    return true;
+  } catch {
+    return false;
+  }
+})();
+const skip = !hasSqlite && 'sqlite3 is not installed';
+
+// commands go through the real database module, so it needs sqlite3
+const load = () => {
+  const { FakeSocket, FakeServer } = require('../bench/fakes');
+  const handleCommand = require('../utils/commands');
+  require('../utils/search').configure({ enabled: false });
+
+  const socket = new FakeSocket({ username: 'alice' });
+  const replies = [];
+  socket.send = (data) => replies.push(JSON.parse(data).text);
+  const run = (msg) => handleCommand(msg, socket, new FakeServer([socket]), () => {}, {}, {});
+  return { run, replies };
+};
+
+test.after(() => {
+  if (hasSqlite) return require('../utils/db').close();
+});
+
+test('a multi-line /search is answered, not thrown', { skip }, async () => {
+  const { run, replies } = load();
+  assert.strictEqual(run('/search a\nb'), true);
+  await new Promise((resolve) => setImmediate(resolve));
+  assert.deepStrictEqual(replies, ['Search is disabled on this server.']);
+});
+
+test('/search only matches the whole command', { skip }, () => {
+  const { run } = load();
+  assert.strictEqual(run('/searching for something'), false);
+});
+
+test('one /search per socket at a time', { skip }, async () => {
+  const { run, replies } = load();
+  run('/search hello');
+  run('/search again');
+  assert.deepStrictEqual(replies, ['A search is already running. Please wait for its results.']);
+
+  await new Promise((resolve) => setImmediate(resolve));
+  run('/search hello');
+  await new Promise((resolve) => setImmediate(resolve));
+  assert.strictEqual(replies.length, 3);
+});
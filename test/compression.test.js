@@ -0,0 +1,67 @@
+const test = require('node:test');
+const assert = require('node:assert');
+const EventEmitter = require('events');
+const compression = require('../utils/compression');
+const { encode, sendFrame } = require('../handlers/broadcast');
+const { FakeSocket } = require('../bench/fakes');
+
+compression.configure({ threshold: 1024, maxClients: 2, sampleEvery: 1 });
+
+const upgrade = (query = '') => ({
+  url: `/?${query}`,
+  headers: { 'sec-websocket-extensions': 'permessage-deflate; client_max_window_bits' },
+});
+
+const compressedSocket = () => {
+  const socket = new EventEmitter();
+  socket.extensions = 'permessage-deflate';
+  compression.track(socket);
+  return socket;
+};
+
+test('frames under the threshold are not counted', () => {
+  assert.strictEqual(compression.serverOptions().threshold, 1024);
+
+  const before = compression.getStats().framesObserved;
+  compression.observe(Buffer.alloc(1023));
+  assert.strictEqual(compression.getStats().framesObserved, before);
+
+  compression.observe(Buffer.alloc(1024));
+  assert.strictEqual(compression.getStats().framesObserved, before + 1);
+});
+
+test('a broadcast frame is sampled once, however many recipients', () => {
+  const before = compression.getStats();
+  const frame = encode({ type: 'chat', text: 'x'.repeat(2000) });
+
+  for (let i = 0; i < 100; i++) {
+    const client = new FakeSocket();
+    client.compressed = true;
+    sendFrame(client, frame);
+  }
+
+  const after = compression.getStats();
+  assert.strictEqual(after.framesObserved - before.framesObserved, 100);
+  assert.strictEqual(after.sampledFrames - before.sampledFrames, 1);
+});
+
+test('clients that opt out are declined', () => {
+  const request = upgrade('compress=off');
+  compression.admit(request);
+  assert.strictEqual(request.headers['sec-websocket-extensions'], undefined);
+});
+
+test('the extension is declined past maxClients, and offered again after a close', () => {
+  const first = compressedSocket();
+  compressedSocket();
+  assert.strictEqual(compression.getStats().compressedClients, 2);
+
+  const refused = upgrade();
+  compression.admit(refused);
+  assert.strictEqual(refused.headers['sec-websocket-extensions'], undefined);
+
+  first.emit('close');
+  const admitted = upgrade();
+  compression.admit(admitted);
+  assert.ok(admitted.headers['sec-websocket-extensions']);
+});
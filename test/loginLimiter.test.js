@@ -0,0 +1,25 @@
+const test = require('node:test');
+const assert = require('node:assert');
+const loginLimiter = require('../utils/loginLimiter');
+
+test('bans after repeated failures on one username', () => {
+  for (let i = 0; i < 5; i++) loginLimiter.recordFailedAttempt('10.0.0.1', 'alice');
+  assert.strictEqual(loginLimiter.isBlocked('10.0.0.1', 'alice'), true);
+  assert.strictEqual(loginLimiter.isBlocked('10.0.0.2', 'alice'), false);
+});
+
+test('cycling throwaway usernames does not reset the count', () => {
+  for (let i = 0; i < 4; i++) loginLimiter.recordFailedAttempt('10.0.0.3', 'victim');
+  for (let i = 0; i < 40; i++) loginLimiter.recordFailedAttempt('10.0.0.3', `throwaway${i}`);
+  assert.strictEqual(loginLimiter.isBlocked('10.0.0.3', 'victim'), false);
+
+  loginLimiter.recordFailedAttempt('10.0.0.3', 'victim');
+  assert.strictEqual(loginLimiter.isBlocked('10.0.0.3', 'victim'), true);
+});
+
+test('a successful login clears the count', () => {
+  for (let i = 0; i < 4; i++) loginLimiter.recordFailedAttempt('10.0.0.4', 'bob');
+  loginLimiter.resetAttempts('10.0.0.4', 'bob');
+  loginLimiter.recordFailedAttempt('10.0.0.4', 'bob');
+  assert.strictEqual(loginLimiter.isBlocked('10.0.0.4', 'bob'), false);
+});
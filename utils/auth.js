@@ -1,6 +1,6 @@
 const sqlite3 = require('sqlite3').verbose();
 const path = require('path');
-const bcrypt = require('bcrypt');
+const hashPool = require('./hashPool');
 
 const dbPath = path.join(__dirname, '../accounts.db');
 const db = new sqlite3.Database(dbPath);
@@ -19,6 +19,7 @@ db.serialize(() => {
  * @param {string} username
  * @param {string} password
  * @returns {Promise<boolean>} true if registered, false if username exists
+ * @throws {Error} code HASH_POOL_BUSY when the hashing pool is saturated
  */
 function registerUser(username, password) {
   return new Promise((resolve, reject) => {
@@ -27,7 +28,7 @@ function registerUser(username, password) {
       if (row) return resolve(false);
 
       try {
-        const hash = await bcrypt.hash(password, 10);
+        const hash = await hashPool.hash(password, 10);
         db.run(
           'INSERT INTO accounts (username, password_hash) VALUES (?, ?)',
           [username, hash],
@@ -48,6 +49,7 @@ function registerUser(username, password) {
  * @param {string} username
  * @param {string} password
  * @returns {Promise<boolean>} true if authenticated, false otherwise
+ * @throws {Error} code HASH_POOL_BUSY when the hashing pool is saturated
  */
 function authenticateUser(username, password) {
   return new Promise((resolve, reject) => {
@@ -56,7 +58,7 @@ function authenticateUser(username, password) {
       if (!row) return resolve(false);
 
       try {
-        const match = await bcrypt.compare(password, row.password_hash);
+        const match = await hashPool.compare(password, row.password_hash);
         resolve(match);
       } catch (compareErr) {
         reject(compareErr);
@@ -0,0 +1,202 @@
+const metrics = require('./metrics');
+const logger = require('./logger');
+
+// what happens to broadcast frames for a client that isn't reading them
+// fast enough. sendFrame only calls in here once a socket's bufferedAmount
+// is past the high-water mark, so healthy sockets pay one property read.
+//
+// over the mark, droppable frames (typing) are coalesced: only the latest
+// per sender is kept and sent once the socket drains. other frames follow
+// options.action:
+//   'drop'       skip them while over the mark; the client is told how many
+//                it missed once it catches up
+//   'degrade'    keep sending them, shedding only droppable frames, until
+//                maxBufferedBytes; then disconnect
+//   'disconnect' disconnect once it has been over the mark for slowConsumerMs
+//                (or hits maxBufferedBytes sooner)
+
+const options = {
+  highWaterMark: 1024 * 1024,      // bytes queued before a socket counts as slow
+  lowWaterMark: 256 * 1024,        // ...and under this it has caught up again
+  maxBufferedBytes: 8 * 1024 * 1024,
+  slowConsumerMs: 15000,
+  action: 'degrade',
+  droppable: ['typing'],
+  coalescedMaxAgeMs: 5000,         // coalesced frames older than this are stale by the time they'd go out
+};
+
+const SWEEP_MS = 1000;
+const CLOSE_GRACE_MS = 5000;
+
+const stats = {
+  slowEvents: 0,
+  recovered: 0,
+  evicted: 0,
+  dropped: 0,
+  coalesced: 0,
+};
+
+const dropped = metrics.counter('chat_outbound_dropped_total', 'Frames not sent to slow clients', 'type');
+const coalesced = metrics.counter('chat_outbound_coalesced_total', 'Droppable frames held back for slow clients');
+const evictions = metrics.counter('chat_slow_consumer_evictions_total', 'Clients disconnected for not reading fast enough');
+
+const slow = new Set();
+let droppable = new Set(options.droppable);
+let sweepTimer = null;
+
+function configure(overrides = {}) {
+  for (const key of Object.keys(options)) {
+    if (overrides[key] !== undefined) options[key] = overrides[key];
+  }
+  droppable = new Set(options.droppable);
+}
+
+function evict(client, reason) {
+  if (client.evicted) return;
+  client.evicted = true;
+  stats.evicted++;
+  evictions.inc();
+
+  logger.warn('Disconnecting slow consumer', {
+    event: 'slow-consumer',
+    username: client.username || null,
+    bufferedBytes: client.bufferedAmount,
+    reason,
+  });
+
+  // the close frame queues behind everything else, so don't wait on it forever
+  client.close(1013, 'Slow consumer');
+  const timer = setTimeout(() => {
+    if (client.readyState !== 3 && client.terminate) client.terminate();
+  }, CLOSE_GRACE_MS);
+  timer.unref();
+  slow.delete(client);
+}
+
+function recover(client, now, sendFrame) {
+  slow.delete(client);
+  client.slowSince = 0;
+  stats.recovered++;
+
+  if (client.coalesced) {
+    for (const { frame, at } of client.coalesced.values()) {
+      if (now - at <= options.coalescedMaxAgeMs) sendFrame(client, frame);
+    }
+    client.coalesced = null;
+  }
+
+  if (client.skippedFrames) {
+    client.send(JSON.stringify({
+      type: 'system',
+      text: `${client.skippedFrames} message(s) were not delivered because your connection was too slow. Load history to catch up.`,
+    }));
+    client.skippedFrames = 0;
+  }
+}
+
+function sweep(sendFrame) {
+  const now = Date.now();
+
+  for (const client of slow) {
+    if (client.readyState !== 1) {
+      slow.delete(client);
+    } else if (client.bufferedAmount <= options.lowWaterMark) {
+      recover(client, now, sendFrame);
+    } else if (options.action === 'disconnect' && now - client.slowSince >= options.slowConsumerMs) {
+      evict(client, 'slow for too long');
+    }
+  }
+
+  if (!slow.size) {
+    clearInterval(sweepTimer);
+    sweepTimer = null;
+  }
+}
+
+/**
+ * Decide whether a frame still goes to a client that is over the
+ * high-water mark. Coalesces, drops or evicts as configured.
+ * @param {Function} sendFrame used to send coalesced frames once it drains
+ * @returns {boolean} true to send the frame now
+ */
+function admit(client, frame, sendFrame) {
+  const now = Date.now();
+
+  if (!client.slowSince) {
+    client.slowSince = now;
+    slow.add(client);
+    stats.slowEvents++;
+    if (!sweepTimer) {
+      sweepTimer = setInterval(sweep, SWEEP_MS, sendFrame);
+      sweepTimer.unref();
+    }
+  }
+
+  if (droppable.has(frame.type)) {
+    if (!client.coalesced) client.coalesced = new Map();
+    client.coalesced.set(`${frame.type}:${frame.message.username}`, { frame, at: now });
+    stats.coalesced++;
+    coalesced.inc();
+    return false;
+  }
+
+  if (options.action === 'drop') {
+    client.skippedFrames = (client.skippedFrames || 0) + 1;
+    stats.dropped++;
+    dropped.inc(frame.type);
+    return false;
+  }
+
+  if (client.bufferedAmount >= options.maxBufferedBytes) {
+    evict(client, 'buffer limit reached');
+    return false;
+  }
+
+  if (options.action === 'disconnect' && now - client.slowSince >= options.slowConsumerMs) {
+    evict(client, 'slow for too long');
+    return false;
+  }
+
+  return true;
+}
+
+function highWaterMark() {
+  return options.highWaterMark;
+}
+
+/**
+ * Buffered bytes across a server's sockets. With `top`, also the worst
+ * few by name, which is not for public endpoints.
+ */
+function getStats(wss, top = 0) {
+  let total = 0;
+  let max = 0;
+  const worst = [];
+
+  if (wss) {
+    for (const client of wss.clients) {
+      const buffered = client.bufferedAmount;
+      total += buffered;
+      if (buffered > max) max = buffered;
+      if (top > 0 && buffered > 0) worst.push({ username: client.username || null, bufferedBytes: buffered });
+    }
+    worst.sort((a, b) => b.bufferedBytes - a.bufferedBytes);
+  }
+
+  return {
+    ...stats,
+    action: options.action,
+    highWaterMark: options.highWaterMark,
+    slowNow: slow.size,
+    bufferedBytes: total,
+    maxBufferedBytes: max,
+    topSockets: top > 0 ? worst.slice(0, top) : undefined,
+  };
+}
+
+module.exports = {
+  configure,
+  admit,
+  highWaterMark,
+  getStats,
+};
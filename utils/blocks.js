@@ -0,0 +1,183 @@
+const TimerWheel = require('./timerWheel');
+const bus = require('./bus');
+
+// who blocked whom, indexed by the blocked sender so a broadcast makes one
+// map lookup per message and none per recipient unless that sender is
+// blocked by someone. senders are identified by ip, as before, so a
+// blocked user can't get out of it with /nick. blockers are identified by
+// account on authentication servers and by ip otherwise, so a block
+// outlives the socket it was made on (see identify()).
+//
+// blocks expire on a timing wheel with minute resolution. in cluster mode
+// every block and unblock is relayed, so every worker has the whole index
+// and a reconnect to any worker keeps its blocks.
+
+const options = {
+  durationMs: 12 * 60 * 60 * 1000, // how long a block lasts
+  maxPerUser: 100,                 // most blocks one blocker can have at once
+};
+
+const stats = {
+  blocks: 0,
+  unblocks: 0,
+  expired: 0,
+  refused: 0,
+};
+
+// sender ip -> Map(blocker key -> entry)
+const bySender = new Map();
+// blocker key -> Map(sender ip -> entry)
+const byBlocker = new Map();
+
+// one lap is 12 hours, so a default block is visited once
+const wheel = new TimerWheel({
+  tickMs: 60000,
+  slots: 720,
+  onExpire: (entry) => {
+    stats.expired++;
+    remove(entry.blocker, entry.ip);
+  },
+});
+
+function configure(overrides = {}) {
+  for (const key of Object.keys(options)) {
+    if (overrides[key] !== undefined) options[key] = overrides[key];
+  }
+}
+
+/**
+ * Give a joined socket the key its blocks are stored under.
+ */
+function identify(socket, settings) {
+  socket.blockerKey = settings.authentication ? `user:${socket.username}` : `ip:${socket._ip}`;
+}
+
+function add(blocker, ip, username, expiresAt) {
+  let blocked = byBlocker.get(blocker);
+  if (!blocked) {
+    blocked = new Map();
+    byBlocker.set(blocker, blocked);
+  }
+
+  let entry = blocked.get(ip);
+  if (!entry) {
+    entry = { blocker, ip, username, expiresAt };
+    blocked.set(ip, entry);
+
+    let blockers = bySender.get(ip);
+    if (!blockers) {
+      blockers = new Map();
+      bySender.set(ip, blockers);
+    }
+    blockers.set(blocker, entry);
+  }
+
+  entry.username = username;
+  entry.expiresAt = expiresAt;
+  wheel.schedule(entry, expiresAt);
+}
+
+function remove(blocker, ip) {
+  const blocked = byBlocker.get(blocker);
+  const entry = blocked && blocked.get(ip);
+  if (!entry) return false;
+
+  wheel.cancel(entry);
+  blocked.delete(ip);
+  if (!blocked.size) byBlocker.delete(blocker);
+
+  const blockers = bySender.get(ip);
+  blockers.delete(blocker);
+  if (!blockers.size) bySender.delete(ip);
+  return true;
+}
+
+bus.subscribe('block', ({ op, blocker, ip, username, expiresAt }) => {
+  if (op === 'add') add(blocker, ip, username, expiresAt);
+  if (op === 'remove') remove(blocker, ip);
+});
+
+/**
+ * Hide everything sent from `ip` from `blocker` for options.durationMs.
+ * @param {string} username the blocked user's name when blocked, for /list and /unblock
+ * @returns {boolean} false if the blocker already has maxPerUser blocks
+ */
+function block(blocker, ip, username) {
+  const blocked = byBlocker.get(blocker);
+  if (blocked && blocked.size >= options.maxPerUser && !blocked.has(ip)) {
+    stats.refused++;
+    return false;
+  }
+
+  const expiresAt = Date.now() + options.durationMs;
+  add(blocker, ip, username, expiresAt);
+  stats.blocks++;
+  if (bus.clustered) bus.publish('block', { op: 'add', blocker, ip, username, expiresAt });
+  return true;
+}
+
+/**
+ * @returns {boolean} false if there was no such block
+ */
+function unblock(blocker, ip) {
+  if (!remove(blocker, ip)) return false;
+  stats.unblocks++;
+  if (bus.clustered) bus.publish('block', { op: 'remove', blocker, ip });
+  return true;
+}
+
+function isBlocked(blocker, ip) {
+  const blockers = bySender.get(ip);
+  return blockers !== undefined && blockers.has(blocker);
+}
+
+// everyone this blocker blocked, keyed by ip; undefined if nobody
+function blockedBy(blocker) {
+  return byBlocker.get(blocker);
+}
+
+// everyone who blocked this sender, keyed by blocker key; undefined for
+// the usual case of nobody
+function blockersOf(ip) {
+  return bySender.get(ip);
+}
+
+// a block by the name the user had when they were blocked, for users who
+// are no longer online
+function findByUsername(blocker, username) {
+  const blocked = byBlocker.get(blocker);
+  if (!blocked) return null;
+
+  const wanted = username.toLowerCase();
+  for (const entry of blocked.values()) {
+    if (entry.username.toLowerCase() === wanted) return entry;
+  }
+  return null;
+}
+
+function durationMs() {
+  return options.durationMs;
+}
+
+function getStats() {
+  return {
+    ...stats,
+    active: wheel.size,
+    blockedSenders: bySender.size,
+    blockers: byBlocker.size,
+    expiry: wheel.getStats(),
+  };
+}
+
+module.exports = {
+  configure,
+  identify,
+  block,
+  unblock,
+  isBlocked,
+  blockersOf,
+  blockedBy,
+  findByUsername,
+  durationMs,
+  getStats,
+};
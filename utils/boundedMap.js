@@ -0,0 +1,103 @@
+// Map with a hard entry ceiling and idle expiry. Entries are kept in
+// least-recently-used order (Map insertion order, refreshed on access), so
+// the oldest entry is evicted first once maxEntries is reached. A periodic
+// sweep drops entries that have not been touched within their ttl.
+// `canEvict` lets the owner pin entries that must not be dropped yet.
+class BoundedMap {
+  constructor({ maxEntries = 10000, ttlMs = 0, sweepIntervalMs = 60000, canEvict = null } = {}) {
+    this.maxEntries = maxEntries;
+    this.ttlMs = ttlMs;
+    this.sweepIntervalMs = sweepIntervalMs;
+    this.canEvict = canEvict;
+    this.map = new Map();
+    this.sweepTimer = null;
+    this.evictions = 0;
+    this.expirations = 0;
+  }
+
+  evictable(entry) {
+    return !this.canEvict || this.canEvict(entry.value);
+  }
+
+  expired(entry, now) {
+    return entry.ttl > 0 && now - entry.touched > entry.ttl && this.evictable(entry);
+  }
+
+  get(key) {
+    const entry = this.map.get(key);
+    if (!entry) return undefined;
+
+    const now = Date.now();
+    if (this.expired(entry, now)) {
+      this.map.delete(key);
+      this.expirations++;
+      return undefined;
+    }
+
+    entry.touched = now;
+    this.map.delete(key);
+    this.map.set(key, entry);
+    return entry.value;
+  }
+
+  has(key) {
+    return this.get(key) !== undefined;
+  }
+
+  set(key, value, ttl = this.ttlMs) {
+    this.map.delete(key);
+    this.map.set(key, { value, ttl, touched: Date.now() });
+
+    if (this.map.size > this.maxEntries) this.evictOldest();
+    if (!this.sweepTimer && this.sweepIntervalMs > 0) this.startSweeper();
+    return this;
+  }
+
+  delete(key) {
+    return this.map.delete(key);
+  }
+
+  evictOldest() {
+    for (const [key, entry] of this.map) {
+      if (this.map.size <= this.maxEntries) return;
+      if (!this.evictable(entry)) continue;
+      this.map.delete(key);
+      this.evictions++;
+    }
+  }
+
+  sweep(now = Date.now()) {
+    for (const [key, entry] of this.map) {
+      if (this.expired(entry, now)) {
+        this.map.delete(key);
+        this.expirations++;
+      }
+    }
+    if (!this.map.size) this.stopSweeper();
+  }
+
+  startSweeper() {
+    this.sweepTimer = setInterval(() => this.sweep(), this.sweepIntervalMs);
+    this.sweepTimer.unref();
+  }
+
+  stopSweeper() {
+    clearInterval(this.sweepTimer);
+    this.sweepTimer = null;
+  }
+
+  get size() {
+    return this.map.size;
+  }
+
+  getStats() {
+    return {
+      size: this.map.size,
+      maxEntries: this.maxEntries,
+      evictions: this.evictions,
+      expirations: this.expirations,
+    };
+  }
+}
+
+module.exports = BoundedMap;
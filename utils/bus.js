@@ -0,0 +1,101 @@
+const cluster = require('cluster');
+const EventEmitter = require('events');
+
+const REQUEST_TIMEOUT_MS = 5000;
+
+// pub/sub between server processes. publish() reaches every *other*
+// process; subscribers never see their own messages, so local delivery
+// stays the caller's job. request() asks the cluster primary something and
+// waits for its answer.
+//
+// any object with the same publish/subscribe/request/clustered surface can
+// be swapped in with use(), e.g. a redis or unix socket transport. it has
+// to happen before anything subscribes.
+
+// single process: nobody else to talk to
+class LocalBus extends EventEmitter {
+  get clustered() {
+    return false;
+  }
+
+  publish() {}
+
+  subscribe(channel, handler) {
+    this.on(channel, handler);
+  }
+
+  request(method) {
+    return Promise.reject(new Error(`No cluster primary to handle ${method}`));
+  }
+}
+
+// cluster worker: the IPC channel to the primary is a unix socket pair,
+// and the primary forwards published messages to every other worker
+class IpcBus extends EventEmitter {
+  constructor() {
+    super();
+    this.pending = new Map();
+    this.nextId = 1;
+
+    process.on('message', (msg) => {
+      if (!msg || !msg.__bus) return;
+
+      if (msg.__bus === 'event') {
+        this.emit(msg.channel, msg.payload, msg.from);
+      } else if (msg.__bus === 'reply') {
+        const request = this.pending.get(msg.id);
+        if (!request) return;
+        this.pending.delete(msg.id);
+        clearTimeout(request.timer);
+        request.resolve(msg.result);
+      }
+    });
+  }
+
+  get clustered() {
+    return true;
+  }
+
+  publish(channel, payload) {
+    process.send({ __bus: 'publish', channel, payload });
+  }
+
+  subscribe(channel, handler) {
+    this.on(channel, handler);
+  }
+
+  request(method, ...args) {
+    return new Promise((resolve, reject) => {
+      const id = this.nextId++;
+      const timer = setTimeout(() => {
+        this.pending.delete(id);
+        reject(new Error(`Cluster request ${method} timed out`));
+      }, REQUEST_TIMEOUT_MS);
+
+      this.pending.set(id, { resolve, timer });
+      process.send({ __bus: 'request', id, method, args });
+    });
+  }
+}
+
+let impl = cluster.isWorker ? new IpcBus() : new LocalBus();
+
+module.exports = {
+  get clustered() {
+    return impl.clustered;
+  },
+  get workerId() {
+    return cluster.isWorker ? cluster.worker.id : 0;
+  },
+  // jobs that must run in exactly one process (retention). the primary
+  // hands the role to one worker and passes it on if that worker dies
+  get runsBackgroundJobs() {
+    return !cluster.isWorker || process.env.CHAT_BACKGROUND_JOBS === '1';
+  },
+  publish: (channel, payload) => impl.publish(channel, payload),
+  subscribe: (channel, handler) => impl.subscribe(channel, handler),
+  request: (method, ...args) => impl.request(method, ...args),
+  use(bus) {
+    impl = bus;
+  },
+};
@@ -0,0 +1,130 @@
+const cluster = require('cluster');
+const os = require('os');
+const logger = require('./logger');
+const configStore = require('./configStore');
+
+const RESPAWN_DELAY_MS = 1000;
+
+// the primary process in cluster mode. it doesn't serve clients itself:
+// it forks the workers (which share the listening port), restarts them if
+// they die, relays bus messages between them, owns the username roster
+// so names stay unique across workers, and is the only writer of the ban
+// list so concurrent bans on different workers can't overwrite each other.
+module.exports = function runClusterPrimary(settings) {
+  const count = settings.cluster.workers || os.availableParallelism?.() || os.cpus().length;
+  const owners = new Map(); // username -> { workerId, ip }
+  let jobsWorkerId = null;
+  let shuttingDown = false;
+
+  const sendAll = (msg, except) => {
+    for (const worker of Object.values(cluster.workers)) {
+      if (worker && worker !== except && worker.isConnected()) worker.send(msg);
+    }
+  };
+
+  const rosterEvent = (payload) => {
+    sendAll({ __bus: 'event', channel: 'roster', payload });
+  };
+
+  const releaseName = (name, workerId) => {
+    const owner = owners.get(name);
+    if (!owner || owner.workerId !== workerId) return;
+    owners.delete(name);
+    rosterEvent({ op: 'remove', name });
+  };
+
+  const handlers = {
+    'roster-snapshot': () => Array.from(owners, ([name, { ip }]) => [name, ip]),
+
+    'roster-claim': (worker, name, ip) => {
+      if (owners.has(name)) return false;
+      owners.set(name, { workerId: worker.id, ip });
+      rosterEvent({ op: 'add', name, ip });
+      return true;
+    },
+
+    'roster-rename': (worker, from, to) => {
+      if (owners.has(to)) return false;
+      const owner = owners.get(from);
+      const ip = owner ? owner.ip : null;
+      if (owner && owner.workerId === worker.id) owners.delete(from);
+      owners.set(to, { workerId: worker.id, ip });
+      rosterEvent({ op: 'rename', name: to, from, ip });
+      return true;
+    },
+
+    'roster-release': (worker, name) => {
+      releaseName(name, worker.id);
+      return true;
+    },
+
+    // writes are queued, so this answers before the file is written
+    'ban-list': (worker, op, username) => {
+      configStore.updateBanFile(op, username);
+      return true;
+    },
+  };
+
+  const fork = () => {
+    const runsJobs = jobsWorkerId === null;
+    const worker = cluster.fork(runsJobs ? { CHAT_BACKGROUND_JOBS: '1' } : {});
+    if (runsJobs) jobsWorkerId = worker.id;
+
+    worker.on('message', (msg) => {
+      if (!msg || !msg.__bus) return;
+
+      if (msg.__bus === 'publish') {
+        sendAll({ __bus: 'event', channel: msg.channel, payload: msg.payload, from: worker.id }, worker);
+        return;
+      }
+
+      if (msg.__bus === 'request') {
+        const handler = handlers[msg.method];
+        const result = handler ? handler(worker, ...msg.args) : null;
+        if (worker.isConnected()) worker.send({ __bus: 'reply', id: msg.id, result });
+      }
+    });
+
+    return worker;
+  };
+
+  cluster.on('exit', (worker, code, signal) => {
+    for (const [name, owner] of owners) {
+      if (owner.workerId === worker.id) releaseName(name, worker.id);
+    }
+
+    sendAll({ __bus: 'event', channel: 'worker-exit', payload: { workerId: worker.id } });
+
+    // its replacement takes over the background jobs
+    if (worker.id === jobsWorkerId) jobsWorkerId = null;
+
+    if (shuttingDown) {
+      if (!Object.keys(cluster.workers).length) process.exit(0);
+      return;
+    }
+
+    logger.warn(`Worker ${worker.id} exited, restarting`, { workerId: worker.id, code, signal });
+    setTimeout(fork, RESPAWN_DELAY_MS);
+  });
+
+  for (let i = 0; i < count; i++) fork();
+  logger.info(`Cluster mode: started ${count} workers`);
+
+  const shutdown = () => {
+    if (shuttingDown) return;
+    shuttingDown = true;
+    logger.info('Shutting down cluster');
+
+    for (const worker of Object.values(cluster.workers)) {
+      if (worker) worker.process.kill('SIGTERM');
+    }
+
+    setTimeout(() => {
+      logger.warn('Force exiting cluster after timeout');
+      process.exit(1);
+    }, 10000).unref();
+  };
+
+  process.on('SIGINT', shutdown);
+  process.on('SIGTERM', shutdown);
+};
@@ -1,15 +1,62 @@
-const fs = require('fs');
-const path = require('path');
-const { clampUsername } = require('./colorUtils');
-const { saveMessage } = require('./db');
+const { clampUsername } = require('./colorutils');
+const { saveMessage, getHistoryFrame } = require('./db');
+const { sendFrame } = require('../handlers/broadcast');
+const bus = require('./bus');
+const roster = require('./roster');
+const rooms = require('./rooms');
+const typing = require('./typing');
+const blocks = require('./blocks');
+const { search, errorText: searchErrorText } = require('./search');
+const logger = require('./logger');
 
 const isIllegalUsername = (username) => {
   return !/^[A-Za-z0-9_-]{3,20}$/.test(username);
 };
 
-const BLOCK_DURATION_MS = 12 * 60 * 60 * 1000; // 12 hours
+// e.g. "12 hours", for block messages
+const blockDurationText = () => {
+  const hours = Math.round(blocks.durationMs() / 3600000);
+  return hours >= 1 ? `${hours} hour${hours === 1 ? '' : 's'}` : `${Math.round(blocks.durationMs() / 60000)} minutes`;
+};
+
+// leave the current room for another: a leave line in the old room, a join
+// line in the new one, and the new room's history for the mover
+const switchRoom = (socket, wss, broadcast, settings, room) => {
+  const now = Date.now();
+  const cooldown = rooms.switchCooldownMs();
+  if (socket.lastRoomSwitch && now - socket.lastRoomSwitch < cooldown) {
+    socket.send(JSON.stringify({ type: 'system', text: 'You are switching rooms too fast. Please wait a few seconds.' }));
+    return;
+  }
 
-const handleCommand = (msg, socket, wss, broadcast, settings, adminUsers) => {
+  const from = socket.room;
+  if (!rooms.join(socket, room)) {
+    socket.send(JSON.stringify({ type: 'system', text: 'Too many rooms are open on this server. Try joining an existing one.' }));
+    return;
+  }
+  socket.lastRoomSwitch = now;
+  typing.clear(from, socket.username);
+
+  const leaveText = `${socket.username} has left.`;
+  broadcast(wss, { type: 'system', room: from, text: leaveText }, settings);
+  saveMessage({ type: 'system', text: leaveText, room: from });
+
+  // the mover sees their own join line at the end of the history
+  const joinText = `${socket.username} has joined.`;
+  broadcast(wss, { type: 'system', room, text: joinText }, settings, socket);
+  saveMessage({ type: 'system', text: joinText, room });
+
+  getHistoryFrame(room).then((frame) => {
+    if (socket.room !== room) return;
+    sendFrame(socket, frame);
+    socket.send(JSON.stringify({ type: 'system', text: `You are now in #${room}.` }));
+  }).catch((err) => {
+    logger.error('Room history error', { err, room });
+    socket.send(JSON.stringify({ type: 'system', text: `You are now in #${room}, but its history could not be loaded.` }));
+  });
+};
+
+const handleCommand = (msg, socket, wss, broadcast, settings, moderation) => {
   const isAuth = settings.authentication;
   const nickChangeCooldown = typeof settings.nickChangeCooldown === 'number' ? settings.nickChangeCooldown : 60000;
 
@@ -39,41 +86,90 @@ const handleCommand = (msg, socket, wss, broadcast, settings, adminUsers) => {
     }
 
     const oldName = socket.username;
-    if (wss.usernames.has(newName)) {
+    if (roster.has(newName)) {
       socket.send(JSON.stringify({ type: 'system', text: `Username "${newName}" is already taken.` }));
       return true;
     }
 
-    socket.username = newName;
+    // hold the cooldown while the rename is in flight so it can't be raced
+    const previousNickChange = socket.lastNickChange;
     socket.lastNickChange = now;
 
-    wss.usernames.delete(oldName);
-    wss.usernames.add(newName);
+    roster.rename(oldName, newName).then((renamed) => {
+      if (!renamed) {
+        socket.lastNickChange = previousNickChange;
+        socket.send(JSON.stringify({ type: 'system', text: `Username "${newName}" is already taken.` }));
+        return;
+      }
+
+      // the close handler already released the old name
+      if (socket.readyState !== socket.OPEN) {
+        roster.release(newName);
+        return;
+      }
+
+      socket.username = newName;
+      typing.clear(socket.room, oldName);
 
-    const nickChangeText = `${oldName} is now ${newName}`;
-    broadcast(wss, { type: 'system', text: nickChangeText });
-    saveMessage({ type: 'system', text: nickChangeText });
+      const nickChangeText = `${oldName} is now ${newName}`;
+      broadcast(wss, { type: 'system', room: socket.room, text: nickChangeText });
+      saveMessage({ type: 'system', text: nickChangeText, room: socket.room });
+    }).catch((err) => {
+      logger.error('Nick change error', { err, from: oldName, to: newName });
+      socket.send(JSON.stringify({ type: 'system', text: 'Nick change failed due to a server error.' }));
+    });
     return true;
   }
 
   if (msg === '/list') {
-    const now = Date.now();
-    const onlineUsers = Array.from(wss.clients)
-      .filter(c => c.username)
-      .map(c => {
-        if (socket.blockedUsers && c._ip && socket.blockedUsers[c._ip]) {
-          if (now - socket.blockedUsers[c._ip] > BLOCK_DURATION_MS) {
-            delete socket.blockedUsers[c._ip];
-            return c.username;
-          }
-          return `[B]${c.username}`;
-        }
-        return c.username;
-      });
+    // the roster has everyone on every worker, with their addresses
+    const blocked = blocks.blockedBy(socket.blockerKey);
+    const onlineUsers = roster.list().map((name) => {
+      if (!blocked) return name;
+      const user = roster.find(name);
+      return blocked.has(user.ip) ? `[B]${name}` : name;
+    });
     socket.send(JSON.stringify({ type: 'system', text: `Online users: ${onlineUsers.join(', ')}` }));
     return true;
   }
 
+  if (msg === '/join' || msg.startsWith('/join ')) {
+    if (!rooms.enabled()) {
+      socket.send(JSON.stringify({ type: 'system', text: 'Rooms are disabled on this server.' }));
+      return true;
+    }
+
+    const arg = msg.slice(5).trim();
+    const room = arg.startsWith('#') ? rooms.normalize(arg) : null;
+    if (!room) {
+      socket.send(JSON.stringify({
+        type: 'system',
+        text: arg
+          ? 'Illegal room name. Must be # followed by 1-32 letters, digits, underscores or dashes.'
+          : `You are in #${socket.room}. Usage: /join #<room>`,
+      }));
+      return true;
+    }
+
+    if (room === socket.room) {
+      socket.send(JSON.stringify({ type: 'system', text: `You are already in #${room}.` }));
+      return true;
+    }
+
+    switchRoom(socket, wss, broadcast, settings, room);
+    return true;
+  }
+
+  if (msg === '/part') {
+    if (socket.room === rooms.DEFAULT_ROOM) {
+      socket.send(JSON.stringify({ type: 'system', text: `You are in #${rooms.DEFAULT_ROOM}, which can't be left.` }));
+      return true;
+    }
+
+    switchRoom(socket, wss, broadcast, settings, rooms.DEFAULT_ROOM);
+    return true;
+  }
+
   if (msg.startsWith('/kick')) {
     if (!isAuth || !socket.isAdmin) {
       socket.send(JSON.stringify({ type: 'system', text: 'You do not have permission to use /kick.' }));
@@ -101,6 +197,11 @@ const handleCommand = (msg, socket, wss, broadcast, settings, adminUsers) => {
       }
     });
 
+    if (!found && bus.clustered && roster.has(target)) {
+      bus.publish('kick', { target, text: 'You have been kicked by an admin.' });
+      found = true;
+    }
+
     if (found) {
       broadcast(wss, { type: 'system', text: `${target} was kicked by ${socket.username}.` });
     } else {
@@ -128,20 +229,11 @@ const handleCommand = (msg, socket, wss, broadcast, settings, adminUsers) => {
       return true;
     }
 
-    const bannedPath = path.join(__dirname, '../banned.json');
-    let bannedUsers = [];
-    if (fs.existsSync(bannedPath)) {
-      bannedUsers = JSON.parse(fs.readFileSync(bannedPath));
-    }
-
-    if (bannedUsers.includes(target)) {
+    if (!moderation.ban(target)) {
       socket.send(JSON.stringify({ type: 'system', text: `${target} is already banned.` }));
       return true;
     }
 
-    bannedUsers.push(target);
-    fs.writeFileSync(bannedPath, JSON.stringify(bannedUsers, null, 2));
-
     let found = false;
     wss.clients.forEach((client) => {
       if (client.username === target && client !== socket) {
@@ -151,6 +243,11 @@ const handleCommand = (msg, socket, wss, broadcast, settings, adminUsers) => {
       }
     });
 
+    if (!found && bus.clustered && roster.has(target)) {
+      bus.publish('kick', { target, text: 'You have been banned by an admin.' });
+      found = true;
+    }
+
     broadcast(wss, { type: 'system', text: `${target} was banned by ${socket.username}.` });
     saveMessage({ type: 'system', text: `${target} was banned by ${socket.username}.` });
 
@@ -179,20 +276,11 @@ const handleCommand = (msg, socket, wss, broadcast, settings, adminUsers) => {
       return true;
     }
 
-    const bannedPath = path.join(__dirname, '../banned.json');
-    let bannedUsers = [];
-    if (fs.existsSync(bannedPath)) {
-      bannedUsers = JSON.parse(fs.readFileSync(bannedPath));
-    }
-
-    if (!bannedUsers.includes(target)) {
+    if (!moderation.unban(target)) {
       socket.send(JSON.stringify({ type: 'system', text: `${target} is not banned.` }));
       return true;
     }
 
-    bannedUsers = bannedUsers.filter(user => user !== target);
-    fs.writeFileSync(bannedPath, JSON.stringify(bannedUsers, null, 2));
-
     socket.send(JSON.stringify({ type: 'system', text: `${target} has been unbanned.` }));
     broadcast(wss, { type: 'system', text: `${target} was unbanned by ${socket.username}.` });
     saveMessage({ type: 'system', text: `${target} was unbanned by ${socket.username}.` });
@@ -201,29 +289,31 @@ const handleCommand = (msg, socket, wss, broadcast, settings, adminUsers) => {
   }
 
   if (msg.startsWith('/block')) {
-    const targetRaw = msg.slice(6).trim().toLowerCase();
+    const targetRaw = msg.slice(6).trim();
     if (!targetRaw) {
       socket.send(JSON.stringify({ type: 'system', text: 'Usage: /block <username>' }));
       return true;
     }
 
-    if (targetRaw === socket.username?.toLowerCase()) {
+    if (targetRaw.toLowerCase() === socket.username?.toLowerCase()) {
       socket.send(JSON.stringify({ type: 'system', text: 'You cannot block yourself.' }));
       return true;
     }
 
-    const targetSocket = Array.from(wss.clients).find(
-      c => c.username?.toLowerCase() === targetRaw
-    );
+    // anyone online on any worker, not just sockets on this one
+    const target = roster.find(targetRaw);
 
-    if (!targetSocket?._ip) {
+    if (!target?.ip) {
       socket.send(JSON.stringify({ type: 'system', text: `User "${targetRaw}" not found.` }));
       return true;
     }
 
-    if (!socket.blockedUsers) socket.blockedUsers = {};
-    socket.blockedUsers[targetSocket._ip] = Date.now();
-    socket.send(JSON.stringify({ type: 'system', text: `You have blocked ${targetSocket.username} for 12 hours.` }));
+    if (!blocks.block(socket.blockerKey, target.ip, target.username)) {
+      socket.send(JSON.stringify({ type: 'system', text: 'You have blocked too many users. /unblock someone first.' }));
+      return true;
+    }
+
+    socket.send(JSON.stringify({ type: 'system', text: `You have blocked ${target.username} for ${blockDurationText()}.` }));
     return true;
   }
 
@@ -234,17 +324,76 @@ const handleCommand = (msg, socket, wss, broadcast, settings, adminUsers) => {
       return true;
     }
 
-    const targetSocket = Array.from(wss.clients).find(
-      c => c.username?.toLowerCase() === targetRaw
-    );
+    // whoever is online under that name, or failing that the name they
+    // had when they were blocked
+    const online = roster.find(targetRaw);
+    const target = online?.ip && blocks.isBlocked(socket.blockerKey, online.ip)
+      ? online
+      : blocks.findByUsername(socket.blockerKey, targetRaw);
 
-    if (!targetSocket?._ip || !socket.blockedUsers?.[targetSocket._ip]) {
+    if (!target) {
       socket.send(JSON.stringify({ type: 'system', text: `${targetRaw} was not blocked.` }));
       return true;
     }
 
-    delete socket.blockedUsers[targetSocket._ip];
-    socket.send(JSON.stringify({ type: 'system', text: `You have unblocked ${targetSocket.username}.` }));
+    blocks.unblock(socket.blockerKey, target.ip);
+    socket.send(JSON.stringify({ type: 'system', text: `You have unblocked ${target.username}.` }));
+    return true;
+  }
+
+  if (/^\/search(\s|$)/.test(msg)) {
+    // s: a query can span lines
+    const match = msg.slice(7).trim().match(/^(.*?)(?:\s+-p\s+(\d+))?$/s);
+    const [, query, pageArg] = match || [];
+
+    if (!query) {
+      socket.send(JSON.stringify({ type: 'system', text: 'Usage: /search <words> [-p <page>]' }));
+      return true;
+    }
+
+    // one search per socket at a time, shared with search-request
+    if (socket.searchPending) {
+      socket.send(JSON.stringify({ type: 'system', text: 'A search is already running. Please wait for its results.' }));
+      return true;
+    }
+    socket.searchPending = true;
+
+    search(query, { page: Number(pageArg) || 1, room: socket.room })
+      .then(({ results, page, hasMore }) => {
+        if (!results.length) {
+          socket.send(JSON.stringify({ type: 'system', text: `No messages match "${query}".` }));
+          return;
+        }
+
+        const lines = results.map((r) => `[${r.timestamp}] ${r.username}: ${r.text}`);
+        lines.unshift(`Search results for "${query}" (page ${page}):`);
+        if (hasMore) lines.push(`More: /search ${query} -p ${page + 1}`);
+
+        socket.send(JSON.stringify({ type: 'system', text: lines.join('\n') }));
+      })
+      .catch((err) => {
+        socket.send(JSON.stringify({ type: 'system', text: searchErrorText(err) }));
+      })
+      .finally(() => {
+        socket.searchPending = false;
+      });
+
+    return true;
+  }
+
+  if (msg === '/logs' || msg.startsWith('/logs ')) {
+    if (!isAuth || !socket.isAdmin) {
+      socket.send(JSON.stringify({ type: 'system', text: 'You do not have permission to use /logs.' }));
+      return true;
+    }
+
+    const count = Math.min(parseInt(msg.slice(5).trim(), 10) || 20, 100);
+    const lines = logger.recent(count);
+
+    socket.send(JSON.stringify({
+      type: 'system',
+      text: lines.length ? lines.join('\n') : 'No log lines yet.',
+    }));
     return true;
   }
 
@@ -252,11 +401,15 @@ const handleCommand = (msg, socket, wss, broadcast, settings, adminUsers) => {
     const helpText = [
       '/nick <name> - Change your nickname (disabled if authentication is enabled).',
       '/list - List online users.',
+      '/join #<room> - Move to another room, creating it if nobody is in it.',
+      `/part - Leave your room and go back to #${rooms.DEFAULT_ROOM}.`,
       '/kick <username> - Kick a user (admins only).',
       '/ban <username> - Ban a user (admins only).',
       '/unban <username> - Unban a user (admins only).',
-      '/block <username> - Block a user for 12 hours.',
+      '/logs [count] - Show recent server log lines on this worker (admins only).',
+      `/block <username> - Block a user for ${blockDurationText()}.`,
       '/unblock <username> - Unblock a user.',
+      '/search <words> [-p <page>] - Search past chat messages in your room.',
       '/help - Show this help message.'
     ].join('\n');
 
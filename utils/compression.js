@@ -0,0 +1,138 @@
+const zlib = require('zlib');
+
+// permessage-deflate policy and accounting. ws does the actual
+// compression; this decides who gets it and estimates what it costs.
+//
+// ws compresses per socket, so a broadcast is deflated once for every
+// compressed recipient. to keep that bounded: frames under `threshold`
+// bytes go out as is, no context takeover means no zlib window has to
+// be kept between messages, and at most `maxClients` sockets get the
+// extension at all.
+
+const DEFAULTS = {
+  enabled: true,
+  threshold: 1024,
+  level: 6,
+  memLevel: 4,
+  windowBits: 10,
+  concurrency: 4,
+  maxClients: 1000,
+  sampleEvery: 50,
+};
+
+const options = { ...DEFAULTS };
+
+const stats = {
+  compressedClients: 0,
+  declined: 0,
+  framesObserved: 0,
+  bytesObserved: 0,
+  distinctFrames: 0,
+  sampledFrames: 0,
+  sampledBytesIn: 0,
+  sampledBytesOut: 0,
+  sampledCpuMs: 0,
+};
+
+function configure(settings = {}) {
+  for (const key of Object.keys(DEFAULTS)) {
+    if (settings[key] !== undefined) options[key] = settings[key];
+  }
+}
+
+/**
+ * Options for WebSocket.Server's perMessageDeflate, or false.
+ */
+function serverOptions() {
+  if (!options.enabled) return false;
+
+  return {
+    threshold: options.threshold,
+    concurrencyLimit: options.concurrency,
+    serverNoContextTakeover: true,
+    clientNoContextTakeover: true,
+    serverMaxWindowBits: options.windowBits,
+    zlibDeflateOptions: {
+      level: options.level,
+      memLevel: options.memLevel,
+    },
+  };
+}
+
+/**
+ * Called on upgrade. Strips the client's extension offer when it opted
+ * out with ?compress=off or the compressed client cap is reached, so ws
+ * negotiates an uncompressed connection.
+ */
+function admit(request) {
+  if (!options.enabled || !request.headers['sec-websocket-extensions']) return;
+
+  const { query } = require('url').parse(request.url, true);
+
+  if (query.compress === 'off' || stats.compressedClients >= options.maxClients) {
+    delete request.headers['sec-websocket-extensions'];
+    stats.declined++;
+  }
+}
+
+function track(socket) {
+  socket.compressed = typeof socket.extensions === 'string' &&
+    socket.extensions.includes('permessage-deflate');
+
+  if (!socket.compressed) return;
+
+  stats.compressedClients++;
+  socket.once('close', () => { stats.compressedClients--; });
+}
+
+// one frame about to go through a compressed socket. `fresh` is true the
+// first time a given frame is sent; a broadcast hands the same buffer to
+// every recipient, so only every `sampleEvery`th fresh one is deflated
+// here as well, with the same settings, to estimate the ratio and cpu
+// cost that ws is paying. that keeps the synchronous sample off the
+// per-recipient path
+function observe(payload, fresh = true) {
+  if (payload.length < options.threshold) return;
+
+  stats.framesObserved++;
+  stats.bytesObserved += payload.length;
+
+  if (!fresh) return;
+  stats.distinctFrames++;
+  if (stats.distinctFrames % options.sampleEvery !== 0) return;
+
+  const started = process.hrtime.bigint();
+  const out = zlib.deflateRawSync(payload, {
+    level: options.level,
+    memLevel: options.memLevel,
+    windowBits: options.windowBits,
+  });
+
+  stats.sampledCpuMs += Number(process.hrtime.bigint() - started) / 1e6;
+  stats.sampledFrames++;
+  stats.sampledBytesIn += payload.length;
+  stats.sampledBytesOut += out.length;
+}
+
+function getStats() {
+  const ratio = stats.sampledBytesIn ? stats.sampledBytesOut / stats.sampledBytesIn : null;
+
+  return {
+    enabled: options.enabled,
+    threshold: options.threshold,
+    maxClients: options.maxClients,
+    ...stats,
+    ratio,
+    cpuMsPerMB: stats.sampledBytesIn ? stats.sampledCpuMs / (stats.sampledBytesIn / 1048576) : null,
+    estimatedBytesSaved: ratio === null ? 0 : Math.round(stats.bytesObserved * (1 - ratio)),
+  };
+}
+
+module.exports = {
+  configure,
+  serverOptions,
+  admit,
+  track,
+  observe,
+  getStats,
+};
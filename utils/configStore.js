@@ -0,0 +1,184 @@
+const fs = require('fs');
+const path = require('path');
+const bus = require('./bus');
+const logger = require('./logger');
+
+const ROOT = path.join(__dirname, '..');
+const SETTINGS_FILE = 'settings.json';
+const BANNED_FILE = 'banned.json';
+const ADMINS_FILE = 'admins.json';
+
+const RELOAD_DEBOUNCE_MS = 200;
+
+// settings is mutated in place on reload, so anything holding a reference
+// to it (handlers, the webrtc sfu, server info) always sees current values
+const settings = {};
+let bannedUsers = new Set();
+let adminUsers = new Set();
+
+let watcher = null;
+let reloadTimer = null;
+let changedFiles = new Set();
+let pendingWrites = 0;
+let writeChain = Promise.resolve();
+
+const filePath = (name) => path.join(ROOT, name);
+
+function readJsonSync(name, fallback) {
+  const file = filePath(name);
+  if (!fs.existsSync(file)) return fallback;
+  return JSON.parse(fs.readFileSync(file));
+}
+
+async function readJson(name, fallback) {
+  try {
+    return JSON.parse(await fs.promises.readFile(filePath(name)));
+  } catch (err) {
+    if (err.code === 'ENOENT') return fallback;
+    throw err;
+  }
+}
+
+function replaceSettings(next) {
+  for (const key of Object.keys(settings)) delete settings[key];
+  Object.assign(settings, next);
+}
+
+/**
+ * Read settings, bans and admins from disk. Called once at startup.
+ */
+function load() {
+  replaceSettings(readJsonSync(SETTINGS_FILE, { authentication: false }));
+  bannedUsers = new Set(readJsonSync(BANNED_FILE, []));
+  adminUsers = new Set(readJsonSync(ADMINS_FILE, []));
+}
+
+async function reload(files) {
+  try {
+    if (files.has(SETTINGS_FILE)) {
+      replaceSettings(await readJson(SETTINGS_FILE, { authentication: false }));
+    }
+    if (files.has(BANNED_FILE)) {
+      bannedUsers = new Set(await readJson(BANNED_FILE, []));
+    }
+    if (files.has(ADMINS_FILE)) {
+      adminUsers = new Set(await readJson(ADMINS_FILE, []));
+    }
+  } catch (err) {
+    // half-written or hand-edited file; keep what we have until it parses
+    logger.error('Config reload error', { err });
+  }
+}
+
+function scheduleReload(name) {
+  changedFiles.add(name);
+  clearTimeout(reloadTimer);
+  reloadTimer = setTimeout(() => {
+    // our own ban list write is still landing, the file may be stale
+    if (pendingWrites > 0) return scheduleReload(name);
+
+    const files = changedFiles;
+    changedFiles = new Set();
+    reload(files);
+  }, RELOAD_DEBOUNCE_MS);
+}
+
+/**
+ * Watch the config files for edits and reload them (debounced).
+ * The directory is watched rather than the files so that editors and
+ * our own write-then-rename persistence don't orphan the watcher.
+ */
+function watch() {
+  if (watcher) return;
+
+  const tracked = new Set([SETTINGS_FILE, BANNED_FILE, ADMINS_FILE]);
+
+  watcher = fs.watch(ROOT, (event, filename) => {
+    if (!filename) {
+      tracked.forEach(scheduleReload);
+    } else if (tracked.has(filename)) {
+      scheduleReload(filename);
+    }
+  });
+  watcher.unref();
+}
+
+// the ban list is re-read and changed one entry at a time rather than
+// overwritten with what this process has in memory, so bans made elsewhere
+// (another worker, a hand edit) since our last reload survive. in cluster
+// mode only the primary calls this, so writes never race each other
+function updateBanFile(op, username) {
+  const file = filePath(BANNED_FILE);
+  const tmp = `${file}.${process.pid}.tmp`;
+
+  pendingWrites++;
+  writeChain = writeChain
+    .then(() => readJson(BANNED_FILE, []))
+    .then((list) => {
+      const names = new Set(list);
+      if (op === 'ban') names.add(username);
+      if (op === 'unban') names.delete(username);
+      return fs.promises.writeFile(tmp, JSON.stringify(Array.from(names), null, 2));
+    })
+    .then(() => fs.promises.rename(tmp, file))
+    .catch((err) => logger.error(`Failed to write ${BANNED_FILE}`, { err }))
+    .finally(() => { pendingWrites--; });
+
+  return writeChain;
+}
+
+function persistBan(op, username) {
+  if (!bus.clustered) return updateBanFile(op, username);
+
+  return bus.request('ban-list', op, username)
+    .catch((err) => logger.error(`Failed to write ${BANNED_FILE}`, { err }));
+}
+
+function isBanned(username) {
+  return bannedUsers.has(username);
+}
+
+function isAdmin(username) {
+  return adminUsers.has(username);
+}
+
+/**
+ * Add a user to the ban list and persist it in the background.
+ * @returns {boolean} false if the user was already banned
+ */
+function ban(username) {
+  if (bannedUsers.has(username)) return false;
+  bannedUsers.add(username);
+  persistBan('ban', username);
+  if (bus.clustered) bus.publish('moderation', { op: 'ban', username });
+  return true;
+}
+
+/**
+ * Remove a user from the ban list and persist it in the background.
+ * @returns {boolean} false if the user was not banned
+ */
+function unban(username) {
+  if (!bannedUsers.delete(username)) return false;
+  persistBan('unban', username);
+  if (bus.clustered) bus.publish('moderation', { op: 'unban', username });
+  return true;
+}
+
+// the primary writes the file for whichever worker banned; mirror the
+// change so it applies here before the watcher catches up
+bus.subscribe('moderation', ({ op, username }) => {
+  if (op === 'ban') bannedUsers.add(username);
+  if (op === 'unban') bannedUsers.delete(username);
+});
+
+module.exports = {
+  settings,
+  load,
+  watch,
+  isBanned,
+  isAdmin,
+  ban,
+  unban,
+  updateBanFile,
+};
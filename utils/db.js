@@ -1,11 +1,100 @@
 const sqlite3 = require('sqlite3').verbose();
 const path = require('path');
+const HistoryRing = require('./history');
+const bus = require('./bus');
+const rooms = require('./rooms');
+const metrics = require('./metrics');
+const logger = require('./logger');
 
-const dbPath = path.join(__dirname, '../chat.db');
+// CHAT_DB_PATH points the server (and the benchmarks) at another file
+const dbPath = process.env.CHAT_DB_PATH || path.join(__dirname, '../chat.db');
 
 const db = new sqlite3.Database(dbPath);
 
+// sqlite caps bound parameters per statement, so big batches are split
+const ROWS_PER_INSERT = 200;
+
+const options = {
+  batchSize: 200,        // flush as soon as this many messages are waiting
+  flushIntervalMs: 250,  // ...or after this long, whichever comes first
+  maxPending: 5000,      // refuse new messages once this many are waiting
+  maxRetries: 3,         // a batch that fails this many more times is dropped
+};
+
+const stats = {
+  flushes: 0,
+  rowsWritten: 0,
+  lastBatchSize: 0,
+  maxBatchSize: 0,
+  lastFlushMs: 0,
+  maxFlushMs: 0,
+  totalFlushMs: 0,
+  rejected: 0,
+  errors: 0,
+  dropped: 0,
+};
+
+const HISTORY_SIZE = 100;
+const MAX_PAGE_SIZE = 100;
+
+// schema changes after the base table, applied in order and tracked with
+// PRAGMA user_version. only ever append
+const MIGRATIONS = [
+  // 1: full-text index over chat text. external content, so the text
+  // isn't stored twice; triggers keep it in step with every insert and
+  // delete, including the write-behind batches and retention
+  `
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(text, content='messages', content_rowid='id');
+    CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages WHEN new.type = 'chat' BEGIN
+      INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text);
+    END;
+    CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages WHEN old.type = 'chat' BEGIN
+      INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END;
+    INSERT INTO messages_fts (rowid, text) SELECT id, text FROM messages WHERE type = 'chat';
+  `,
+  // 2: rooms. every room is its own slice of the table through the
+  // (room, id) index, and rows from before rooms belong to the default one
+  `
+    ALTER TABLE messages ADD COLUMN room TEXT NOT NULL DEFAULT '${rooms.DEFAULT_ROOM}';
+    CREATE INDEX IF NOT EXISTS idx_messages_room_id ON messages (room, id);
+    CREATE INDEX IF NOT EXISTS idx_messages_room_username_id ON messages (room, username, id);
+    DROP INDEX IF EXISTS idx_messages_username_id;
+  `,
+];
+
+// a history ring per room with members on this process, each with the
+// promise of its first load from the database. a room's ring goes away
+// with its last local member and is loaded again on the next join
+const rings = new Map();
+
+const flushSeconds = metrics.histogram(
+  'chat_db_flush_seconds',
+  'Time to write one batch of messages in a single transaction',
+  [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1]
+);
+const rowsWritten = metrics.counter('chat_db_rows_written_total', 'Messages written to the database');
+const rowsRejected = metrics.counter('chat_db_rows_rejected_total', 'Messages refused because the write buffer was full');
+const rowsDropped = metrics.counter('chat_db_rows_dropped_total', 'Messages given up on after every write attempt failed');
+metrics.gauge('chat_db_write_queue_depth', 'Messages waiting to be written', () => pending.length);
+
+let pending = [];
+let flushing = null;
+let flushTimer = null;
+let retries = 0;
+let closed = false;
+let schemaReady;
+let pageStatement;
+let userPageStatement;
+
 db.serialize(() => {
+  // only takes effect on a new database file; retention relies on it to
+  // hand freed pages back to the filesystem a few at a time
+  db.run('PRAGMA auto_vacuum = INCREMENTAL');
+  db.run('PRAGMA journal_mode = WAL');
+  db.run('PRAGMA synchronous = NORMAL');
+  db.run('PRAGMA temp_store = MEMORY');
+  db.run('PRAGMA busy_timeout = 5000');
   db.run(`
     CREATE TABLE IF NOT EXISTS messages (
       id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -15,23 +104,258 @@ db.serialize(() => {
       timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
     )
   `);
+  db.run('CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp)');
+
+  // the statements need the room column, so they wait for the migrations.
+  // history paging walks backwards from a cursor through the (room, id)
+  // index, or (room, username, id) when filtering by user
+  schemaReady = migrate().then(() => {
+    pageStatement = db.prepare(
+      'SELECT id, type, username, text, timestamp, room FROM messages WHERE room = ? AND id < ? ORDER BY id DESC LIMIT ?'
+    );
+    userPageStatement = db.prepare(
+      'SELECT id, type, username, text, timestamp, room FROM messages WHERE room = ? AND username = ? AND id < ? ORDER BY id DESC LIMIT ?'
+    );
+  });
 });
 
-function saveMessage({ type = 'chat', username = null, text }) {
-  db.run(
-    'INSERT INTO messages (type, username, text) VALUES (?, ?, ?)',
-    [type, username, text],
-    (err) => {
-      if (err) console.error('DB insert error:', err);
+rooms.onEmpty((room) => rings.delete(room));
+
+// BEGIN IMMEDIATE takes the write lock before user_version is read, so
+// cluster workers starting together don't both run the same migration.
+// a failed migration rejects: nothing after it works on the old schema
+function migrate() {
+  return new Promise((resolve, reject) => {
+    const fail = (err) => {
+      logger.error('DB migration error', { err });
+      db.run('ROLLBACK', () => reject(err));
+    };
+
+    db.run('BEGIN IMMEDIATE', (err) => {
+      if (err) {
+        logger.error('DB migration error', { err });
+        return reject(err);
+      }
+
+      db.get('PRAGMA user_version', (err, row) => {
+        if (err) return fail(err);
+
+        const from = row.user_version;
+        if (from >= MIGRATIONS.length) return db.run('COMMIT', () => resolve());
+
+        logger.info(`Migrating chat database from version ${from} to ${MIGRATIONS.length}`);
+        const sql = MIGRATIONS.slice(from).join('\n') + `PRAGMA user_version = ${MIGRATIONS.length};`;
+
+        db.exec(sql, (err) => {
+          if (err) return fail(err);
+          db.run('COMMIT', (err) => (err ? fail(err) : resolve()));
+        });
+      });
+    });
+  });
+}
+
+// same format sqlite uses for CURRENT_TIMESTAMP, so old and new rows match
+function toSqlTimestamp(date) {
+  return date.toISOString().replace('T', ' ').slice(0, 19);
+}
+
+function configure(overrides = {}) {
+  Object.assign(options, overrides);
+}
+
+function scheduleFlush() {
+  if (flushTimer || flushing) return;
+  flushTimer = setTimeout(flush, options.flushIntervalMs);
+}
+
+// one statement inserts its rows with consecutive ids ending at lastID.
+// the rows are the same objects the history ring holds, so they pick up
+// their ids there too
+function insertChunk(rows, done) {
+  const placeholders = rows.map(() => '(?, ?, ?, ?, ?)').join(', ');
+  const params = [];
+  for (const row of rows) {
+    params.push(row.type, row.username, row.text, row.timestamp, row.room);
+  }
+  db.run(`INSERT INTO messages (type, username, text, timestamp, room) VALUES ${placeholders}`, params, function (err) {
+    if (err) return done(err);
+    const firstId = this.lastID - rows.length + 1;
+    rows.forEach((row, i) => { row.id = firstId + i; });
+    done(null);
+  });
+}
+
+// batch rows were changed in place (given or stripped of their ids)
+function invalidateRings(batch) {
+  for (const room of new Set(batch.map((row) => row.room))) {
+    const entry = rings.get(room);
+    if (entry) entry.ring.invalidate();
+  }
+}
+
+// the whole batch is written or none of it is: if any statement fails the
+// transaction is rolled back and the promise rejects, so flush() can retry
+function writeBatch(batch) {
+  return new Promise((resolve, reject) => {
+    const started = process.hrtime.bigint();
+    let failure = null;
+
+    const failed = (err) => {
+      if (!err) return;
+      stats.errors++;
+      logger.error('DB write error', { err });
+      if (!failure) failure = err;
+    };
+
+    const rollback = () => {
+      // ids from chunks that did go in are gone with the transaction
+      for (const row of batch) row.id = undefined;
+      invalidateRings(batch);
+      db.run('ROLLBACK', () => reject(failure));
+    };
+
+    const chunks = [];
+    for (let i = 0; i < batch.length; i += ROWS_PER_INSERT) {
+      chunks.push(batch.slice(i, i + ROWS_PER_INSERT));
     }
-  );
+
+    const commit = () => {
+      if (failure) return rollback();
+
+      db.run('COMMIT', (err) => {
+        if (err) {
+          failed(err);
+          rollback();
+          return;
+        }
+
+        const elapsedMs = Number(process.hrtime.bigint() - started) / 1e6;
+        stats.flushes++;
+        stats.rowsWritten += batch.length;
+        stats.lastBatchSize = batch.length;
+        stats.maxBatchSize = Math.max(stats.maxBatchSize, batch.length);
+        stats.lastFlushMs = elapsedMs;
+        stats.maxFlushMs = Math.max(stats.maxFlushMs, elapsedMs);
+        stats.totalFlushMs += elapsedMs;
+        flushSeconds.observeMs(elapsedMs);
+        rowsWritten.inc(batch.length);
+        invalidateRings(batch);
+        resolve();
+      });
+    };
+
+    db.serialize(() => {
+      db.run('BEGIN', failed);
+      chunks.forEach((rows, i) => insertChunk(rows, (err) => {
+        failed(err);
+        // statements answer in order, so this is the last one
+        if (i === chunks.length - 1) commit();
+      }));
+    });
+  });
 }
 
-function getRecentMessages(limit = 100) {
+// a failed batch goes back to the front of the queue, so message order is
+// kept, and is tried again on the next flush. after maxRetries more
+// failures it is dropped, along with the history rings that still hold
+// it; they reload from the database, so history agrees with what paging
+// and search can find
+function requeue(batch) {
+  retries++;
+  if (retries <= options.maxRetries) {
+    pending = batch.concat(pending);
+    return true;
+  }
+
+  retries = 0;
+  stats.dropped += batch.length;
+  rowsDropped.inc(batch.length);
+  logger.error(`DB write failed ${options.maxRetries + 1} times, dropping ${batch.length} messages`);
+  for (const room of new Set(batch.map((row) => row.room))) rings.delete(room);
+  return false;
+}
+
+/**
+ * Write everything that is currently buffered in one transaction.
+ * @returns {Promise<void>} resolves once the buffer has been drained
+ */
+function flush() {
+  if (flushTimer) {
+    clearTimeout(flushTimer);
+    flushTimer = null;
+  }
+
+  if (flushing) return flushing.then(flush);
+  if (!pending.length) return Promise.resolve();
+
+  const batch = pending;
+  pending = [];
+
+  // nothing is written while a migration holds the transaction
+  flushing = schemaReady.then(() => writeBatch(batch)).then(() => {
+    retries = 0;
+    return false;
+  }, () => requeue(batch)).then((retrying) => {
+    flushing = null;
+    // on shutdown keep going until everything is written or dropped
+    if (closed && pending.length) return flush();
+
+    // a retry waits a flush interval rather than hammering a failing database
+    if (!retrying && pending.length >= options.batchSize) {
+      flush();
+    } else if (pending.length) {
+      scheduleFlush();
+    }
+  });
+
+  return flushing;
+}
+
+function remember(row) {
+  const entry = rings.get(row.room);
+  if (entry) entry.ring.push(row);
+}
+
+/**
+ * Queue a message for persistence.
+ * @returns {boolean} false if the write buffer is full and the message was refused
+ */
+function saveMessage({ type = 'chat', username = null, text, timestamp, room = rooms.DEFAULT_ROOM }) {
+  if (closed || pending.length >= options.maxPending) {
+    stats.rejected++;
+    rowsRejected.inc();
+    return false;
+  }
+
+  const row = {
+    type,
+    username,
+    text,
+    timestamp: toSqlTimestamp(timestamp ? new Date(timestamp) : new Date()),
+    room,
+  };
+
+  pending.push(row);
+  remember(row);
+  if (bus.clustered) bus.publish('history', row);
+
+  if (pending.length >= options.batchSize) {
+    flush();
+  } else {
+    scheduleFlush();
+  }
+  return true;
+}
+
+// rows saved by other cluster workers; they write them, we only remember them
+bus.subscribe('history', remember);
+
+function getRecentMessages(limit = 100, room = rooms.DEFAULT_ROOM) {
   return new Promise((resolve, reject) => {
     db.all(
-      `SELECT type, username, text, timestamp FROM messages ORDER BY id DESC LIMIT ?`,
-      [limit],
+      `SELECT id, type, username, text, timestamp, room FROM messages WHERE room = ? ORDER BY id DESC LIMIT ?`,
+      [room, limit],
       (err, rows) => {
         if (err) {
           reject(err);
@@ -40,10 +364,12 @@ function getRecentMessages(limit = 100) {
             rows
               .reverse()
               .map((row) => ({
+                id: row.id,
                 type: row.type,
                 username: row.username,
                 text: row.text,
                 timestamp: row.timestamp,
+                room: row.room,
               }))
           );
         }
@@ -52,7 +378,109 @@ function getRecentMessages(limit = 100) {
   });
 }
 
+/**
+ * One page of older history, newest first in the database but returned
+ * oldest first like the `history` frame.
+ * @param {object} cursor
+ * @param {number} [cursor.beforeId] only rows with a smaller id; omit for the newest rows
+ * @param {number} [cursor.limit] rows per page, capped at 100
+ * @param {string} [cursor.username] only this user's rows
+ * @param {string} [cursor.room] the room to page through
+ * @returns {Promise<{messages: object[], hasMore: boolean}>}
+ */
+function getHistoryPage({ beforeId, limit = 50, username, room = rooms.DEFAULT_ROOM } = {}) {
+  const pageSize = Math.min(Math.max(1, Math.floor(limit) || 1), MAX_PAGE_SIZE);
+  const cursor = Number.isSafeInteger(beforeId) && beforeId > 0 ? beforeId : Number.MAX_SAFE_INTEGER;
+
+  // one extra row tells us whether there is another page
+  const params = username ? [room, username, cursor, pageSize + 1] : [room, cursor, pageSize + 1];
+
+  return schemaReady.then(() => new Promise((resolve, reject) => {
+    const statement = username ? userPageStatement : pageStatement;
+    statement.all(params, (err, rows) => {
+      if (err) return reject(err);
+
+      const hasMore = rows.length > pageSize;
+      if (hasMore) rows.pop();
+
+      resolve({ messages: rows.reverse(), hasMore });
+    });
+  }));
+}
+
+// buffered rows are written first so the load sees them; seed() drops
+// the ones that were also pushed in the meantime
+function ringFor(room) {
+  let entry = rings.get(room);
+  if (!entry) {
+    const ring = new HistoryRing(HISTORY_SIZE, room);
+    const ready = schemaReady
+      .then(() => flush())
+      .then(() => getRecentMessages(HISTORY_SIZE, room))
+      .then((messages) => ring.seed(messages))
+      .catch((err) => logger.error('DB history load error', { err, room }));
+    entry = { ring, ready };
+    // the client may have gone again already; nothing would remove it
+    if (rooms.membersOf(room).size) rings.set(room, entry);
+  }
+  return entry;
+}
+
+/**
+ * Encoded `history` frame for a client joining a room. Joins are served
+ * from memory; the database is only read when a room gets its first
+ * member on this process.
+ * @returns {Promise<object>} frame for broadcast.sendFrame
+ */
+function getHistoryFrame(room = rooms.DEFAULT_ROOM) {
+  const entry = ringFor(room);
+  return entry.ready.then(() => entry.ring.getFrame());
+}
+
+/**
+ * Resolves once schema migrations have finished; rejects if one failed.
+ * @returns {Promise<void>}
+ */
+function ready() {
+  return schemaReady;
+}
+
+function getStats() {
+  return {
+    ...stats,
+    pending: pending.length,
+    avgBatchSize: stats.flushes ? stats.rowsWritten / stats.flushes : 0,
+    avgFlushMs: stats.flushes ? stats.totalFlushMs / stats.flushes : 0,
+  };
+}
+
+/**
+ * Flush whatever is buffered and close the database.
+ * @returns {Promise<void>}
+ */
+function close() {
+  closed = true;
+  // with a failed migration the statements were never prepared
+  return flush().then(() => schemaReady).catch(() => {}).then(() => new Promise((resolve) => {
+    if (pageStatement) pageStatement.finalize();
+    if (userPageStatement) userPageStatement.finalize();
+    db.close((err) => {
+      if (err) logger.error('DB close error', { err });
+      resolve();
+    });
+  }));
+}
+
 module.exports = {
+  dbPath,
+  ready,
+  toSqlTimestamp,
+  configure,
   saveMessage,
   getRecentMessages,
+  getHistoryFrame,
+  getHistoryPage,
+  flush,
+  getStats,
+  close,
 };
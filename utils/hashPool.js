@@ -0,0 +1,155 @@
+const path = require('path');
+const { Worker } = require('worker_threads');
+const metrics = require('./metrics');
+
+const WORKER_PATH = path.join(__dirname, 'hashWorker.js');
+
+const options = {
+  workers: 2,    // dedicated bcrypt threads
+  maxQueue: 32,  // jobs allowed to wait for a free thread before new ones are refused
+};
+
+const stats = {
+  completed: 0,
+  rejected: 0,
+  failed: 0,
+  lastLatencyMs: 0,
+  maxLatencyMs: 0,
+  totalLatencyMs: 0,
+};
+
+const hashSeconds = metrics.histogram(
+  'chat_bcrypt_seconds',
+  'Password hash and compare latency, including time queued for a thread',
+  [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5]
+);
+const hashRejected = metrics.counter('chat_bcrypt_rejected_total', 'Hash jobs refused because the queue was full');
+
+const idle = [];
+const busy = new Map(); // worker -> job
+const queue = [];
+let workerCount = 0;
+let nextId = 1;
+
+metrics.gauge('chat_bcrypt_queue_depth', 'Hash jobs waiting for a thread', () => queue.length);
+
+function configure({ workers, maxQueue } = {}) {
+  if (workers) options.workers = workers;
+  if (maxQueue) options.maxQueue = maxQueue;
+}
+
+function spawnWorker() {
+  const worker = new Worker(WORKER_PATH);
+  workerCount++;
+
+  worker.on('message', ({ error, result }) => {
+    const job = busy.get(worker);
+    busy.delete(worker);
+    finish(job, error ? new Error(error) : null, result);
+    release(worker);
+  });
+
+  worker.on('error', (err) => {
+    const job = busy.get(worker);
+    busy.delete(worker);
+    if (job) finish(job, err);
+  });
+
+  worker.on('exit', () => {
+    workerCount--;
+    busy.delete(worker);
+    const i = idle.indexOf(worker);
+    if (i !== -1) idle.splice(i, 1);
+    drain();
+  });
+
+  return worker;
+}
+
+function finish(job, err, result) {
+  const latencyMs = Number(process.hrtime.bigint() - job.queuedAt) / 1e6;
+  stats.lastLatencyMs = latencyMs;
+  stats.maxLatencyMs = Math.max(stats.maxLatencyMs, latencyMs);
+  stats.totalLatencyMs += latencyMs;
+  hashSeconds.observeMs(latencyMs);
+
+  if (err) {
+    stats.failed++;
+    job.reject(err);
+  } else {
+    stats.completed++;
+    job.resolve(result);
+  }
+}
+
+// a busy worker keeps the process alive until its job settles; idle ones don't
+function dispatch(worker, job) {
+  busy.set(worker, job);
+  worker.ref();
+  worker.postMessage({ id: job.id, ...job.payload });
+}
+
+function release(worker) {
+  if (queue.length) {
+    dispatch(worker, queue.shift());
+  } else {
+    worker.unref();
+    idle.push(worker);
+  }
+}
+
+function drain() {
+  while (queue.length && (idle.length || workerCount < options.workers)) {
+    dispatch(idle.length ? idle.pop() : spawnWorker(), queue.shift());
+  }
+}
+
+function submit(payload) {
+  return new Promise((resolve, reject) => {
+    if (queue.length >= options.maxQueue) {
+      stats.rejected++;
+      hashRejected.inc();
+      const err = new Error('Password hashing queue is full');
+      err.code = 'HASH_POOL_BUSY';
+      reject(err);
+      return;
+    }
+
+    queue.push({ id: nextId++, payload, resolve, reject, queuedAt: process.hrtime.bigint() });
+    drain();
+  });
+}
+
+/**
+ * Hash a password on the pool.
+ * @returns {Promise<string>} rejects with code HASH_POOL_BUSY when saturated
+ */
+function hash(password, rounds = 10) {
+  return submit({ op: 'hash', password, rounds });
+}
+
+/**
+ * Compare a password against a bcrypt hash on the pool.
+ * @returns {Promise<boolean>} rejects with code HASH_POOL_BUSY when saturated
+ */
+function compare(password, hash) {
+  return submit({ op: 'compare', password, hash });
+}
+
+function getStats() {
+  const finished = stats.completed + stats.failed;
+  return {
+    ...stats,
+    workers: workerCount,
+    active: busy.size,
+    queueDepth: queue.length,
+    avgLatencyMs: finished ? stats.totalLatencyMs / finished : 0,
+  };
+}
+
+module.exports = {
+  configure,
+  hash,
+  compare,
+  getStats,
+};
@@ -0,0 +1,15 @@
+const { parentPort } = require('worker_threads');
+const bcrypt = require('bcrypt');
+
+// the sync bcrypt calls run on this worker's own thread, keeping password
+// hashing off libuv's shared threadpool (which sqlite3 and fs also use)
+parentPort.on('message', ({ id, op, password, hash, rounds }) => {
+  try {
+    const result = op === 'hash'
+      ? bcrypt.hashSync(password, rounds)
+      : bcrypt.compareSync(password, hash);
+    parentPort.postMessage({ id, result });
+  } catch (err) {
+    parentPort.postMessage({ id, error: err.message });
+  }
+});
@@ -0,0 +1,69 @@
+const TimerWheel = require('./timerWheel');
+const metrics = require('./metrics');
+const logger = require('./logger');
+
+// one shared wheel for every socket instead of a setInterval per socket.
+// pings only bump socket.lastHeartbeat; the wheel checks the socket once its
+// deadline comes around and either disconnects it or re-arms it from the
+// latest ping, so an active socket costs one visit per timeout period.
+const timeouts = metrics.counter('chat_heartbeat_timeouts_total', 'Sockets disconnected for missing heartbeats');
+
+const wheel = new TimerWheel({ tickMs: 1000, slots: 256, onExpire: check });
+
+function check(socket, now) {
+  if (socket.readyState > 1) return;
+
+  const sinceLastBeat = now - socket.lastHeartbeat;
+
+  if (sinceLastBeat < socket.heartbeatTimeout) {
+    wheel.schedule(socket, socket.lastHeartbeat + socket.heartbeatTimeout);
+    return;
+  }
+
+  timeouts.inc();
+  if (logger.sample('heartbeat-timeout')) {
+    logger.info('Heartbeat timeout', {
+      event: 'heartbeat-timeout',
+      username: socket.username || null,
+      sinceLastBeatMs: sinceLastBeat,
+    });
+  }
+
+  try {
+    socket.send(JSON.stringify({
+      type: 'system',
+      text: 'Disconnected: Heartbeat timeout (no ping received)',
+    }));
+  } catch {}
+
+  socket.close(1008, 'Heartbeat timeout');
+}
+
+function touch(socket) {
+  socket.lastHeartbeat = Date.now();
+}
+
+function track(socket, timeout) {
+  socket.heartbeatTimeout = timeout;
+  socket.lastHeartbeat = Date.now();
+  wheel.schedule(socket, socket.lastHeartbeat + timeout);
+
+  // protocol level pings count as heartbeats too; ws answers them itself
+  socket.on('ping', () => touch(socket));
+  socket.on('pong', () => touch(socket));
+}
+
+function untrack(socket) {
+  wheel.cancel(socket);
+}
+
+function getStats() {
+  return wheel.getStats();
+}
+
+module.exports = {
+  track,
+  untrack,
+  touch,
+  getStats,
+};
@@ -0,0 +1,61 @@
+const { encode } = require('../handlers/broadcast');
+
+// fixed size ring of a room's most recent messages, plus the encoded
+// `history` frame that joins receive. the frame is only rebuilt after
+// the ring has changed, so a burst of joins shares one serialization
+class HistoryRing {
+  constructor(capacity = 100, room = null) {
+    this.capacity = capacity;
+    this.room = room;
+    this.entries = new Array(capacity);
+    this.start = 0;
+    this.length = 0;
+    this.frame = null;
+  }
+
+  push(message) {
+    const end = (this.start + this.length) % this.capacity;
+    this.entries[end] = message;
+
+    if (this.length < this.capacity) {
+      this.length++;
+    } else {
+      this.start = (this.start + 1) % this.capacity;
+    }
+
+    this.frame = null;
+  }
+
+  // rows loaded from the database are older than anything pushed since
+  // the ring was created, except pushed rows that were written before the
+  // load and so came back with it
+  seed(messages) {
+    const lastId = messages.length ? messages[messages.length - 1].id : 0;
+    const newer = this.toArray().filter((m) => !m.id || m.id > lastId);
+    this.start = 0;
+    this.length = 0;
+    messages.concat(newer).slice(-this.capacity).forEach((m) => this.push(m));
+  }
+
+  // entries were changed in place (e.g. given their database ids)
+  invalidate() {
+    this.frame = null;
+  }
+
+  toArray() {
+    const out = new Array(this.length);
+    for (let i = 0; i < this.length; i++) {
+      out[i] = this.entries[(this.start + i) % this.capacity];
+    }
+    return out;
+  }
+
+  getFrame() {
+    if (!this.frame) {
+      this.frame = encode({ type: 'history', room: this.room, messages: this.toArray() });
+    }
+    return this.frame;
+  }
+}
+
+module.exports = HistoryRing;
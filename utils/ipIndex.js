@@ -0,0 +1,139 @@
+const BoundedMap = require('./boundedMap');
+
+// per-IP accounting shared by the connection limiter, reconnect guard and
+// churn guard. every IP gets one entry holding its live connection count
+// and a few named sliding-window counters.
+// idle entries (no live connections, nothing recent) are swept away.
+
+const BUCKETS = 10;
+const MIN_IDLE_TTL_MS = 60000;
+const MAX_ENTRIES = 50000;
+const MAX_WINDOWS_PER_IP = 32;
+
+// approximate sliding window: the window is split into fixed buckets and
+// whole buckets fall out as time moves on, so memory per counter is constant
+class SlidingWindow {
+  constructor(windowMs) {
+    this.windowMs = windowMs;
+    this.bucketMs = Math.max(1, Math.ceil(windowMs / BUCKETS));
+    this.counts = new Array(BUCKETS).fill(0);
+    this.epochs = new Array(BUCKETS).fill(-Infinity);
+  }
+
+  add(now) {
+    const epoch = Math.floor(now / this.bucketMs);
+    const i = epoch % BUCKETS;
+    if (this.epochs[i] !== epoch) {
+      this.epochs[i] = epoch;
+      this.counts[i] = 0;
+    }
+    this.counts[i]++;
+    return this.count(now);
+  }
+
+  count(now) {
+    const epoch = Math.floor(now / this.bucketMs);
+    let total = 0;
+    for (let i = 0; i < BUCKETS; i++) {
+      if (epoch - this.epochs[i] < BUCKETS) total += this.counts[i];
+    }
+    return total;
+  }
+}
+
+// an IP with live connections is never evicted
+const entries = new BoundedMap({
+  maxEntries: MAX_ENTRIES,
+  canEvict: (entry) => entry.live === 0,
+});
+
+function getEntry(ip) {
+  let entry = entries.get(ip);
+  if (!entry) {
+    entry = { ip, live: 0, ttl: MIN_IDLE_TTL_MS, windows: new Map() };
+    entries.set(ip, entry, entry.ttl);
+  }
+  return entry;
+}
+
+function getWindow(entry, name, windowMs) {
+  let win = entry.windows.get(name);
+  if (!win || win.windowMs !== windowMs) {
+    // one IP cycling through window names drops its oldest counters
+    if (entry.windows.size >= MAX_WINDOWS_PER_IP) {
+      entry.windows.delete(entry.windows.keys().next().value);
+    }
+    win = new SlidingWindow(windowMs);
+    entry.windows.set(name, win);
+
+    if (windowMs > entry.ttl) {
+      entry.ttl = windowMs;
+      entries.set(entry.ip, entry, entry.ttl);
+    }
+  }
+  return win;
+}
+
+/**
+ * Count a new live connection for this IP.
+ */
+function acquire(ip) {
+  getEntry(ip).live++;
+}
+
+/**
+ * Count a closed connection for this IP.
+ */
+function release(ip) {
+  const entry = entries.get(ip);
+  if (!entry) return;
+  entry.live = Math.max(0, entry.live - 1);
+}
+
+function live(ip) {
+  const entry = entries.get(ip);
+  return entry ? entry.live : 0;
+}
+
+/**
+ * Record an event in a named window for this IP.
+ * @returns {number} events in the window, including this one
+ */
+function hit(ip, name, windowMs, now = Date.now()) {
+  return getWindow(getEntry(ip), name, windowMs).add(now);
+}
+
+function count(ip, name, windowMs, now = Date.now()) {
+  const entry = entries.get(ip);
+  const win = entry && entry.windows.get(name);
+  return win && win.windowMs === windowMs ? win.count(now) : 0;
+}
+
+function reset(ip, name) {
+  const entry = entries.get(ip);
+  if (entry) entry.windows.delete(name);
+}
+
+function sweep(now = Date.now()) {
+  entries.sweep(now);
+}
+
+function size() {
+  return entries.size;
+}
+
+function getStats() {
+  return entries.getStats();
+}
+
+module.exports = {
+  acquire,
+  release,
+  live,
+  hit,
+  count,
+  reset,
+  sweep,
+  size,
+  getStats,
+};
@@ -0,0 +1,273 @@
+const fs = require('fs');
+const path = require('path');
+const cluster = require('cluster');
+const metrics = require('./metrics');
+
+// structured logging. a call formats one JSON line and queues it; the queue
+// is written in batches with fs.write, which goes through the threadpool,
+// so a slow pipe or disk never stalls the event loop the way console.log
+// to a pipe does (that's a synchronous write on linux). when the output
+// can't keep up, new lines are dropped and counted instead of piling up in
+// memory. the last few hundred lines are also kept in memory for /logs,
+// whatever the output.
+//
+// everything not yet written, queued or mid-write, is written
+// synchronously on exit. a batch the threadpool finished just as the
+// process exited can be written twice; nothing is lost.
+//
+// in cluster mode every worker writes to the same stdout. a worker cuts
+// its batches at line boundaries into writes of at most PIPE_BUF bytes,
+// which a pipe never interleaves, so only lines longer than that can be
+// split up by another worker's output. a logging file is opened for
+// appending, and each write to it lands whole.
+
+const LEVELS = { debug: 10, info: 20, warn: 30, error: 40 };
+const PIPE_BUF = 4096;
+const RETRY_MS = 10;
+
+const options = {
+  level: 'info',         // lowest level written
+  format: 'json',        // 'json' lines, or 'text' for reading in a terminal
+  file: '',              // append to this file instead of stdout
+  flushIntervalMs: 100,  // most time a line waits before being written
+  batchBytes: 65536,     // ...or write as soon as this much is waiting
+  maxQueuedBytes: 4 * 1024 * 1024, // drop new lines while this much is unwritten
+  ringSize: 500,         // recent lines kept for /logs
+  sampleRates: {},       // event -> log 1 in N, for sample()
+};
+
+const written = metrics.counter('chat_log_lines_total', 'Log lines queued for output', 'level');
+const dropped = metrics.counter('chat_log_dropped_total', 'Log lines dropped because the output could not keep up');
+const sampledOut = metrics.counter('chat_log_sampled_out_total', 'High-frequency log events skipped by sampling', 'event');
+
+const ring = new Array(options.ringSize);
+let ringNext = 0;
+let ringCount = 0;
+
+let queue = [];
+let queuedBytes = 0;
+let droppedSinceWrite = 0;
+let flushTimer = null;
+// buffers handed to the output and not fully written yet, in order
+let writing = [];
+let writeBusy = false;
+let fd = null;
+let threshold = LEVELS[options.level];
+const sampleCounts = new Map();
+
+const workerId = cluster.isWorker ? cluster.worker.id : undefined;
+
+function configure(overrides = {}) {
+  for (const key of Object.keys(options)) {
+    if (overrides[key] !== undefined) options[key] = overrides[key];
+  }
+  threshold = LEVELS[options.level] || LEVELS.info;
+
+  if (ring.length !== options.ringSize) {
+    ring.length = 0;
+    ring.length = options.ringSize;
+    ringNext = 0;
+    ringCount = 0;
+  }
+
+  // reopened on the next write
+  if (fd !== null && fd !== 1 && !writeBusy) fs.closeSync(fd);
+  fd = null;
+}
+
+// fd 1 through fs rather than process.stdout, so writes are asynchronous
+function output() {
+  if (fd === null) {
+    fd = options.file ? fs.openSync(path.resolve(__dirname, '..', options.file), 'a') : 1;
+  }
+  return fd;
+}
+
+// one write at a time, so the output sees the lines in order
+function pump() {
+  if (writeBusy || !writing.length) return;
+  writeBusy = true;
+
+  const buf = writing[0];
+  fs.write(output(), buf, 0, buf.length, null, (err, bytesWritten) => {
+    writeBusy = false;
+
+    if (err) {
+      // a non-blocking stdout that is full; try again shortly
+      if (err.code === 'EAGAIN') {
+        setTimeout(pump, RETRY_MS).unref();
+        return;
+      }
+      // nowhere left to log it but stderr
+      process.stderr.write(`Log output error: ${err.message}\n`);
+      writing.shift();
+    } else if (bytesWritten < buf.length) {
+      writing[0] = buf.subarray(bytesWritten);
+    } else {
+      writing.shift();
+    }
+
+    if (writing.length) {
+      pump();
+    } else if (queue.length) {
+      scheduleFlush();
+    }
+  });
+}
+
+// the whole queue as one write, or for a worker sharing stdout, as writes
+// that each fit in PIPE_BUF without splitting a line
+function toWrites(lines) {
+  if (options.file || workerId === undefined) return [Buffer.from(lines.join(''))];
+
+  const writes = [];
+  let batch = [];
+  let batchBytes = 0;
+  for (const line of lines) {
+    const bytes = Buffer.byteLength(line);
+    if (batch.length && batchBytes + bytes > PIPE_BUF) {
+      writes.push(Buffer.from(batch.join('')));
+      batch = [];
+      batchBytes = 0;
+    }
+    batch.push(line);
+    batchBytes += bytes;
+  }
+  if (batch.length) writes.push(Buffer.from(batch.join('')));
+  return writes;
+}
+
+const serializeError = (err) => ({ message: err.message, code: err.code, stack: err.stack });
+
+function format(level, msg, fields) {
+  const entry = { time: new Date().toISOString(), level, msg };
+  if (workerId !== undefined) entry.worker = workerId;
+
+  if (fields) {
+    for (const key of Object.keys(fields)) {
+      const value = fields[key];
+      entry[key] = value instanceof Error ? serializeError(value) : value;
+    }
+  }
+
+  if (options.format === 'text') {
+    const { time, level: lvl, msg: text, ...rest } = entry;
+    const extra = Object.keys(rest).length ? ` ${JSON.stringify(rest)}` : '';
+    return `[${time}] ${lvl.toUpperCase()} ${text}${extra}\n`;
+  }
+
+  try {
+    return JSON.stringify(entry) + '\n';
+  } catch {
+    return JSON.stringify({ time: entry.time, level, msg, error: 'unserializable fields' }) + '\n';
+  }
+}
+
+function remember(line) {
+  ring[ringNext] = line;
+  ringNext = (ringNext + 1) % ring.length;
+  ringCount = Math.min(ringCount + 1, ring.length);
+}
+
+function scheduleFlush() {
+  if (flushTimer || writing.length) return;
+  flushTimer = setTimeout(flush, options.flushIntervalMs);
+  flushTimer.unref();
+}
+
+function flush() {
+  clearTimeout(flushTimer);
+  flushTimer = null;
+  // the previous batch is still being written; this one waits its turn
+  if (!queue.length || writing.length) return;
+
+  if (droppedSinceWrite) {
+    queue.push(format('warn', 'Log lines dropped', { dropped: droppedSinceWrite }));
+    droppedSinceWrite = 0;
+  }
+
+  writing = toWrites(queue);
+  queue = [];
+  queuedBytes = 0;
+  pump();
+}
+
+function write(level, msg, fields) {
+  if (LEVELS[level] < threshold) return;
+
+  const line = format(level, msg, fields);
+  remember(line);
+
+  if (queuedBytes + line.length > options.maxQueuedBytes) {
+    droppedSinceWrite++;
+    dropped.inc();
+    return;
+  }
+
+  written.inc(level);
+  queue.push(line);
+  queuedBytes += line.length;
+
+  if (queuedBytes >= options.batchBytes) {
+    flush();
+  } else {
+    scheduleFlush();
+  }
+}
+
+/**
+ * Whether this occurrence of a high-frequency event should be logged,
+ * per options.sampleRates (log 1 in N). Events without a rate always are.
+ * Check it before building the log fields:
+ *   if (logger.sample('heartbeat-timeout')) logger.info(...)
+ */
+function sample(event) {
+  const rate = options.sampleRates[event];
+  if (!rate || rate <= 1) return true;
+
+  const n = sampleCounts.get(event) || 0;
+  sampleCounts.set(event, (n + 1) % rate);
+  if (n === 0) return true;
+
+  sampledOut.inc(event);
+  return false;
+}
+
+/**
+ * The most recent log lines, oldest first, including ones that were
+ * dropped from the output.
+ * @returns {string[]}
+ */
+function recent(limit = 50) {
+  const count = Math.min(Math.max(0, limit), ringCount);
+  const out = [];
+  for (let i = count; i > 0; i--) {
+    out.push(ring[(ringNext - i + ring.length) % ring.length].trimEnd());
+  }
+  return out;
+}
+
+// whatever is mid-write or still queued goes out synchronously on the way down
+process.on('exit', () => {
+  const rest = writing.concat(toWrites(queue));
+  writing = [];
+  queue = [];
+  try {
+    const out = output();
+    for (const buf of rest) {
+      let offset = 0;
+      while (offset < buf.length) offset += fs.writeSync(out, buf, offset);
+    }
+  } catch {}
+});
+
+module.exports = {
+  configure,
+  debug: (msg, fields) => write('debug', msg, fields),
+  info: (msg, fields) => write('info', msg, fields),
+  warn: (msg, fields) => write('warn', msg, fields),
+  error: (msg, fields) => write('error', msg, fields),
+  sample,
+  recent,
+  flush,
+};
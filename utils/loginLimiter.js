@@ -1,42 +1,72 @@
+const BoundedMap = require('./boundedMap');
+const { settings } = require('./configStore');
+const metrics = require('./metrics');
+
 const ATTEMPT_LIMIT = 5;
+const ATTEMPT_WINDOW_MS = 60 * 60 * 1000; // failures older than this are forgotten
 const BAN_DURATION_MS = 60 * 60 * 1000; // 1 hour
 
-// Format: { 'ip:username': { count, bannedUntil } }
-const loginAttempts = new Map();
+// failure counts are kept here rather than in the shared ip index: that
+// caps the windows per IP, and an IP cycling through throwaway usernames
+// must not be able to push out the count for the account it is guessing.
+// both maps are capped so a flood of rotating usernames can't grow them
+// without limit
+// Format: { 'ip:username': { count, since } }
+const failures = new BoundedMap({ maxEntries: 10000, ttlMs: ATTEMPT_WINDOW_MS });
+// Format: { 'ip:username': bannedUntil }
+const loginAttempts = new BoundedMap({ maxEntries: 10000, ttlMs: BAN_DURATION_MS });
+
+const bans = metrics.counter('chat_login_bans_total', 'ip:username pairs banned after repeated failed logins');
+const refused = metrics.counter('chat_login_refused_total', 'Login attempts refused while banned');
 
 function isBlocked(ip, username) {
   const key = `${ip}:${username}`;
-  const entry = loginAttempts.get(key);
+  const bannedUntil = loginAttempts.get(key);
+
+  if (bannedUntil === undefined) return false;
 
-  if (entry && entry.bannedUntil && Date.now() < entry.bannedUntil) {
+  if (Date.now() < bannedUntil) {
+    refused.inc();
     return true;
   }
 
+  loginAttempts.delete(key);
   return false;
 }
 
 function recordFailedAttempt(ip, username) {
   const key = `${ip}:${username}`;
   const now = Date.now();
+  const maxEntries = (settings.loginLimiter && settings.loginLimiter.maxEntries) || 10000;
+  failures.maxEntries = maxEntries;
 
-  let entry = loginAttempts.get(key) || { count: 0, bannedUntil: null };
-
-  entry.count += 1;
+  let entry = failures.get(key);
+  if (!entry || now - entry.since > ATTEMPT_WINDOW_MS) {
+    entry = { count: 0, since: now };
+    failures.set(key, entry);
+  }
+  entry.count++;
 
   if (entry.count >= ATTEMPT_LIMIT) {
-    entry.bannedUntil = now + BAN_DURATION_MS;
-    entry.count = 0;
+    loginAttempts.maxEntries = maxEntries;
+    loginAttempts.set(key, now + BAN_DURATION_MS);
+    bans.inc();
+    failures.delete(key);
   }
-
-  loginAttempts.set(key, entry);
 }
 
 function resetAttempts(ip, username) {
   const key = `${ip}:${username}`;
+  failures.delete(key);
   loginAttempts.delete(key);
 }
 
+function size() {
+  return failures.size + loginAttempts.size;
+}
+
 module.exports = {
+  size,
   isBlocked,
   recordFailedAttempt,
   resetAttempts,
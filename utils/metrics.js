@@ -0,0 +1,232 @@
+const { monitorEventLoopDelay, PerformanceObserver, performance } = require('perf_hooks');
+
+// counters and histograms for the /metrics endpoint, in the prometheus text
+// format. the hot paths only bump numbers in place. anything that needs a
+// clock read (fan-out and similar timings) and the event loop and gc
+// observers only run while someone is scraping: the first scrape switches
+// them on, and they switch themselves off again after idleMs without one.
+
+const options = {
+  idleMs: 300000, // stop timing and observing this long after the last scrape
+};
+
+const LOOP_RESOLUTION_MS = 10;
+
+const metrics = [];
+let active = false;
+let idleTimer = null;
+let loopDelay = null;
+let gcObserver = null;
+
+const escapeLabel = (value) => String(value).replace(/\\/g, '\\\\').replace(/"/g, '\\"').replace(/\n/g, '\\n');
+
+const labelText = (labels) => {
+  const parts = Object.keys(labels).map((key) => `${key}="${escapeLabel(labels[key])}"`);
+  return parts.length ? `{${parts.join(',')}}` : '';
+};
+
+// one value, or one per value of a single label
+class Counter {
+  constructor(name, help, labelName) {
+    this.name = name;
+    this.help = help;
+    this.labelName = labelName;
+    this.value = 0;
+    this.values = labelName ? new Map() : null;
+  }
+
+  inc(labelOrAmount, amount = 1) {
+    if (this.values) {
+      this.values.set(labelOrAmount, (this.values.get(labelOrAmount) || 0) + amount);
+    } else {
+      this.value += labelOrAmount === undefined ? 1 : labelOrAmount;
+    }
+  }
+
+  render() {
+    const lines = [`# HELP ${this.name} ${this.help}`, `# TYPE ${this.name} counter`];
+    if (this.values) {
+      for (const [label, value] of this.values) {
+        lines.push(`${this.name}${labelText({ [this.labelName]: label })} ${value}`);
+      }
+    } else {
+      lines.push(`${this.name} ${this.value}`);
+    }
+    return lines.join('\n');
+  }
+}
+
+// read when scraped, from whatever module owns the number
+class Gauge {
+  constructor(name, help, read) {
+    this.name = name;
+    this.help = help;
+    this.read = read;
+  }
+
+  render() {
+    const lines = [`# HELP ${this.name} ${this.help}`, `# TYPE ${this.name} gauge`];
+    const value = this.read();
+
+    if (value && typeof value === 'object') {
+      for (const { labels, value: v } of value) lines.push(`${this.name}${labelText(labels)} ${v}`);
+    } else {
+      lines.push(`${this.name} ${Number(value) || 0}`);
+    }
+    return lines.join('\n');
+  }
+}
+
+// fixed buckets, in seconds
+class Histogram {
+  constructor(name, help, buckets) {
+    this.name = name;
+    this.help = help;
+    this.buckets = buckets;
+    this.counts = new Array(buckets.length).fill(0);
+    this.count = 0;
+    this.sum = 0;
+  }
+
+  observe(seconds) {
+    this.count++;
+    this.sum += seconds;
+    for (let i = 0; i < this.buckets.length; i++) {
+      if (seconds <= this.buckets[i]) {
+        this.counts[i]++;
+        return;
+      }
+    }
+  }
+
+  observeMs(ms) {
+    this.observe(ms / 1000);
+  }
+
+  // pairs with start(): nothing is recorded when the timer never ran
+  since(startedAt) {
+    if (startedAt) this.observeMs(performance.now() - startedAt);
+  }
+
+  render() {
+    const lines = [`# HELP ${this.name} ${this.help}`, `# TYPE ${this.name} histogram`];
+    let cumulative = 0;
+    this.buckets.forEach((le, i) => {
+      cumulative += this.counts[i];
+      lines.push(`${this.name}_bucket{le="${le}"} ${cumulative}`);
+    });
+    lines.push(`${this.name}_bucket{le="+Inf"} ${this.count}`);
+    lines.push(`${this.name}_sum ${this.sum}`);
+    lines.push(`${this.name}_count ${this.count}`);
+    return lines.join('\n');
+  }
+}
+
+const register = (metric) => {
+  metrics.push(metric);
+  return metric;
+};
+
+const counter = (name, help, labelName) => register(new Counter(name, help, labelName));
+const gauge = (name, help, read) => register(new Gauge(name, help, read));
+const histogram = (name, help, buckets) => register(new Histogram(name, help, buckets));
+
+/**
+ * Start a timing for Histogram#since. Returns 0, which since() ignores,
+ * while nobody is scraping.
+ */
+function start() {
+  return active ? performance.now() : 0;
+}
+
+const gcPause = histogram(
+  'chat_gc_pause_seconds',
+  'Garbage collection pauses (observed while metrics are being scraped)',
+  [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25]
+);
+
+gauge('chat_event_loop_lag_seconds', 'Event loop delay since the previous scrape', () => {
+  if (!loopDelay) return [];
+
+  // the sampler's own interval is part of every sample; only the rest is lag
+  const stat = (labels, ns) => ({
+    labels,
+    value: Number.isFinite(ns) ? Math.max(0, ns / 1e6 - LOOP_RESOLUTION_MS) / 1000 : 0,
+  });
+  const values = loopDelay.count
+    ? [
+        stat({ quantile: '0.5' }, loopDelay.percentile(50)),
+        stat({ quantile: '0.9' }, loopDelay.percentile(90)),
+        stat({ quantile: '0.99' }, loopDelay.percentile(99)),
+        stat({ quantile: '1' }, loopDelay.max),
+      ]
+    : [];
+  loopDelay.reset();
+  return values;
+});
+
+gauge('chat_process_resident_memory_bytes', 'Resident set size', () => process.memoryUsage.rss());
+gauge('chat_process_heap_used_bytes', 'V8 heap in use', () => process.memoryUsage().heapUsed);
+
+function activate() {
+  if (!active) {
+    active = true;
+
+    loopDelay = monitorEventLoopDelay({ resolution: LOOP_RESOLUTION_MS });
+    loopDelay.enable();
+
+    gcObserver = new PerformanceObserver((list) => {
+      for (const entry of list.getEntries()) gcPause.observeMs(entry.duration);
+    });
+    gcObserver.observe({ entryTypes: ['gc'] });
+  }
+
+  clearTimeout(idleTimer);
+  idleTimer = setTimeout(deactivate, options.idleMs);
+  idleTimer.unref();
+}
+
+function deactivate() {
+  active = false;
+  clearTimeout(idleTimer);
+  idleTimer = null;
+
+  if (loopDelay) {
+    loopDelay.disable();
+    loopDelay = null;
+  }
+  if (gcObserver) {
+    gcObserver.disconnect();
+    gcObserver = null;
+  }
+}
+
+function configure(overrides = {}) {
+  for (const key of Object.keys(options)) {
+    if (overrides[key] !== undefined) options[key] = overrides[key];
+  }
+}
+
+/**
+ * Everything registered so far, in the prometheus text format. Counts as a
+ * scrape, so it also keeps the timers and observers running.
+ * @returns {string}
+ */
+function render() {
+  // the first scrape after a quiet spell starts the observers; they fill
+  // in from the next one
+  activate();
+  return metrics.map((metric) => metric.render()).join('\n') + '\n';
+}
+
+module.exports = {
+  configure,
+  counter,
+  gauge,
+  histogram,
+  start,
+  render,
+  get active() {
+    return active;
+  },
+};
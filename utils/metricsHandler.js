@@ -0,0 +1,52 @@
+const metrics = require('./metrics');
+const bus = require('./bus');
+const backpressure = require('./backpressure');
+const rooms = require('./rooms');
+
+// GET /metrics for prometheus. in cluster mode each scrape is answered by
+// whichever worker accepts the connection, and chat_worker_id says which
+let clients = null;
+
+metrics.gauge('chat_worker_id', 'Cluster worker that answered this scrape (0 when not clustered)', () => bus.workerId);
+metrics.gauge('chat_connected_clients', 'Open websocket connections on this process', () => (clients ? clients.size : 0));
+metrics.gauge('chat_outbound_buffered_bytes', 'Bytes queued for clients, in total and for the worst one', () => {
+  const { bufferedBytes, maxBufferedBytes } = backpressure.getStats(clients ? { clients } : null, 0);
+  return [
+    { labels: { stat: 'total' }, value: bufferedBytes },
+    { labels: { stat: 'max' }, value: maxBufferedBytes },
+  ];
+});
+metrics.gauge('chat_slow_consumers', 'Clients currently over the outbound high-water mark', () => backpressure.getStats(null).slowNow);
+metrics.gauge('chat_rooms', 'Rooms with members on this process', () => rooms.size());
+
+// per-client detail is only for whoever holds the metrics token; with no
+// token set, nobody gets it
+const authorized = (req, settings) => {
+  const cfg = settings.metrics || {};
+  return Boolean(cfg.token) && req.headers['authorization'] === `Bearer ${cfg.token}`;
+};
+
+module.exports = (req, res, wss, settings) => {
+  if (req.url !== '/metrics') {
+    return false;
+  }
+
+  const cfg = settings.metrics || {};
+  if (cfg.enabled === false) {
+    return false;
+  }
+
+  if (cfg.token && !authorized(req, settings)) {
+    res.writeHead(401, { 'WWW-Authenticate': 'Bearer' });
+    res.end();
+    return true;
+  }
+
+  clients = wss.clients;
+
+  res.writeHead(200, { 'Content-Type': 'text/plain; version=0.0.4; charset=utf-8' });
+  res.end(metrics.render());
+  return true;
+};
+
+module.exports.authorized = authorized;
@@ -0,0 +1,95 @@
+const roster = require('./roster');
+const metrics = require('./metrics');
+const { encode, sendFrame, fanOut } = require('../handlers/broadcast');
+
+// who is online, pushed to clients instead of them polling /list and
+// reading join/leave lines. a client gets one `presence-snapshot` of the
+// whole roster when it joins, then `presence-delta` frames with what
+// changed. changes are collected for batchMs and sent as one frame, so a
+// burst of joins costs every client one frame rather than one per join.
+//
+// the roster is the source, so in cluster mode every worker sees every
+// change and tells its own sockets.
+
+const options = {
+  enabled: true,
+  batchMs: 100,  // changes are held this long and sent together
+};
+
+const stats = {
+  snapshots: 0,
+  deltas: 0,
+  changes: 0,
+};
+
+const deltasSent = metrics.counter('chat_presence_deltas_total', 'Batched presence-delta frames fanned out');
+
+let wss = null;
+let settings = null;
+let pending = [];
+let timer = null;
+// the encoded snapshot, shared by every join until the roster changes
+let snapshot = null;
+
+function configure(overrides = {}) {
+  for (const key of Object.keys(options)) {
+    if (overrides[key] !== undefined) options[key] = overrides[key];
+  }
+}
+
+function flush() {
+  timer = null;
+  const changes = pending;
+  pending = [];
+
+  stats.deltas++;
+  deltasSent.inc();
+  fanOut(wss, encode({ type: 'presence-delta', changes }), settings);
+}
+
+roster.onChange((change) => {
+  snapshot = null;
+  if (!options.enabled || !wss) return;
+
+  stats.changes++;
+  pending.push(change);
+  if (!timer) {
+    timer = setTimeout(flush, options.batchMs);
+    timer.unref();
+  }
+});
+
+/**
+ * Start sending presence deltas to this server's clients.
+ */
+function init(server, serverSettings) {
+  wss = server;
+  settings = serverSettings;
+}
+
+/**
+ * Send a joining client everyone who is online. Changes already in it
+ * may still arrive in the next delta; applying them again is harmless.
+ */
+function sendSnapshot(socket) {
+  if (!options.enabled) return;
+  stats.snapshots++;
+  if (!snapshot) snapshot = encode({ type: 'presence-snapshot', users: roster.list() });
+  sendFrame(socket, snapshot);
+}
+
+function getStats() {
+  return {
+    ...stats,
+    enabled: options.enabled,
+    online: roster.size(),
+    pending: pending.length,
+  };
+}
+
+module.exports = {
+  configure,
+  init,
+  sendSnapshot,
+  getStats,
+};
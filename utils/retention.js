@@ -0,0 +1,291 @@
+const fs = require('fs');
+const path = require('path');
+const zlib = require('zlib');
+const { promisify } = require('util');
+const sqlite3 = require('sqlite3');
+const bus = require('./bus');
+const logger = require('./logger');
+const { dbPath, ready, toSqlTimestamp } = require('./db');
+
+// keeps chat.db from growing forever: prunes messages past a maximum age or
+// row count, rolls old join/leave noise up into one line per day, archives
+// whatever it removes and hands the freed pages back with incremental vacuum.
+//
+// it has its own connection, so its transactions never interleave with the
+// write-behind flushes, and every step is an async sqlite call or a zlib
+// call on the threadpool with a yield in between, so the event loop keeps
+// serving clients while it works. only one process runs it (see
+// bus.runsBackgroundJobs).
+
+const gzip = promisify(zlib.gzip);
+
+const DAY_MS = 24 * 60 * 60 * 1000;
+
+const JOIN_LEAVE = "type = 'system' AND username IS NULL AND (text LIKE '% has joined.' OR text LIKE '% has left.%')";
+
+const options = {
+  enabled: false,
+  intervalMs: 3600000,    // how often the job runs
+  maxAgeDays: 0,          // prune messages older than this; 0 keeps them
+  maxRows: 0,             // keep at most this many messages; 0 for no limit
+  joinLeaveMaxAgeDays: 0, // compact join/leave rows older than this; 0 leaves them alone
+  joinLeave: 'rollup',    // 'rollup' keeps one summary line per day, 'drop' keeps nothing
+  archive: true,          // write removed rows to gzip segments before deleting them
+  archiveDir: 'archive',
+  batchSize: 2000,        // rows removed per transaction
+  vacuumPages: 2000,      // most pages handed back to the filesystem per run
+};
+
+const stats = {
+  runs: 0,
+  lastRunAt: null,
+  lastRunMs: 0,
+  rowsPruned: 0,
+  joinLeaveCompacted: 0,
+  segmentsWritten: 0,
+  pagesVacuumed: 0,
+  errors: 0,
+};
+
+let conn = null;
+let timer = null;
+let running = false;
+let warnedVacuum = false;
+
+function configure(overrides = {}) {
+  for (const key of Object.keys(options)) {
+    if (overrides[key] !== undefined) options[key] = overrides[key];
+  }
+}
+
+function open() {
+  if (conn) return;
+  conn = new sqlite3.Database(dbPath);
+  conn.configure('busyTimeout', 5000);
+}
+
+const run = (sql, params = []) => new Promise((resolve, reject) => {
+  conn.run(sql, params, (err) => (err ? reject(err) : resolve()));
+});
+
+const get = (sql, params = []) => new Promise((resolve, reject) => {
+  conn.get(sql, params, (err, row) => (err ? reject(err) : resolve(row)));
+});
+
+const all = (sql, params = []) => new Promise((resolve, reject) => {
+  conn.all(sql, params, (err, rows) => (err ? reject(err) : resolve(rows)));
+});
+
+const exec = (sql) => new Promise((resolve, reject) => {
+  conn.exec(sql, (err) => (err ? reject(err) : resolve()));
+});
+
+const yieldToEventLoop = () => new Promise((resolve) => setImmediate(resolve));
+
+async function transaction(fn) {
+  await run('BEGIN IMMEDIATE');
+  try {
+    await fn();
+    await run('COMMIT');
+  } catch (err) {
+    await run('ROLLBACK').catch(() => {});
+    throw err;
+  }
+}
+
+// one immutable file per removed range, named after its ids. written to a
+// temp name and renamed into place once it's on disk, so a segment is
+// either complete or absent, and the rows are only deleted after that
+async function writeSegment(kind, rows) {
+  const dir = path.resolve(__dirname, '..', options.archiveDir);
+  await fs.promises.mkdir(dir, { recursive: true });
+
+  const pad = (id) => String(id).padStart(10, '0');
+  const file = path.join(dir, `${kind}-${pad(rows[0].id)}-${pad(rows[rows.length - 1].id)}.jsonl.gz`);
+  const body = await gzip(rows.map((row) => JSON.stringify(row)).join('\n') + '\n');
+
+  const handle = await fs.promises.open(`${file}.tmp`, 'w');
+  try {
+    await handle.writeFile(body);
+    await handle.sync();
+  } finally {
+    await handle.close();
+  }
+  await fs.promises.rename(`${file}.tmp`, file);
+
+  stats.segmentsWritten++;
+}
+
+// one room's day at a time, oldest first, only whole days
+async function compactJoinLeave() {
+  const cutoff = `${toSqlTimestamp(new Date(Date.now() - options.joinLeaveMaxAgeDays * DAY_MS)).slice(0, 10)} 00:00:00`;
+
+  for (;;) {
+    const first = await get(
+      `SELECT date(timestamp) AS day, room FROM messages WHERE ${JOIN_LEAVE} AND timestamp < ? ORDER BY timestamp LIMIT 1`,
+      [cutoff]
+    );
+    if (!first) return;
+
+    const start = `${first.day} 00:00:00`;
+    const end = `${toSqlTimestamp(new Date(Date.parse(`${first.day}T00:00:00Z`) + DAY_MS)).slice(0, 10)} 00:00:00`;
+    const range = [first.room, start, end];
+
+    const rows = await all(
+      `SELECT id, type, username, text, timestamp, room FROM messages WHERE ${JOIN_LEAVE} AND room = ? AND timestamp >= ? AND timestamp < ? ORDER BY id`,
+      range
+    );
+
+    if (options.archive) await writeSegment('joinleave', rows);
+
+    await transaction(async () => {
+      await run(`DELETE FROM messages WHERE ${JOIN_LEAVE} AND room = ? AND timestamp >= ? AND timestamp < ?`, range);
+
+      if (options.joinLeave === 'rollup') {
+        const joins = rows.filter((row) => row.text.endsWith(' has joined.')).length;
+        const last = rows[rows.length - 1];
+
+        // reuses the id of the day's last join/leave, so the summary sits
+        // where that day's activity was when paging through history
+        await run(
+          'INSERT INTO messages (id, type, username, text, timestamp, room) VALUES (?, ?, NULL, ?, ?, ?)',
+          [last.id, 'system', `${first.day}: ${joins} joins, ${rows.length - joins} leaves`, last.timestamp, first.room]
+        );
+      }
+    });
+
+    stats.joinLeaveCompacted += rows.length;
+    await yieldToEventLoop();
+  }
+}
+
+// everything at or below this id is past maxAgeDays or maxRows
+async function findCutoffId() {
+  let cutoff = 0;
+
+  if (options.maxAgeDays > 0) {
+    const row = await get(
+      'SELECT MAX(id) AS id FROM messages WHERE timestamp < ?',
+      [toSqlTimestamp(new Date(Date.now() - options.maxAgeDays * DAY_MS))]
+    );
+    cutoff = Math.max(cutoff, (row && row.id) || 0);
+  }
+
+  if (options.maxRows > 0) {
+    const row = await get('SELECT id FROM messages ORDER BY id DESC LIMIT 1 OFFSET ?', [options.maxRows]);
+    if (row) cutoff = Math.max(cutoff, row.id);
+  }
+
+  return cutoff;
+}
+
+async function prune(cutoffId) {
+  for (;;) {
+    const rows = await all(
+      'SELECT id, type, username, text, timestamp, room FROM messages WHERE id <= ? ORDER BY id LIMIT ?',
+      [cutoffId, options.batchSize]
+    );
+    if (!rows.length) return;
+
+    if (options.archive) await writeSegment('messages', rows);
+
+    // the fts delete trigger keeps the search index in step
+    await transaction(() => run(
+      'DELETE FROM messages WHERE id BETWEEN ? AND ?',
+      [rows[0].id, rows[rows.length - 1].id]
+    ));
+
+    stats.rowsPruned += rows.length;
+    await yieldToEventLoop();
+  }
+}
+
+async function vacuum() {
+  // incremental_vacuum(0) would release every free page at once
+  const pages = Math.floor(options.vacuumPages);
+  if (!(pages > 0)) return;
+
+  const mode = await get('PRAGMA auto_vacuum');
+  if (mode.auto_vacuum !== 2) {
+    if (!warnedVacuum) {
+      warnedVacuum = true;
+      logger.warn('chat.db was created without incremental auto-vacuum, so pruned space is reused but not released. '
+        + "To enable it, stop the server and run: sqlite3 chat.db 'PRAGMA auto_vacuum = INCREMENTAL; VACUUM;'");
+    }
+    return;
+  }
+
+  const before = await get('PRAGMA freelist_count');
+  // exec steps the pragma to completion; each step frees one page
+  await exec(`PRAGMA incremental_vacuum(${pages})`);
+  const after = await get('PRAGMA freelist_count');
+
+  stats.pagesVacuumed += before.freelist_count - after.freelist_count;
+}
+
+async function runOnce() {
+  if (running) return;
+  running = true;
+  const started = Date.now();
+
+  try {
+    await ready();
+    open();
+
+    if (options.joinLeaveMaxAgeDays > 0) await compactJoinLeave();
+
+    const cutoffId = await findCutoffId();
+    if (cutoffId) await prune(cutoffId);
+
+    await vacuum();
+  } catch (err) {
+    stats.errors++;
+    logger.error('Retention error', { err });
+  } finally {
+    running = false;
+    stats.runs++;
+    stats.lastRunAt = new Date(started).toISOString();
+    stats.lastRunMs = Date.now() - started;
+  }
+}
+
+/**
+ * Start the periodic retention job, if it's enabled and this process is
+ * the one that runs background jobs.
+ */
+function start(overrides) {
+  configure(overrides);
+  if (!options.enabled || !bus.runsBackgroundJobs || timer) return;
+
+  // first run a minute in, out of the way of startup
+  timer = setTimeout(function tick() {
+    runOnce().finally(() => {
+      if (!timer) return;
+      timer = setTimeout(tick, options.intervalMs);
+      timer.unref();
+    });
+  }, 60000);
+  timer.unref();
+}
+
+function stop() {
+  clearTimeout(timer);
+  timer = null;
+}
+
+function getStats() {
+  return {
+    ...stats,
+    enabled: options.enabled,
+    active: !!timer,
+    running,
+  };
+}
+
+module.exports = {
+  configure,
+  start,
+  stop,
+  runOnce,
+  getStats,
+};
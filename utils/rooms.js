@@ -0,0 +1,139 @@
+// which local sockets are in which room, so a room's messages only visit
+// that room's members. every joined socket is in exactly one room at a
+// time (socket.room); it starts in DEFAULT_ROOM and moves with /join and
+// /part. in cluster mode each worker indexes only its own sockets, and
+// room messages still cross the bus to reach members on other workers.
+
+const DEFAULT_ROOM = 'general';
+
+const ROOM_NAME = /^[a-z0-9_-]{1,32}$/;
+
+const options = {
+  enabled: true,
+  maxRooms: 1000,        // rooms with members on this process before new ones are refused
+  switchCooldownMs: 3000, // how often one client can /join or /part
+};
+
+const stats = {
+  joins: 0,
+  parts: 0,
+  refused: 0,
+};
+
+const members = new Map();
+const NO_MEMBERS = new Set();
+const emptyHandlers = [];
+
+function configure(overrides = {}) {
+  for (const key of Object.keys(options)) {
+    if (overrides[key] !== undefined) options[key] = overrides[key];
+  }
+}
+
+/**
+ * Canonical room name from user input: lowercased, leading # optional.
+ * @returns {string|null} null if it isn't a valid room name
+ */
+function normalize(input) {
+  if (typeof input !== 'string') return null;
+  const name = input.trim().replace(/^#/, '').toLowerCase();
+  return ROOM_NAME.test(name) ? name : null;
+}
+
+function leave(socket) {
+  const room = socket.room;
+  if (!room) return;
+  socket.room = null;
+  stats.parts++;
+
+  const set = members.get(room);
+  if (!set) return;
+  set.delete(socket);
+
+  if (!set.size) {
+    members.delete(room);
+    emptyHandlers.forEach((handler) => handler(room));
+  }
+}
+
+/**
+ * Move a socket into a room, out of whatever room it was in.
+ * @returns {boolean} false if that would open a room past maxRooms
+ */
+function join(socket, room) {
+  if (socket.room === room) return true;
+
+  let set = members.get(room);
+  if (!set) {
+    // everyone has to fit somewhere, so the default room is never refused
+    if (members.size >= options.maxRooms && room !== DEFAULT_ROOM) {
+      stats.refused++;
+      return false;
+    }
+    set = new Set();
+    members.set(room, set);
+  }
+
+  leave(socket);
+
+  set.add(socket);
+  socket.room = room;
+  stats.joins++;
+  return true;
+}
+
+// sockets in a room on this process; don't hold on to it
+function membersOf(room) {
+  return members.get(room) || NO_MEMBERS;
+}
+
+// called with a room's name once its last local member leaves
+function onEmpty(handler) {
+  emptyHandlers.push(handler);
+}
+
+function enabled() {
+  return options.enabled;
+}
+
+function switchCooldownMs() {
+  return options.switchCooldownMs;
+}
+
+/**
+ * Local rooms by member count, largest first.
+ */
+function list(limit = Infinity) {
+  return Array.from(members, ([room, set]) => ({ room, members: set.size }))
+    .sort((a, b) => b.members - a.members || (a.room < b.room ? -1 : 1))
+    .slice(0, limit);
+}
+
+function size() {
+  return members.size;
+}
+
+// room names are only listed when asked for; they are not for public endpoints
+function getStats(top = 0) {
+  return {
+    ...stats,
+    enabled: options.enabled,
+    rooms: members.size,
+    largest: top > 0 ? list(top) : undefined,
+  };
+}
+
+module.exports = {
+  DEFAULT_ROOM,
+  configure,
+  normalize,
+  join,
+  leave,
+  membersOf,
+  onEmpty,
+  enabled,
+  switchCooldownMs,
+  list,
+  size,
+  getStats,
+};
@@ -0,0 +1,143 @@
+const bus = require('./bus');
+const logger = require('./logger');
+
+// every username that is online, on this process or any other cluster
+// worker, with the address it connected from. in cluster mode the primary
+// owns the authoritative copy: claims and renames are decided there, and
+// every worker keeps a mirror that is updated through `roster` bus events
+// so has(), list() and find() stay local.
+//
+// onChange() handlers hear about every name that actually comes or goes,
+// once, whichever of the local call or the bus event gets here first.
+const names = new Map(); // username -> ip
+const byLowerCase = new Map(); // lowercased username -> username
+const changeHandlers = [];
+
+const notify = (change) => changeHandlers.forEach((handler) => handler(change));
+
+function add(name, ip) {
+  if (names.has(name)) return;
+  names.set(name, ip);
+  byLowerCase.set(name.toLowerCase(), name);
+  notify({ op: 'join', username: name });
+}
+
+function forget(name) {
+  if (!names.delete(name)) return false;
+  const lower = name.toLowerCase();
+  if (byLowerCase.get(lower) === name) byLowerCase.delete(lower);
+  return true;
+}
+
+function remove(name) {
+  if (!forget(name)) return;
+  notify({ op: 'leave', username: name });
+}
+
+function move(from, to, ip) {
+  if (!names.has(from)) return add(to, ip);
+  if (names.has(to)) return remove(from);
+  const fromIp = names.get(from);
+  forget(from);
+  names.set(to, fromIp);
+  byLowerCase.set(to.toLowerCase(), to);
+  notify({ op: 'rename', from, username: to });
+}
+
+if (bus.clustered) {
+  bus.subscribe('roster', ({ op, name, from, ip }) => {
+    if (op === 'add') add(name, ip);
+    if (op === 'remove') remove(name);
+    if (op === 'rename') move(from, name, ip);
+  });
+
+  bus.request('roster-snapshot')
+    .then((snapshot) => snapshot.forEach(([name, ip]) => add(name, ip)))
+    .catch((err) => logger.error('Roster sync error', { err }));
+}
+
+/**
+ * Reserve a username for a client connecting from `ip`.
+ * @returns {Promise<boolean>} false if someone already has it
+ */
+function claim(name, ip) {
+  if (!bus.clustered) {
+    if (names.has(name)) return Promise.resolve(false);
+    add(name, ip);
+    return Promise.resolve(true);
+  }
+
+  return bus.request('roster-claim', name, ip)
+    .then((ok) => {
+      if (ok) add(name, ip);
+      return ok;
+    })
+    .catch(() => false);
+}
+
+/**
+ * Move a reservation to a new username.
+ * @returns {Promise<boolean>} false if the new name is taken
+ */
+function rename(from, to) {
+  if (!bus.clustered) {
+    if (names.has(to)) return Promise.resolve(false);
+    move(from, to);
+    return Promise.resolve(true);
+  }
+
+  return bus.request('roster-rename', from, to)
+    .then((ok) => {
+      if (ok) move(from, to);
+      return ok;
+    })
+    .catch(() => false);
+}
+
+function release(name) {
+  remove(name);
+  if (bus.clustered) {
+    bus.request('roster-release', name).catch(() => {});
+  }
+}
+
+function has(name) {
+  return names.has(name);
+}
+
+function list() {
+  return Array.from(names.keys());
+}
+
+/**
+ * Look up an online user by name, ignoring case when there is no exact
+ * match.
+ * @returns {{ username: string, ip: string } | null}
+ */
+function find(name) {
+  const username = names.has(name) ? name : byLowerCase.get(name.toLowerCase());
+  return username === undefined ? null : { username, ip: names.get(username) };
+}
+
+function size() {
+  return names.size;
+}
+
+/**
+ * Call `handler({ op, username, from? })` for every join, leave and
+ * rename, in the order they happen here.
+ */
+function onChange(handler) {
+  changeHandlers.push(handler);
+}
+
+module.exports = {
+  claim,
+  rename,
+  release,
+  has,
+  list,
+  find,
+  size,
+  onChange,
+};
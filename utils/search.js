@@ -0,0 +1,183 @@
+const sqlite3 = require('sqlite3');
+const { dbPath, ready } = require('./db');
+const { DEFAULT_ROOM } = require('./rooms');
+const logger = require('./logger');
+
+// full-text search over chat history (the messages_fts table from db.js).
+// searches get their own read-only connection so that interrupting one
+// that ran over its time budget can never cancel a write, and they run
+// one at a time so the interrupt always lands on the query that earned it.
+
+const options = {
+  enabled: true,
+  timeBudgetMs: 250,  // a query still running after this is interrupted
+  pageSize: 10,       // results per page unless the client asks for fewer
+  maxResults: 200,    // deepest result (page * size) anyone can page to
+  maxQueued: 16,      // searches waiting their turn before new ones are refused
+};
+
+const stats = {
+  queries: 0,
+  interrupted: 0,
+  rejected: 0,
+  errors: 0,
+  lastQueryMs: 0,
+  maxQueryMs: 0,
+  totalQueryMs: 0,
+};
+
+let searchDb = null;
+let statement = null;
+let chain = Promise.resolve();
+let queued = 0;
+
+function configure(overrides = {}) {
+  for (const key of Object.keys(options)) {
+    if (overrides[key] !== undefined) options[key] = overrides[key];
+  }
+}
+
+function open() {
+  if (statement) return;
+
+  searchDb = new sqlite3.Database(dbPath, sqlite3.OPEN_READONLY);
+  searchDb.run('PRAGMA busy_timeout = 1000');
+  statement = searchDb.prepare(`
+    SELECT m.id, m.type, m.username, m.text, m.timestamp,
+           snippet(messages_fts, 0, '[', ']', '…', 12) AS snippet
+    FROM messages_fts
+    JOIN messages m ON m.id = messages_fts.rowid
+    WHERE messages_fts MATCH ? AND m.room = ?
+    ORDER BY rank
+    LIMIT ? OFFSET ?
+  `);
+}
+
+// user text becomes a list of quoted terms (all must match, the last one
+// as a prefix) so fts5 query syntax in it can't error or be abused
+function toMatchExpression(query) {
+  const terms = query
+    .split(/\s+/)
+    .map((term) => term.replace(/"/g, ''))
+    .filter(Boolean)
+    .slice(0, 8);
+
+  if (!terms.length) return null;
+
+  return terms
+    .map((term, i) => `"${term}"${i === terms.length - 1 ? '*' : ''}`)
+    .join(' ');
+}
+
+function run(match, room, limit, offset) {
+  return new Promise((resolve, reject) => {
+    const started = process.hrtime.bigint();
+    const timer = setTimeout(() => searchDb.interrupt(), options.timeBudgetMs);
+
+    statement.all([match, room, limit + 1, offset], (err, rows) => {
+      clearTimeout(timer);
+
+      const elapsedMs = Number(process.hrtime.bigint() - started) / 1e6;
+      stats.queries++;
+      stats.lastQueryMs = elapsedMs;
+      stats.maxQueryMs = Math.max(stats.maxQueryMs, elapsedMs);
+      stats.totalQueryMs += elapsedMs;
+
+      if (err) {
+        if (err.code === 'SQLITE_INTERRUPT') {
+          stats.interrupted++;
+          const timeout = new Error('Search took too long');
+          timeout.code = 'SEARCH_TIMEOUT';
+          return reject(timeout);
+        }
+        stats.errors++;
+        return reject(err);
+      }
+
+      resolve(rows);
+    });
+  });
+}
+
+/**
+ * Ranked full-text search over one room's chat messages.
+ * @param {string} query words to look for; all must match
+ * @param {object} [paging]
+ * @param {number} [paging.page] 1-based page number
+ * @param {number} [paging.limit] results per page
+ * @param {string} [paging.room] the room to search
+ * @returns {Promise<{results: object[], page: number, hasMore: boolean}>}
+ *   rejects with code SEARCH_DISABLED, SEARCH_BUSY or SEARCH_TIMEOUT
+ */
+function search(query, { page = 1, limit, room = DEFAULT_ROOM } = {}) {
+  const fail = (code, message) => {
+    const err = new Error(message);
+    err.code = code;
+    return Promise.reject(err);
+  };
+
+  if (!options.enabled) return fail('SEARCH_DISABLED', 'Search is disabled on this server');
+
+  const match = typeof query === 'string' ? toMatchExpression(query) : null;
+  if (!match) return Promise.resolve({ results: [], page: 1, hasMore: false });
+
+  if (queued >= options.maxQueued) {
+    stats.rejected++;
+    return fail('SEARCH_BUSY', 'Too many searches running');
+  }
+
+  const size = Math.min(Math.max(1, Math.floor(limit) || options.pageSize), options.pageSize);
+  const pageNumber = Math.max(1, Math.floor(page) || 1);
+  const offset = (pageNumber - 1) * size;
+
+  if (offset >= options.maxResults) {
+    return Promise.resolve({ results: [], page: pageNumber, hasMore: false });
+  }
+
+  // never page past maxResults, however the page size divides it
+  const pageSize = Math.min(size, options.maxResults - offset);
+
+  queued++;
+  const result = chain
+    .then(() => ready())
+    .then(() => {
+      open();
+      return run(match, room, pageSize, offset);
+    })
+    .then((rows) => {
+      const hasMore = rows.length > pageSize && offset + pageSize < options.maxResults;
+      return { results: rows.slice(0, pageSize), page: pageNumber, hasMore };
+    })
+    .finally(() => { queued--; });
+
+  chain = result.catch(() => {});
+  return result;
+}
+
+// what to tell the user when search() rejects
+function errorText(err) {
+  switch (err.code) {
+    case 'SEARCH_DISABLED': return 'Search is disabled on this server.';
+    case 'SEARCH_BUSY': return 'The server is busy. Please search again in a moment.';
+    case 'SEARCH_TIMEOUT': return 'That search took too long. Try more specific words.';
+    default:
+      logger.error('Search error', { err });
+      return 'Search failed due to a server error.';
+  }
+}
+
+function getStats() {
+  return {
+    ...stats,
+    enabled: options.enabled,
+    queued,
+    avgQueryMs: stats.queries ? stats.totalQueryMs / stats.queries : 0,
+  };
+}
+
+module.exports = {
+  configure,
+  search,
+  errorText,
+  getStats,
+};
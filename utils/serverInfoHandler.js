@@ -1,8 +1,30 @@
+const heartbeatMonitor = require('./heartbeatMonitor');
+const ipIndex = require('./ipIndex');
+const loginLimiter = require('./loginLimiter');
+const churnGuard = require('../middleware/churnGuard');
+const hashPool = require('./hashPool');
+const sessionCache = require('./sessionCache');
+const { getTotals } = require('../handlers/clusterRelay');
+const inboundRouter = require('../handlers/inboundRouter');
+const compression = require('./compression');
+const search = require('./search');
+const retention = require('./retention');
+const backpressure = require('./backpressure');
+const rooms = require('./rooms');
+const typing = require('./typing');
+const blocks = require('./blocks');
+const presence = require('./presence');
+const { authorized } = require('./metricsHandler');
+
 module.exports = (req, res, wss, settings) => {
   if (req.url !== '/info' && req.url !== '/server-info') {
     return false;
   }
 
+  const totals = getTotals(wss);
+  // slow clients and room names only for the metrics token holder
+  const detail = authorized(req, settings);
+
   const serverInfo = {
     serverName: settings.serverName,
     motd: settings.motd,
@@ -10,7 +32,15 @@ module.exports = (req, res, wss, settings) => {
 
     authentication: settings.authentication,
 
+    auth: settings.authentication
+      ? {
+          passwordHashing: hashPool.getStats(),
+          resumableSessions: sessionCache.size(),
+        }
+      : undefined,
+
     maxMessagesPerSecond: settings.maxMessagesPerSecond,
+    maxPayloadBytes: settings.maxPayloadBytes,
     nickChangeCooldown: settings.nickChangeCooldown,
 
     connectionLimits: {
@@ -23,8 +53,18 @@ module.exports = (req, res, wss, settings) => {
     heartbeat: {
       interval: settings.heartbeatInterval,
       timeout: settings.heartbeatTimeout,
+      sweep: heartbeatMonitor.getStats(),
     },
 
+    cluster: settings.cluster && settings.cluster.enabled
+      ? {
+          enabled: true,
+          workers: totals.workers,
+        }
+      : {
+          enabled: false
+        },
+
     webrtc: settings.webrtc
       ? {
           enabled: settings.webrtc.enabled,
@@ -37,12 +77,29 @@ module.exports = (req, res, wss, settings) => {
           enabled: false
         },
 
+    inbound: inboundRouter.getStats(),
+
+    compression: compression.getStats(),
+
+    backpressure: backpressure.getStats(wss, detail ? 5 : 0),
+
+    rooms: rooms.getStats(detail ? 10 : 0),
+    typing: typing.getStats(),
+    blocks: blocks.getStats(),
+    presence: presence.getStats(),
+
+    search: search.getStats(),
+    retention: retention.getStats(),
+
+    abuseProtection: {
+      trackedIPs: ipIndex.size(),
+      churnGuardEntries: churnGuard.size(),
+      loginLimiterEntries: loginLimiter.size(),
+    },
+
     currentStats: {
-      connectedUsers: wss.clients.size,
-      voiceParticipants:
-        wss.webrtcSFU && typeof wss.webrtcSFU.getParticipantCount === 'function'
-          ? wss.webrtcSFU.getParticipantCount()
-          : 0,
+      connectedUsers: totals.connectedUsers,
+      voiceParticipants: totals.voiceParticipants,
     }
   };
 
@@ -0,0 +1,38 @@
+const BoundedMap = require('./boundedMap');
+
+// recently verified logins, keyed by the session token the client was
+// given. a reconnecting client can present its previous token with /resume
+// and skip another bcrypt round. tokens are single use: resuming consumes
+// the old token and the new connection's token takes its place.
+const sessions = new BoundedMap({ maxEntries: 10000, ttlMs: 10 * 60 * 1000 });
+
+function configure({ maxEntries, ttlMs } = {}) {
+  if (maxEntries) sessions.maxEntries = maxEntries;
+  if (ttlMs) sessions.ttlMs = ttlMs;
+}
+
+function remember(token, username) {
+  sessions.set(token, username);
+}
+
+/**
+ * Consume a previously issued session token.
+ * @returns {string|null} the username it was issued to
+ */
+function take(token) {
+  const username = sessions.get(token);
+  if (username === undefined) return null;
+  sessions.delete(token);
+  return username;
+}
+
+function size() {
+  return sessions.size;
+}
+
+module.exports = {
+  configure,
+  remember,
+  take,
+  size,
+};
@@ -0,0 +1,107 @@
+// hashed timing wheel: items are bucketed by deadline into `slots` buckets
+// of `tickMs` each. a tick only visits the buckets that came due since the
+// last tick, so the cost is proportional to what expires, not to how many
+// items are scheduled. deadlines further out than one revolution simply
+// stay in their bucket until a later lap reaches them.
+class TimerWheel {
+  constructor({ tickMs = 1000, slots = 256, onExpire }) {
+    this.tickMs = tickMs;
+    this.slots = Array.from({ length: slots }, () => new Set());
+    this.onExpire = onExpire;
+    this.deadlines = new Map();
+    this.timer = null;
+    this.lastTick = Math.floor(Date.now() / tickMs);
+
+    this.stats = {
+      ticks: 0,
+      lastSwept: 0,
+      lastExpired: 0,
+      lastTickMs: 0,
+      maxTickMs: 0,
+      totalSwept: 0,
+      totalExpired: 0,
+    };
+  }
+
+  // round up so an item is always due by the time its bucket is visited;
+  // a deadline in a bucket that was already visited goes in the next one
+  slotFor(deadline) {
+    const tick = Math.max(Math.ceil(deadline / this.tickMs), this.lastTick + 1);
+    return tick % this.slots.length;
+  }
+
+  schedule(item, deadline) {
+    this.cancel(item);
+    const slot = this.slotFor(deadline);
+    this.deadlines.set(item, { deadline, slot });
+    this.slots[slot].add(item);
+    if (!this.timer) this.start();
+  }
+
+  cancel(item) {
+    const entry = this.deadlines.get(item);
+    if (!entry) return;
+    this.deadlines.delete(item);
+    this.slots[entry.slot].delete(item);
+  }
+
+  get size() {
+    return this.deadlines.size;
+  }
+
+  start() {
+    if (this.timer) return;
+    this.timer = setInterval(() => this.tick(), this.tickMs);
+    this.timer.unref();
+  }
+
+  stop() {
+    clearInterval(this.timer);
+    this.timer = null;
+  }
+
+  tick(now = Date.now()) {
+    const started = process.hrtime.bigint();
+    const currentTick = Math.floor(now / this.tickMs);
+
+    // a late timer can skip ticks; never walk more than one full lap
+    const from = Math.max(this.lastTick + 1, currentTick - this.slots.length + 1);
+
+    let swept = 0;
+    let expired = 0;
+
+    for (let t = from; t <= currentTick; t++) {
+      const slot = this.slots[t % this.slots.length];
+
+      for (const item of slot) {
+        swept++;
+        if (this.deadlines.get(item).deadline > now) continue;
+
+        slot.delete(item);
+        this.deadlines.delete(item);
+        expired++;
+        this.onExpire(item, now);
+      }
+    }
+
+    this.lastTick = currentTick;
+
+    const elapsedMs = Number(process.hrtime.bigint() - started) / 1e6;
+    const s = this.stats;
+    s.ticks++;
+    s.lastSwept = swept;
+    s.lastExpired = expired;
+    s.lastTickMs = elapsedMs;
+    s.maxTickMs = Math.max(s.maxTickMs, elapsedMs);
+    s.totalSwept += swept;
+    s.totalExpired += expired;
+
+    if (!this.deadlines.size) this.stop();
+  }
+
+  getStats() {
+    return { ...this.stats, scheduled: this.deadlines.size };
+  }
+}
+
+module.exports = TimerWheel;
@@ -0,0 +1,199 @@
+const bus = require('./bus');
+const rooms = require('./rooms');
+const metrics = require('./metrics');
+const backpressure = require('./backpressure');
+const blocks = require('./blocks');
+const { encode, sendFrame } = require('../handlers/broadcast');
+
+// who is typing in each room. typing frames from clients only update this
+// state; every intervalMs, each room whose typists changed gets one
+// `typing` frame listing them all, and rooms where people keep typing get
+// it again every refreshMs so clients don't expire them. a typist is
+// dropped expireMs after their last typing frame, or as soon as they
+// send a message, move rooms or disconnect.
+//
+// in cluster mode starts and stops cross the bus, so every worker knows
+// the whole room's typists and tells its own sockets.
+
+const OPEN = 1;
+
+const options = {
+  intervalMs: 500,   // most one room's typing list is sent
+  refreshMs: 4000,   // resend an unchanged list this often while anyone types
+  expireMs: 6000,    // a typist is forgotten this long after their last typing frame
+};
+
+const stats = {
+  updates: 0,
+  framesSent: 0,
+  dropped: 0,
+};
+
+const framesSent = metrics.counter('chat_typing_frames_total', 'Batched typing frames sent to clients');
+const typingDropped = metrics.counter('chat_typing_dropped_total', 'Typing frames not sent because the client was over its outbound high-water mark');
+
+// room -> { typists: Map(username -> { ip, expiresAt, publishedAt }), dirty, sentAt }
+const state = new Map();
+let timer = null;
+
+function configure(overrides = {}) {
+  for (const key of Object.keys(options)) {
+    if (overrides[key] !== undefined) options[key] = overrides[key];
+  }
+}
+
+function roomState(room) {
+  let entry = state.get(room);
+  if (!entry) {
+    entry = { typists: new Map(), dirty: false, sentAt: 0 };
+    state.set(room, entry);
+  }
+  return entry;
+}
+
+// one frame for everyone who sees the whole list. typists don't see
+// themselves and clients don't see people they blocked, so they get a
+// frame of their own; there are only ever a few of them. blocks are
+// looked up once per typist, not once per typist for every recipient
+function send(room, typists, now) {
+  const timestamp = new Date(now).toISOString();
+  const everyone = Array.from(typists.keys());
+  const highWaterMark = backpressure.highWaterMark();
+  let shared = null;
+
+  // typists that somebody has blocked, with who; usually none
+  const blocked = [];
+  for (const [username, typist] of typists) {
+    const blockers = blocks.blockersOf(typist.ip);
+    if (blockers) blocked.push([username, blockers]);
+  }
+
+  for (const client of rooms.membersOf(room)) {
+    if (client.readyState !== OPEN) continue;
+
+    if (client.bufferedAmount > highWaterMark) {
+      stats.dropped++;
+      typingDropped.inc();
+      continue;
+    }
+
+    let frame;
+    if (!typists.has(client.username) && !blocked.some(([, blockers]) => blockers.has(client.blockerKey))) {
+      if (!shared) shared = encode({ type: 'typing', room, users: everyone, timestamp });
+      frame = shared;
+    } else {
+      const hidden = new Set([client.username]);
+      for (const [username, blockers] of blocked) {
+        if (blockers.has(client.blockerKey)) hidden.add(username);
+      }
+      frame = encode({ type: 'typing', room, users: everyone.filter((username) => !hidden.has(username)), timestamp });
+    }
+
+    sendFrame(client, frame);
+    stats.framesSent++;
+    framesSent.inc();
+  }
+}
+
+function tick() {
+  const now = Date.now();
+
+  for (const [room, entry] of state) {
+    for (const [username, typist] of entry.typists) {
+      if (typist.expiresAt <= now) {
+        entry.typists.delete(username);
+        entry.dirty = true;
+      }
+    }
+
+    if (entry.dirty || (entry.typists.size && now - entry.sentAt >= options.refreshMs)) {
+      send(room, entry.typists, now);
+      entry.dirty = false;
+      entry.sentAt = now;
+    }
+
+    if (!entry.typists.size) state.delete(room);
+  }
+
+  if (!state.size) {
+    clearInterval(timer);
+    timer = null;
+  }
+}
+
+function schedule() {
+  if (timer) return;
+  timer = setInterval(tick, options.intervalMs);
+  timer.unref();
+}
+
+function start(room, username, ip, remote) {
+  const now = Date.now();
+  const entry = roomState(room);
+  let typist = entry.typists.get(username);
+
+  if (!typist) {
+    typist = { ip, expiresAt: 0, publishedAt: 0 };
+    entry.typists.set(username, typist);
+    entry.dirty = true;
+  }
+  typist.expiresAt = now + options.expireMs;
+
+  // other workers only need to hear about it often enough to not expire it
+  if (!remote && bus.clustered && now - typist.publishedAt >= options.refreshMs) {
+    typist.publishedAt = now;
+    bus.publish('typing', { op: 'start', room, username, ip });
+  }
+
+  schedule();
+}
+
+function stop(room, username, remote) {
+  const entry = state.get(room);
+  if (!entry || !entry.typists.delete(username)) return;
+  entry.dirty = true;
+
+  if (!remote && bus.clustered) bus.publish('typing', { op: 'stop', room, username });
+}
+
+bus.subscribe('typing', ({ op, room, username, ip }) => {
+  if (op === 'start') start(room, username, ip, true);
+  if (op === 'stop') stop(room, username, true);
+});
+
+/**
+ * A client sent a typing frame.
+ */
+function record(room, username, ip) {
+  if (!room || !username) return;
+  stats.updates++;
+  start(room, username, ip, false);
+}
+
+/**
+ * A client stopped typing: they sent their message, left the room or
+ * went away.
+ */
+function clear(room, username) {
+  if (!room || !username) return;
+  stop(room, username, false);
+}
+
+function getStats() {
+  let typing = 0;
+  for (const entry of state.values()) typing += entry.typists.size;
+
+  return {
+    ...stats,
+    intervalMs: options.intervalMs,
+    rooms: state.size,
+    typing,
+  };
+}
+
+module.exports = {
+  configure,
+  record,
+  clear,
+  getStats,
+};
@@ -0,0 +1,321 @@
+// compact binary encoding for clients that ask for it with ?encoding=compact
+// or the `chat.compact.v1` subprotocol. JSON stays the default.
+//
+// a frame is: version byte, type code byte (0 = type spelled out as a
+// string after it), then the rest of the message as a tagged map. map keys
+// that appear in KEYS are sent as one byte, and `timestamp` fields are sent
+// as epoch milliseconds. see docs/PROTOCOL.md for the full layout.
+//
+// TYPES and KEYS are part of the wire format: only ever append to them.
+
+const VERSION = 1;
+const SUBPROTOCOL = 'chat.compact.v1';
+
+const TYPES = [
+  null, // 0: spelled out
+  'chat',
+  'system',
+  'typing',
+  'history',
+  'session-token',
+  'heartbeat-config',
+  'pong',
+  'ping',
+  'webrtc-error',
+  'history-request',
+  'history-page',
+  'search-request',
+  'search-results',
+  'presence-snapshot',
+  'presence-delta',
+];
+
+const KEYS = [
+  null, // 0: spelled out
+  'type',
+  'username',
+  'text',
+  'timestamp',
+  'messages',
+  'token',
+  'content',
+  'interval',
+  'timeout',
+  'error',
+  'users',
+  'mediaTypes',
+  'participants',
+  'fromUsername',
+  'targetUsername',
+  'id',
+  'before_id',
+  'limit',
+  'has_more',
+  'query',
+  'page',
+  'results',
+  'snippet',
+  'room',
+  'changes',
+  'op',
+  'from',
+];
+
+const TAG = {
+  NULL: 0x00,
+  FALSE: 0x01,
+  TRUE: 0x02,
+  UINT: 0x03,
+  NEGINT: 0x04,
+  FLOAT: 0x05,
+  STRING: 0x06,
+  ARRAY: 0x07,
+  MAP: 0x08,
+  TIMESTAMP: 0x09,
+};
+
+const typeCodes = new Map(TYPES.map((t, i) => [t, i]));
+const keyCodes = new Map(KEYS.map((k, i) => [k, i]));
+
+// sqlite's CURRENT_TIMESTAMP style, which is utc without saying so
+const SQL_TIMESTAMP = /^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$/;
+
+const toEpochMs = (value) => {
+  if (typeof value === 'number') return Number.isSafeInteger(value) && value >= 0 ? value : NaN;
+  if (typeof value !== 'string') return NaN;
+  return Date.parse(SQL_TIMESTAMP.test(value) ? `${value.replace(' ', 'T')}Z` : value);
+};
+
+class Writer {
+  constructor(size = 256) {
+    this.buf = Buffer.allocUnsafe(size);
+    this.pos = 0;
+  }
+
+  ensure(n) {
+    if (this.pos + n <= this.buf.length) return;
+    let size = this.buf.length * 2;
+    while (size < this.pos + n) size *= 2;
+    const next = Buffer.allocUnsafe(size);
+    this.buf.copy(next, 0, 0, this.pos);
+    this.buf = next;
+  }
+
+  byte(b) {
+    this.ensure(1);
+    this.buf[this.pos++] = b;
+  }
+
+  // unsigned LEB128; arithmetic instead of bit ops so it's good to 2^53
+  varint(n) {
+    this.ensure(8);
+    while (n >= 0x80) {
+      this.buf[this.pos++] = (n % 0x80) | 0x80;
+      n = Math.floor(n / 0x80);
+    }
+    this.buf[this.pos++] = n;
+  }
+
+  float(n) {
+    this.ensure(8);
+    this.buf.writeDoubleBE(n, this.pos);
+    this.pos += 8;
+  }
+
+  string(s) {
+    const len = Buffer.byteLength(s);
+    this.varint(len);
+    this.ensure(len);
+    this.buf.write(s, this.pos, len, 'utf8');
+    this.pos += len;
+  }
+
+  finish() {
+    return this.buf.subarray(0, this.pos);
+  }
+}
+
+function writeValue(w, value) {
+  if (value === null || value === undefined) {
+    w.byte(TAG.NULL);
+  } else if (value === false) {
+    w.byte(TAG.FALSE);
+  } else if (value === true) {
+    w.byte(TAG.TRUE);
+  } else if (typeof value === 'number') {
+    if (Number.isSafeInteger(value)) {
+      w.byte(value < 0 ? TAG.NEGINT : TAG.UINT);
+      w.varint(Math.abs(value));
+    } else {
+      w.byte(TAG.FLOAT);
+      w.float(value);
+    }
+  } else if (typeof value === 'string') {
+    w.byte(TAG.STRING);
+    w.string(value);
+  } else if (Array.isArray(value)) {
+    w.byte(TAG.ARRAY);
+    w.varint(value.length);
+    for (const item of value) writeValue(w, item);
+  } else if (typeof value === 'object') {
+    writeMap(w, value);
+  } else {
+    w.byte(TAG.NULL);
+  }
+}
+
+function writeMap(w, obj, skipKey) {
+  const keys = Object.keys(obj).filter((k) => k !== skipKey && obj[k] !== undefined);
+
+  w.byte(TAG.MAP);
+  w.varint(keys.length);
+
+  for (const key of keys) {
+    const code = keyCodes.get(key);
+    if (code) {
+      w.byte(code);
+    } else {
+      w.byte(0);
+      w.string(key);
+    }
+
+    const ms = key === 'timestamp' ? toEpochMs(obj[key]) : NaN;
+    if (Number.isNaN(ms)) {
+      writeValue(w, obj[key]);
+    } else {
+      w.byte(TAG.TIMESTAMP);
+      w.varint(ms);
+    }
+  }
+}
+
+/**
+ * Encode a message object as a compact binary frame.
+ * @returns {Buffer}
+ */
+function encode(message) {
+  const w = new Writer();
+  const code = typeCodes.get(message.type);
+
+  w.byte(VERSION);
+  if (code) {
+    w.byte(code);
+  } else {
+    w.byte(0);
+    w.string(String(message.type));
+  }
+  writeMap(w, message, 'type');
+
+  return w.finish();
+}
+
+class Reader {
+  constructor(buf) {
+    this.buf = buf;
+    this.pos = 0;
+  }
+
+  byte() {
+    if (this.pos >= this.buf.length) throw new Error('Truncated frame');
+    return this.buf[this.pos++];
+  }
+
+  varint() {
+    let n = 0;
+    let scale = 1;
+    for (;;) {
+      const b = this.byte();
+      n += (b & 0x7f) * scale;
+      if (b < 0x80) return n;
+      scale *= 0x80;
+      if (scale > Number.MAX_SAFE_INTEGER) throw new Error('Varint too long');
+    }
+  }
+
+  float() {
+    if (this.pos + 8 > this.buf.length) throw new Error('Truncated frame');
+    const n = this.buf.readDoubleBE(this.pos);
+    this.pos += 8;
+    return n;
+  }
+
+  string() {
+    const len = this.varint();
+    if (this.pos + len > this.buf.length) throw new Error('Truncated frame');
+    const s = this.buf.toString('utf8', this.pos, this.pos + len);
+    this.pos += len;
+    return s;
+  }
+}
+
+function readValue(r) {
+  const tag = r.byte();
+  switch (tag) {
+    case TAG.NULL: return null;
+    case TAG.FALSE: return false;
+    case TAG.TRUE: return true;
+    case TAG.UINT: return r.varint();
+    case TAG.NEGINT: return -r.varint();
+    case TAG.FLOAT: return r.float();
+    case TAG.STRING: return r.string();
+    case TAG.TIMESTAMP: return r.varint();
+    case TAG.ARRAY: {
+      const count = r.varint();
+      const out = [];
+      for (let i = 0; i < count; i++) out.push(readValue(r));
+      return out;
+    }
+    case TAG.MAP: return readMapBody(r);
+    default: throw new Error(`Unknown tag 0x${tag.toString(16)}`);
+  }
+}
+
+function readMapBody(r) {
+  const count = r.varint();
+  const out = {};
+  for (let i = 0; i < count; i++) {
+    const code = r.byte();
+    const key = code ? KEYS[code] : r.string();
+    if (!key) throw new Error(`Unknown key code ${code}`);
+    out[key] = readValue(r);
+  }
+  return out;
+}
+
+/**
+ * Decode a compact frame back into a message object.
+ * Throws on anything malformed.
+ */
+function decode(buf) {
+  const r = new Reader(buf);
+
+  const version = r.byte();
+  if (version !== VERSION) throw new Error(`Unsupported compact version ${version}`);
+
+  const code = r.byte();
+  const type = code ? TYPES[code] : r.string();
+  if (!type) throw new Error(`Unknown type code ${code}`);
+
+  if (r.byte() !== TAG.MAP) throw new Error('Frame body must be a map');
+  const message = readMapBody(r);
+  if (r.pos !== buf.length) throw new Error('Trailing bytes in frame');
+
+  return { type, ...message };
+}
+
+/**
+ * Pick the encoding a client asked for during the handshake.
+ * @returns {'compact'|'json'}
+ */
+function negotiate(req, protocol) {
+  if (protocol === SUBPROTOCOL) return 'compact';
+  const { query } = require('url').parse(req.url, true);
+  return query.encoding === 'compact' ? 'compact' : 'json';
+}
+
+module.exports = {
+  SUBPROTOCOL,
+  encode,
+  decode,
+  negotiate,
+};